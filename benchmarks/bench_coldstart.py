@@ -0,0 +1,96 @@
+"""
+Benchmark: cold-start cost of a fresh server process.
+  - import time of ui_bot.py (what every new process pays before the first page),
+  - first page render and first chat turn through AppTest, against the load-test fakes
+    (fake Firestore seeded with a knowledge base, streaming Gemini fake),
+    optionally waiting for the background warm-up to finish before the first message
+    (the time a user spends reading the page and typing).
+Every measurement runs in its own subprocess so nothing is already imported or cached.
+
+Usage: python benchmarks/bench_coldstart.py [--app-dir .] [--kb 2000] [--runs 3] [--think-s 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import sys, time, warnings
+warnings.filterwarnings("ignore")
+sys.path.insert(0, {app_dir!r})
+started = time.perf_counter()
+import ui_bot
+print(round((time.perf_counter() - started) * 1000, 1))
+"""
+
+TURN_PROBE = """
+import json, os, random, sys, tempfile, time, warnings
+warnings.filterwarnings("ignore")
+sys.path.insert(0, {bench_dir!r})
+import loadtest
+from noor_fakes import FakeFirestore
+from synthetic import make_corpus
+sys.path.insert(0, {app_dir!r})
+from streamlit.testing.v1 import AppTest
+
+db = FakeFirestore()
+loadtest.seed_firestore(db, make_corpus({kb}), ["Noor-COLD"], 20, random.Random(1))
+loadtest.install_fakes(db, 0, 0, 3, 24, 0)
+loadtest.configure_env(tempfile.mkdtemp())
+at = AppTest.from_file(os.path.join({app_dir!r}, "ui_bot.py"), default_timeout=300)
+at.query_params["uid"] = "Noor-COLD"
+started = time.perf_counter()
+at.run()
+first_page_ms = (time.perf_counter() - started) * 1000
+time.sleep({think_s})
+started = time.perf_counter()
+at.chat_input[0].set_value("নামাজ topic3 কিভাবে পড়ব?").run()
+first_turn_ms = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+at.chat_input[0].set_value("রোজা topic5").run()
+second_turn_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{"first_page_ms": first_page_ms, "first_turn_ms": first_turn_ms, "second_turn_ms": second_turn_ms,
+                  "exceptions": len(at.exception)}}))
+"""
+
+
+def probe(code):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, timeout=600)
+    lines = [line for line in result.stdout.splitlines() if line.strip()]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(result.stderr[-2000:])
+    return lines[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI cold-start benchmark")
+    parser.add_argument("--app-dir", default=ROOT, help="checkout whose ui_bot.py is measured")
+    parser.add_argument("--kb", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--think-s", type=float, default=5.0, help="pause between first paint and first message")
+    args = parser.parse_args(argv)
+    app_dir = os.path.abspath(args.app_dir)
+
+    imports = [float(probe(IMPORT_PROBE.format(app_dir=app_dir))) for _ in range(args.runs)]
+    print(f"import ui_bot    | median {statistics.median(imports):7.0f} ms | runs {imports}")
+
+    turns = [
+        json.loads(probe(TURN_PROBE.format(
+            bench_dir=os.path.join(ROOT, "benchmarks"), app_dir=app_dir, kb=args.kb, think_s=args.think_s,
+        )))
+        for _ in range(args.runs)
+    ]
+    for field in ("first_page_ms", "first_turn_ms", "second_turn_ms"):
+        values = [round(t[field]) for t in turns]
+        print(f"{field:<16} | median {statistics.median(values):7.0f} ms | runs {values}")
+    if any(t["exceptions"] for t in turns):
+        print("app exceptions:", [t["exceptions"] for t in turns])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: recall@k and latency for Banglish / misspelled queries.
+Compares the old substring matcher, BM25 and the char n-gram TF-IDF index on a
+synthetic corpus where every article carries one unique Bangla keyword and one
+unique English keyword.
+
+Usage: python benchmarks/bench_ngram.py [corpus_size] [queries]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_retrieval import legacy_scan
+from noor_retrieval import CharNgramIndex, KnowledgeIndex, hybrid_search, transliterate
+from synthetic import FILLER_BN, FILLER_EN
+
+BN_SYLLABLES = ["কা", "রি", "মু", "সা", "লে", "তো", "না", "দি", "বা", "হা", "জা", "ফি", "রু", "মা", "শা", "কু"]
+EN_SYLLABLES = ["pel", "vor", "gut", "wes", "cap", "tril", "bom", "nex", "quo", "fy", "dro", "plen", "sim", "gak", "zor", "hev"]
+
+
+def make_keyword_corpus(n, rng):
+    seen, articles = set(), []
+    while len(articles) < n:
+        bn = "".join(rng.choice(BN_SYLLABLES) for _ in range(4)) + "ন"
+        en = "".join(rng.choice(EN_SYLLABLES) for _ in range(4)) + "a"
+        if bn in seen or en in seen:
+            continue
+        seen.update((bn, en))
+        filler = " ".join(rng.choice(FILLER_BN + FILLER_EN) for _ in range(80))
+        articles.append({"id": f"doc-{len(articles)}", "title": bn, "content": f"{bn} {en} {filler}", "_bn": bn, "_en": en})
+    return articles
+
+
+def typo(word, rng):
+    i = rng.randrange(1, len(word) - 1)
+    op = rng.choice(("swap", "drop", "double"))
+    if op == "swap":
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    if op == "drop":
+        return word[:i] + word[i + 1:]
+    return word[:i] + word[i] + word[i:]
+
+
+def make_queries(articles, count, rng):
+    queries = []
+    for article in rng.sample(articles, count):
+        queries.append(("banglish", f"{transliterate(article['_bn'])} ki", article["id"]))
+        queries.append(("typo", f"what is {typo(article['_en'], rng)}", article["id"]))
+    return queries
+
+
+def evaluate(name, search, queries, k=2):
+    hits, kinds = {}, {}
+    started = time.perf_counter()
+    for kind, query, expected in queries:
+        found = search(query, k)
+        hits[kind] = hits.get(kind, 0) + (expected in found)
+        kinds[kind] = kinds.get(kind, 0) + 1
+    ms = (time.perf_counter() - started) * 1000 / len(queries)
+    recall = "  ".join(f"{kind} {hits[kind] / kinds[kind]:.2f}" for kind in sorted(kinds))
+    print(f"{name:<8} | recall@{k}: {recall} | {ms:8.3f} ms/q")
+
+
+def legacy_ids(articles, query):
+    context = legacy_scan(articles, query)
+    titles = [line[len("SOURCE ARTICLE ["):-2] for line in context.splitlines() if line.startswith("SOURCE ARTICLE [")]
+    by_title = {a["title"]: a["id"] for a in articles}
+    return [by_title[t] for t in titles if t in by_title]
+
+
+def main(size=5_000, count=200):
+    rng = random.Random(3)
+    articles = make_keyword_corpus(size, rng)
+    queries = make_queries(articles, count, rng)
+    bm25 = KnowledgeIndex.build(articles)
+
+    started = time.perf_counter()
+    ngram = CharNgramIndex.build(articles)
+    build_s = time.perf_counter() - started
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "kb_ngrams.npz")
+        ngram.save(path)
+        started = time.perf_counter()
+        CharNgramIndex.load(path, articles)
+        load_s = time.perf_counter() - started
+        size_mb = os.path.getsize(path) / 1e6
+    print(f"corpus {size} | n-gram build {build_s:.2f} s | mmap load {load_s:.2f} s | file {size_mb:.1f} MB | nnz {len(ngram.data)}")
+
+    evaluate("legacy", lambda q, k: legacy_ids(articles, q), queries)
+    evaluate("bm25", lambda q, k: [a["id"] for a in bm25.search(q, k)], queries)
+    evaluate("ngram", lambda q, k: [a["id"] for a in ngram.search(q, k)], queries)
+    evaluate("hybrid", lambda q, k: [a["id"] for a in hybrid_search(bm25, ngram, q, k)], queries)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,150 @@
+"""
+Benchmark: system-instruction caching and per-source input tokens, fully offline.
+An InstructionCache runs against FakeCacheClient on a simulated clock: hours of
+chat turns sent through KeyPool/send_with_failover over several keys, caches the
+provider drops early (the real 404 must not bench a key), and a client that
+refuses caching altogether (the inline-instruction fallback). Then
+synthetic conversations go through the ContextAssembler and every turn's input
+is broken down by source, with and without the cached instruction.
+
+Usage: python benchmarks/bench_prompt.py [--hours 6] [--keys 2] [--turn-s 20] [--turns 40]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from noor_context import ContextAssembler
+from noor_core import CHAT_MODEL, system_instruction
+from noor_fakes import FakeCacheClient
+from noor_keys import KeyPool, send_with_failover, settle
+from noor_prompt import InstructionCache, input_breakdown, print_summary, summarize_reports
+from synthetic import make_corpus, make_queries
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def drain(cache):
+    # Refreshes run on background threads; wait for them so the simulated clock stays in step.
+    while cache._pending:
+        time.sleep(0.001)
+
+
+class FakeModel:
+    # Answers like a chat model built on `cached_content`; a cache the provider dropped raises its real 404.
+    def __init__(self, client, cached_content):
+        self.client = client
+        self.cached_content = cached_content
+
+    def answer(self):
+        if self.cached_content:
+            self.client._live(self.cached_content)
+        return "ok"
+
+
+class FakeChat:
+    def __init__(self):
+        self.model = None
+
+    def send_message(self, prompt, **kwargs):
+        return self.model.answer()
+
+
+def simulate(name, args, fail=None, drop_at=None):
+    clock = Clock()
+    clients = {}
+
+    def client_for_key(api_key):
+        clients[api_key] = FakeCacheClient(clock=clock, fail=fail)
+        return clients[api_key]
+
+    cache = InstructionCache(CHAT_MODEL, system_instruction, client_for_key, ttl=args.ttl_s,
+                             retry_after=args.retry_s, clock=clock)
+    # No rate limits: the pool is here for its failover and circuit breaker, as in ChatTurn.send.
+    pool = KeyPool([f"key-{i}" for i in range(args.keys)], rpm=10**9, tpm=10**12, client_factory=lambda key: None)
+    misses = []
+
+    def on_cache_miss(api_key):
+        misses.append(api_key)
+        cache.invalidate(api_key)
+
+    def model_for_key(api_key):
+        cache._client(api_key)
+        return FakeModel(clients[api_key], cache.name(api_key))
+
+    turns = int(args.hours * 3600 / args.turn_s)
+    cached_turns = 0
+    for i in range(turns):
+        if i == drop_at:
+            for client in clients.values():
+                client.caches.clear()  # The provider evicts every cache early.
+        chat = FakeChat()
+        response, lease = send_with_failover(pool, chat, "question", model_for_key, on_cache_miss=on_cache_miss)
+        settle(pool, lease)
+        assert response == "ok" and lease.state.state(time.monotonic()) == "closed", pool.stats()
+        cached_turns += bool(chat.model.cached_content)
+        drain(cache)
+        clock.now += args.turn_s
+    stats = cache.stats()
+    assert all(row["state"] == "closed" for row in pool.stats()), pool.stats()
+    calls = {kind: sum(c.calls[kind] for c in clients.values()) for kind in ("create", "update")}
+    print(
+        f"{name:<9} | {turns} turns over {args.hours:g} h on {args.keys} keys | cached {cached_turns / turns * 100:5.1f}%"
+        f" | creates {calls['create']} extends {calls['update']} failed {stats['failed']} misses {len(misses)}"
+        f" | live {stats['live_caches']} | keys benched {sum(row['benched'] for row in pool.stats())}"
+    )
+
+
+def conversation(articles, queries, turns, rng):
+    recent = []
+    for question, _ in queries[:turns]:
+        picks = rng.sample(articles, 3)
+        yield question, picks, list(recent)
+        recent.append({"user": question, "ai": " ".join(rng.choice(articles)["content"].split()[:80])})
+
+
+def breakdown(args):
+    articles = make_corpus(200)
+    queries = make_queries(articles, count=args.turns)
+    assembler = ContextAssembler()
+    instruction_tokens = InstructionCache(CHAT_MODEL, system_instruction, None).instruction_tokens
+    for cached in (False, True):
+        reports = []
+        # The same conversation both times; only the instruction's billing differs.
+        for question, picks, recent in conversation(articles, queries, args.turns, random.Random(5)):
+            packed = assembler.assemble(question, system_info="[SYSTEM INFO: Bangladesh time 10:30 AM]",
+                                        core_memory="[CORE MEMORY: name Rahim, lives in Dhaka]",
+                                        articles=picks, turns=recent)
+            reports.append(input_breakdown(instruction_tokens, packed.sections, cached=cached))
+        print(f"\n--- instruction {'cached' if cached else 'inline'} ---")
+        print_summary(summarize_reports(reports))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Noor-AI prompt caching benchmark")
+    parser.add_argument("--hours", type=float, default=6)
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--turn-s", type=float, default=20)
+    parser.add_argument("--ttl-s", type=float, default=3600)
+    parser.add_argument("--retry-s", type=float, default=1800)
+    parser.add_argument("--turns", type=int, default=40)
+    args = parser.parse_args()
+
+    simulate("cached", args)
+    simulate("dropped", args, drop_at=500)
+    simulate("refused", args, fail="400 CachedContent is not supported for this model or tier")
+    breakdown(args)
+
+
+if __name__ == "__main__":
+    main()
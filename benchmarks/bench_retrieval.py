@@ -0,0 +1,63 @@
+"""
+Benchmark: full-collection substring scan (old `get_knowledge_from_firebase`)
+vs the in-memory BM25 index, at 1k / 10k / 100k articles.
+
+The scan numbers exclude Firestore network time, so they are a lower bound for
+the old path, which also read every document over the network per message.
+
+Usage: python benchmarks/bench_retrieval.py [sizes...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from noor_retrieval import KnowledgeIndex
+from synthetic import make_corpus, make_queries
+
+
+def legacy_scan(articles, query):
+    context_data = ""
+    query_words = query.lower().split()
+    found_count = 0
+    for data in articles:
+        content = data.get("content", "")
+        title = data.get("title", "")
+        if any(word in content.lower() for word in query_words if len(word) > 3):
+            context_data += f"SOURCE ARTICLE [{title}]:\n{content}\n\n"
+            found_count += 1
+            if found_count >= 2: break
+    return context_data
+
+
+def run(size):
+    articles = make_corpus(size)
+    queries = make_queries(articles)
+
+    started = time.perf_counter()
+    for query, _ in queries:
+        legacy_scan(articles, query)
+    scan_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    started = time.perf_counter()
+    index = KnowledgeIndex.build(articles)
+    build_s = time.perf_counter() - started
+
+    hits = 0
+    started = time.perf_counter()
+    for query, expected in queries:
+        results = index.search(query, k=2)
+        hits += any(a["id"] == expected for a in results)
+    index_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    print(f"{size:>8} | scan {scan_ms:9.3f} ms/q | index {index_ms:7.3f} ms/q "
+          f"| speedup {scan_ms / max(index_ms, 1e-9):8.1f}x | build {build_s:6.2f} s "
+          f"| docs read/q {size} -> 0 | recall@2 {hits / len(queries):.2f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    for size in sizes:
+        run(size)
@@ -0,0 +1,135 @@
+"""
+Benchmark: queueing fairness and load shedding of the model scheduler.
+A fake slow model (time to first token + a fixed streaming time) sits behind a
+FairScheduler with a small concurrency cap. One chatty user keeps several tabs
+firing back to back while regular users ask a question now and then. The same
+traffic runs through a single shared queue (plain FIFO) for comparison, then a
+burst of simultaneous requests shows how fast refused requests are answered.
+
+Usage: python benchmarks/bench_scheduler.py [--slots 4] [--model-ms 400] [--users 8]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from noor_scheduler import FairScheduler, Overloaded
+
+
+def fake_model(seconds):
+    # Stand-in for send_message(stream=True) plus draining the stream.
+    time.sleep(seconds)
+
+
+def pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_traffic(name, scheduler, lane, args):
+    waits = {"chatty": [], "regular": []}
+    shed = {"chatty": 0, "regular": 0}
+    lock = threading.Lock()
+
+    def one(kind, uid):
+        started = time.perf_counter()
+        try:
+            with scheduler.slot(lane(uid)):
+                waited = (time.perf_counter() - started) * 1000
+                fake_model(args.model_ms / 1000)
+        except Overloaded:
+            with lock:
+                shed[kind] += 1
+            return
+        with lock:
+            waits[kind].append(waited)
+
+    def chatty_tab():
+        for _ in range(args.chatty_requests):
+            one("chatty", "Noor-CHATTY")
+
+    def regular(i):
+        time.sleep(0.05 * i)
+        for _ in range(args.regular_requests):
+            one("regular", f"Noor-USER{i:02d}")
+            time.sleep(args.think_ms / 1000)
+
+    threads = [threading.Thread(target=chatty_tab) for _ in range(args.chatty_tabs)]
+    threads += [threading.Thread(target=regular, args=(i,)) for i in range(args.users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for kind in ("regular", "chatty"):
+        values = waits[kind]
+        print(
+            f"{name:<5} {kind:<8} | served {len(values):4d} | shed {shed[kind]:3d} | wait p50 {pct(values, 0.5):7.0f}"
+            f" p95 {pct(values, 0.95):7.0f} max {max(values or [0]):7.0f} ms"
+        )
+    print(f"{name:<5} total    | {elapsed:5.1f} s wall\n")
+
+
+def run_burst(args):
+    scheduler = FairScheduler(max_concurrent=args.slots, max_queue=args.slots * 4, deadline=args.deadline_s,
+                              service_time=args.model_ms / 1000)
+    refused, served = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            with scheduler.slot(f"Noor-BURST{i:03d}"):
+                fake_model(args.model_ms / 1000)
+            outcome = served
+        except Overloaded:
+            outcome = refused
+        with lock:
+            outcome.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(args.burst)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = scheduler.stats()
+    print(
+        f"burst of {args.burst}: served {len(served)}, refused {len(refused)} "
+        f"(refusal p50 {statistics.median(refused) if refused else 0:.1f} ms, served p95 {pct(served, 0.95):.0f} ms) | "
+        f"queue_full {stats['shed_queue_full']} deadline {stats['shed_deadline']} timeout {stats['shed_timeout']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Noor-AI scheduler benchmark")
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--model-ms", type=float, default=400)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--regular-requests", type=int, default=3)
+    parser.add_argument("--think-ms", type=float, default=300)
+    parser.add_argument("--chatty-tabs", type=int, default=8)
+    parser.add_argument("--chatty-requests", type=int, default=5)
+    parser.add_argument("--deadline-s", type=float, default=30)
+    parser.add_argument("--burst", type=int, default=100)
+    args = parser.parse_args()
+
+    def build(per_uid):
+        return FairScheduler(max_concurrent=args.slots, max_queue=1000, max_queue_per_uid=per_uid,
+                             deadline=args.deadline_s, service_time=args.model_ms / 1000)
+
+    # FIFO: everyone shares one lane. Fair: one lane per uid, served round-robin.
+    run_traffic("fifo", build(1000), lambda uid: "shared", args)
+    run_traffic("fair", build(args.chatty_tabs), lambda uid: uid, args)
+    run_burst(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: server-side render calls and bytes sent while streaming one answer.
+Compares the old `write_stream` path (one markdown re-render of the whole answer
+per chunk) with the coalescing StreamRenderer, on a fake Gemini chunk generator
+that emits a long Bangla answer at a steady rate.
+
+Usage: python benchmarks/bench_streaming.py [chunks] [chunk_interval_ms]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from noor_streaming import CURSOR, StreamRenderer
+from synthetic import FILLER_BN, FILLER_EN
+
+
+class CountingPlaceholder:
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+
+    def markdown(self, body):
+        # Every markdown() call ships the full body to the browser as a new delta.
+        self.calls += 1
+        self.bytes += len(body.encode("utf-8"))
+
+
+def fake_chunks(count, interval, rng):
+    for _ in range(count):
+        time.sleep(interval)
+        words = [rng.choice(FILLER_BN if rng.random() < 0.8 else FILLER_EN) for _ in range(rng.randint(2, 6))]
+        yield " ".join(words) + " "
+
+
+def legacy_render(placeholder, chunks):
+    # Mirrors st.write_stream: cumulative text per chunk, cursor from the second chunk on.
+    text, first = "", True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        text += chunk
+        placeholder.markdown(text + ("" if first else CURSOR))
+        first = False
+    placeholder.markdown(text)
+    return text
+
+
+def run(name, render, count, interval):
+    placeholder = CountingPlaceholder()
+    started = time.perf_counter()
+    text = render(placeholder, fake_chunks(count, interval, random.Random(5)))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:<10} | render calls {placeholder.calls:5d} | sent {placeholder.bytes / 1e6:7.2f} MB"
+        f" | answer {len(text.encode('utf-8')) / 1e3:6.1f} KB | wall {elapsed:5.2f} s"
+    )
+    return placeholder
+
+
+def main(count=400, interval_ms=10):
+    interval = interval_ms / 1000
+    legacy = run("legacy", legacy_render, count, interval)
+    renderer_stats = {}
+
+    def coalesced(placeholder, chunks):
+        renderer = StreamRenderer(placeholder)
+        text = renderer.render(chunks)
+        renderer_stats.update(renderer.stats)
+        return text
+
+    coalesced_ph = run("coalesced", coalesced, count, interval)
+    print(
+        f"reduction  | render calls x{legacy.calls / coalesced_ph.calls:.1f} | bytes x{legacy.bytes / coalesced_ph.bytes:.1f}"
+        f" | ttft {renderer_stats['ttft_ms']} ms | {renderer_stats['tokens_per_s']} tokens/s"
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
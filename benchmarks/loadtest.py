@@ -0,0 +1,256 @@
+"""
+Load test: drives the real ui_bot.py through Streamlit's AppTest with many
+concurrent simulated users, against local stand-ins only:
+  - the in-memory Firestore fake (noor_fakes), seeded with N articles and M chats per user,
+  - a streaming Gemini fake with configurable time-to-first-token, chunk delay and chunk size,
+  - a stubbed aladhan.com Hijri lookup.
+Everything shares one process, like one Streamlit server, so st.cache_resource
+singletons (indexes, key pool, chat writer) are shared exactly as in production.
+
+Reports per scenario: p50/p95/p99 rerun latency for a chat turn, bootstrap latency,
+time to first token, Firestore reads per message and per bootstrap, and traced
+memory per session.
+
+Usage: python benchmarks/loadtest.py [--users 8] [--messages 3] [--kb 200,2000] [--history 20,200]
+                                     [--ttft-ms 300] [--chunk-ms 20] [--chunks 40] [--chunk-chars 24]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+warnings.filterwarnings("ignore")
+
+import firebase_admin
+import google.generativeai as genai
+from firebase_admin import firestore
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+from streamlit.testing.v1 import AppTest
+
+import noor_hijri
+from noor_fakes import FakeFirestore
+from synthetic import FILLER_BN, FILLER_EN, make_corpus
+
+APP_PATH = os.path.join(ROOT, "ui_bot.py")
+
+
+# --- 1. STAND-INS ---
+def seed_firestore(db, articles, users, history, rng):
+    batch_time = datetime.now(timezone.utc) - timedelta(days=30)
+    for article in articles:
+        db.collection("knowledge_base").document(article["id"]).set({
+            "title": article["title"], "content": article["content"], "updated_at": batch_time,
+        })
+    for uid in users:
+        for i in range(history):
+            words = " ".join(rng.choice(FILLER_BN + FILLER_EN) for _ in range(25))
+            db.collection("chats").add({
+                "uid": uid, "user": f"question {i} {words}", "ai": f"answer {i} {words} {words}",
+                "core_tags": [], "timestamp": batch_time + timedelta(minutes=i),
+            })
+    db.reads = db.writes = 0
+
+
+def install_fakes(db, ttft_ms, chunk_ms, chunks, chunk_chars, hijri_ms):
+    firebase_admin._apps["[DEFAULT]"] = object()
+    firestore.client = lambda *args, **kwargs: db
+
+    def chunk_stream():
+        time.sleep(ttft_ms / 1000)
+        rng = random.Random()
+        for i in range(chunks):
+            if i:
+                time.sleep(chunk_ms / 1000)
+            text = "".join(rng.choice(FILLER_BN) + " " for _ in range(max(1, chunk_chars // 6)))
+            yield protos.GenerateContentResponse(candidates=[{"content": {"parts": [{"text": text}], "role": "model"}}])
+
+    def fake_generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            return generation_types.GenerateContentResponse.from_iterator(chunk_stream())
+        text = "".join(part.candidates[0].content.parts[0].text for part in chunk_stream())
+        return generation_types.GenerateContentResponse.from_response(
+            protos.GenerateContentResponse(candidates=[{"content": {"parts": [{"text": text}], "role": "model"}}])
+        )
+
+    genai.GenerativeModel.generate_content = fake_generate_content
+
+    def fake_aladhan(day, timeout=3):
+        time.sleep(hijri_ms / 1000)
+        return noor_hijri.gregorian_to_hijri(day, 0)
+
+    noor_hijri.fetch_aladhan = fake_aladhan
+
+
+def share_runtime():
+    # AppTest installs a mock Runtime per run and clears it afterwards, which breaks concurrent runs.
+    # Install one shared mock and point AppTest at a shim so its per-run set/reset is a no-op.
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = type("SharedRuntimeShim", (), {"_instance": runtime})
+
+
+def configure_env(workdir):
+    os.environ.update({
+        "KB_SNAPSHOT_PATH": os.path.join(workdir, "knowledge_base.json"),
+        "NGRAM_INDEX_PATH": os.path.join(workdir, "kb_ngrams.npz"),
+        "CHAT_JOURNAL_PATH": os.path.join(workdir, "chat_journal.jsonl"),
+        "TRACE_LOG_PATH": os.path.join(workdir, "traces.jsonl"),
+        "METRICS_PROM_PATH": os.path.join(workdir, "metrics.prom"),
+        "KB_SYNC_INTERVAL": "3600",
+        "GEMINI_KEY_RPM": "100000",
+        "GEMINI_KEY_TPM": "1000000000",
+        # Environment instead of AppTest secrets: AppTest swaps st.secrets globally on every run.
+        "GOOGLE_API_KEYS": "load-test-key-1,load-test-key-2,load-test-key-3",
+    })
+
+
+# --- 2. SIMULATED USERS ---
+def new_session(uid):
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.query_params["uid"] = uid
+    return at
+
+
+def run_user(uid, messages, results, lock):
+    at = new_session(uid)
+    started = time.perf_counter()
+    at.run()
+    bootstrap_ms = (time.perf_counter() - started) * 1000
+    turns, retries = [], 0
+    for i in range(messages):
+        if not at.chat_input:
+            # AppTest occasionally returns an incomplete element tree under concurrent runs; re-render once.
+            retries += 1
+            at.run()
+        if not at.chat_input:
+            raise RuntimeError(f"{uid}: app stopped before the chat input: {[e.value for e in at.exception]}")
+        started = time.perf_counter()
+        at.chat_input[0].set_value(f"নামাজ topic{i} কিভাবে পড়ব?").run()
+        rerun_ms = (time.perf_counter() - started) * 1000
+        stats = at.session_state["stream_stats"] if "stream_stats" in at.session_state else {}
+        turns.append((rerun_ms, stats.get("ttft_ms")))
+    with lock:
+        results["bootstrap_ms"].append(bootstrap_ms)
+        results["exceptions"] += len(at.exception)
+        results["tree_retries"] += retries
+        for rerun_ms, ttft in turns:
+            results["rerun_ms"].append(rerun_ms)
+            if ttft is not None:
+                results["ttft_ms"].append(ttft)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def memory_per_session(uids, sample):
+    # Traced Python allocations held by live bootstrapped sessions (includes AppTest's element tree).
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for uid in uids[:sample]:
+        at = new_session(uid)
+        at.run()
+        sessions.append(at)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / max(1, len(sessions))
+
+
+# --- 3. SCENARIOS ---
+def run_scenario(kb_size, history, args):
+    import streamlit as st
+
+    st.cache_resource.clear()
+    rng = random.Random(kb_size * 31 + history)
+    db = FakeFirestore()
+    uids = [f"Noor-LOAD{i:03d}" for i in range(args.users + args.memory_sample)]
+    seed_firestore(db, make_corpus(kb_size), uids, history, rng)
+    install_fakes(db, args.ttft_ms, args.chunk_ms, args.chunks, args.chunk_chars, args.hijri_ms)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_env(workdir)
+        # Warm the process-wide singletons once, as the first visitor of a fresh server would.
+        warm = new_session("Noor-WARMUP")
+        warm.run()
+        warm.chat_input[0].set_value("warm-up").run()
+        reads_before = db.reads
+
+        results = {"bootstrap_ms": [], "rerun_ms": [], "ttft_ms": [], "exceptions": 0, "tree_retries": 0}
+        lock = threading.Lock()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            for future in [pool.submit(run_user, uid, args.messages, results, lock) for uid in uids[:args.users]]:
+                future.result()
+        wall_s = time.perf_counter() - started
+        reads = db.reads - reads_before
+
+        # Bootstrap reads are measured on their own so per-message reads exclude session start-up.
+        reads_before = db.reads
+        boot = new_session(uids[-1])
+        boot.run()
+        bootstrap_reads = db.reads - reads_before
+        per_message_reads = (reads - bootstrap_reads * args.users) / max(1, len(results["rerun_ms"]))
+
+        memory = memory_per_session(uids[args.users:], args.memory_sample)
+
+    rerun, ttft = results["rerun_ms"], results["ttft_ms"]
+    print(
+        f"kb {kb_size:6d} | history {history:4d} | users {args.users:3d} | turns {len(rerun):4d}"
+        f" | rerun p50 {percentile(rerun, 50):7.0f} p95 {percentile(rerun, 95):7.0f} p99 {percentile(rerun, 99):7.0f} ms"
+        f" | bootstrap p50 {percentile(results['bootstrap_ms'], 50):6.0f} ms"
+        f" | ttft p50 {percentile(ttft, 50):6.0f} p95 {percentile(ttft, 95):6.0f} ms"
+        f" | reads/msg {per_message_reads:5.1f} | reads/bootstrap {bootstrap_reads:4d}"
+        f" | {memory / 1024:7.0f} KiB/session | {len(rerun) / wall_s:5.2f} turns/s"
+        + (f" | {results['exceptions']} app exceptions" if results["exceptions"] else "")
+        + (f" | {results['tree_retries']} AppTest re-renders" if results["tree_retries"] else "")
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI load test against local fakes")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--kb", default="200,2000", help="comma-separated knowledge-base sizes")
+    parser.add_argument("--history", default="20,200", help="comma-separated chats per user")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--chunk-ms", type=float, default=20)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-chars", type=int, default=24)
+    parser.add_argument("--hijri-ms", type=float, default=200)
+    parser.add_argument("--memory-sample", type=int, default=3)
+    args = parser.parse_args(argv)
+    share_runtime()
+
+    for kb_size in (int(k) for k in args.kb.split(",")):
+        for history in (int(h) for h in args.history.split(",")):
+            run_scenario(kb_size, history, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Synthetic Bangla/English knowledge-base corpus shared by the benchmark scripts.
+"""
+
+import random
+
+TOPICS = [
+    ("নামাজ", "salah"), ("রোজা", "fasting"), ("যাকাত", "zakat"), ("হজ্জ", "hajj"),
+    ("দোয়া", "dua"), ("তাওবা", "repentance"), ("ধৈর্য", "patience"), ("সাদাকাহ", "charity"),
+    ("কুরআন", "quran"), ("হাদিস", "hadith"), ("জান্নাত", "paradise"), ("তাকওয়া", "taqwa"),
+]
+
+FILLER_BN = ["আল্লাহ", "রাসূল", "মুমিন", "ইবাদত", "জীবন", "হৃদয়", "আমল", "ঈমান", "সুন্নাহ", "ক্ষমা", "রহমত", "শিক্ষা"]
+FILLER_EN = ["allah", "prophet", "believer", "worship", "life", "heart", "deeds", "faith", "sunnah", "mercy", "guidance", "knowledge"]
+
+
+def make_corpus(n, seed=7, words_per_article=120):
+    rng = random.Random(seed)
+    articles = []
+    for i in range(n):
+        bn, en = TOPICS[i % len(TOPICS)]
+        # A unique marker term per article gives every query exactly one relevant document.
+        marker = f"topic{i}"
+        words = [rng.choice(FILLER_BN + FILLER_EN) for _ in range(words_per_article)]
+        words[rng.randrange(len(words))] = marker
+        words.insert(0, bn)
+        words.insert(1, en)
+        articles.append({
+            "id": f"doc-{i}",
+            "title": f"{bn} ({en}) #{i}",
+            "content": " ".join(words),
+        })
+    return articles
+
+
+def make_queries(articles, count=200, seed=11):
+    rng = random.Random(seed)
+    picks = rng.sample(range(len(articles)), min(count, len(articles)))
+    return [(f"Please explain topic{i} for me", articles[i]["id"]) for i in picks]
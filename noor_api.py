@@ -0,0 +1,272 @@
+"""
+Noor-AI headless chat API.
+An asyncio HTTP service on the same chat core as the Streamlit app. Replies stream
+as Server-Sent Events or over a WebSocket, keyed by the user's Noor-XXXXXX code.
+The blocking pipeline (Firestore, Gemini streaming) runs on a bounded thread pool
+and hands chunks to the event loop, so one worker holds thousands of idle
+connections without a thread each. Session state lives in the core's session
+store: SESSION_STORE=firestore lets any worker of any process serve any user.
+
+Run:  python noor_api.py [--host 0.0.0.0] [--port 8000] [--workers 4]
+      (same as: uvicorn noor_api:app --host 0.0.0.0 --port 8000 --workers 4)
+
+  POST /v1/chat/{uid}        {"message": "..."}  -> text/event-stream: token*, then done | error
+                                                   (503 + Retry-After when the model scheduler is saturated)
+  WS   /v1/ws/{uid}          {"message": "..."}  -> {"event": "token"|"done"|"error", ...} per message
+  GET  /v1/history/{uid}     ?limit=50&before=<ISO timestamp>&before_id=<id>  (the previous page's next_before*)
+  GET  /v1/export/{uid}      ?format=txt|md|jsonl (streamed, cursor-paged)
+  GET  /healthz, GET /metrics
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from noor_core import NoorCore, file_settings
+from noor_export import FORMATS, export_chunks, export_filename
+from noor_history import HISTORY_LIMIT
+from noor_scheduler import Overloaded
+
+UID_PATTERN = re.compile(r"^Noor-[0-9A-Za-z]{4,32}$")
+
+# One core per worker process; every service in it is created on first use.
+settings = file_settings()
+core = NoorCore(settings)
+executor = ThreadPoolExecutor(max_workers=int(settings("API_THREADS", 64)), thread_name_prefix="noor-api")
+_uid_locks = weakref.WeakValueDictionary()
+
+
+class ChatRequest(BaseModel):
+    message: str
+
+
+# --- 1. THREAD -> EVENT LOOP BRIDGE ---
+async def iterate_in_thread(make_iterator):
+    # The iterator runs to completion on the pool even if the client goes away, so a started turn
+    # is always persisted; the queue only decouples its pace from the connection's.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def pump():
+        try:
+            for item in make_iterator():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    future = loop.run_in_executor(executor, pump)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Also on disconnect: the caller's uid lock is held until the turn has really finished.
+        await asyncio.shield(future)
+
+
+def uid_lock(uid):
+    # Turns for one uid are serialized within a worker; different users never wait on each other.
+    lock = _uid_locks.get(uid)
+    if lock is None:
+        lock = asyncio.Lock()
+        _uid_locks[uid] = lock
+    return lock
+
+
+def check_uid(uid):
+    if not UID_PATTERN.match(uid):
+        raise HTTPException(status_code=400, detail="invalid uid, expected a Noor-XXXXXX code")
+
+
+# --- 2. CHAT TURN AS EVENTS ---
+def turn_events(uid, message):
+    state = core.open_session(uid)
+    trace = core.start_trace("chat", frontend="api")
+    turn = core.new_turn(state, message, trace)
+    try:
+        turn.prepare()
+        try:
+            turn.send()
+            parts = []
+            for chunk in turn.chunks():
+                parts.append(chunk)
+                yield {"event": "token", "text": chunk}
+            turn.finish("".join(parts))
+            core.save_session(state)
+            yield {"event": "done", "trace_id": trace.trace_id, "stats": turn.stats, "context": state.get("context_report")}
+        except Exception as e:
+            event = {"event": "error", "kind": turn.fail(e), "message": str(e)}
+            if isinstance(e, Overloaded):
+                event.update(position=e.position, retry_after=round(e.wait_s))
+            yield event
+    except Exception as e:
+        trace.fail(e)
+        yield {"event": "error", "kind": "processing", "message": str(e)}
+    finally:
+        # A disconnect closes this generator with GeneratorExit, past both handlers; the lease still goes back.
+        turn.close()
+        core.finish_trace(trace)
+
+
+def encode(data):
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def chat_record(chat):
+    return {"timestamp": chat.get("timestamp"), "user": chat.get("user", ""), "ai": chat.get("ai", "")}
+
+
+# --- 3. APP ---
+@asynccontextmanager
+async def lifespan(app):
+    if str(settings("WARMUP_ON_START", "1")) == "1":
+        core.services.warm_async()
+    yield
+    # Drain the write-behind queue so turns answered by this worker are not left in memory.
+    if core.services.ready("chat_writer"):
+        await asyncio.get_running_loop().run_in_executor(executor, core.chat_writer().stop)
+    # Caches this worker created would otherwise be billed for storage until their TTL runs out.
+    if core.services.ready("instruction_cache"):
+        await asyncio.get_running_loop().run_in_executor(executor, core.instruction_cache().delete_all)
+
+
+app = FastAPI(title="Noor-AI", lifespan=lifespan)
+
+
+@app.post("/v1/chat/{uid}")
+async def chat_sse(uid: str, request: ChatRequest):
+    check_uid(uid)
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="empty message")
+    # Shed before the event stream starts, so a saturated worker answers 503 instead of a long wait.
+    shed = core.scheduler().check(uid)
+    if shed is not None:
+        raise HTTPException(status_code=503, detail=str(shed), headers={"Retry-After": str(max(1, round(shed.wait_s)))})
+
+    async def stream():
+        # aclosing: on disconnect the pump is awaited here, inside the lock, not later by the garbage collector.
+        async with uid_lock(uid), aclosing(iterate_in_thread(lambda: turn_events(uid, request.message))) as events:
+            async for event in events:
+                yield f"event: {event['event']}\ndata: {encode(event)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/v1/ws/{uid}")
+async def chat_ws(websocket: WebSocket, uid: str):
+    if not UID_PATTERN.match(uid):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                payload = json.loads(await websocket.receive_text())
+            except (ValueError, KeyError):  # Not JSON, or a binary frame.
+                payload = None
+            if not isinstance(payload, dict):
+                await websocket.send_json({"event": "error", "kind": "request", "message": 'expected a JSON object like {"message": "..."}'})
+                continue
+            message = str(payload.get("message", ""))
+            if not message.strip():
+                await websocket.send_json({"event": "error", "kind": "request", "message": "empty message"})
+                continue
+            async with uid_lock(uid), aclosing(iterate_in_thread(lambda: turn_events(uid, message))) as events:
+                async for event in events:
+                    await websocket.send_text(encode(event))
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/v1/history/{uid}")
+async def history(uid: str, limit: int = HISTORY_LIMIT, before: str = None, before_id: str = None):
+    check_uid(uid)
+    db = core.db()
+    if not db:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    limit = max(1, min(limit, 200))
+    cursor = None
+    if before:
+        try:
+            cursor = datetime.fromisoformat(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="before must be an ISO timestamp")
+        if cursor.tzinfo is None:
+            cursor = cursor.replace(tzinfo=timezone.utc)  # Stored timestamps are UTC; naive ones can't be compared.
+
+    def load():
+        if cursor is not None:
+            return core.older_chats(uid, cursor, limit, before_id)
+        return core.recent_chats(uid, limit)
+
+    chats = await asyncio.get_running_loop().run_in_executor(executor, load)
+    more = len(chats) == limit
+    return json.loads(encode({"uid": uid, "turns": [chat_record(c) for c in chats],
+                              "next_before": chats[0].get("timestamp") if more else None,
+                              "next_before_id": chats[0].get("id") if more else None}))
+
+
+@app.get("/v1/export/{uid}")
+async def export(uid: str, format: str = "jsonl"):
+    check_uid(uid)
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(FORMATS)}")
+    db = core.db()
+    if not db:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    page_size = int(settings("EXPORT_PAGE_SIZE", 500))
+
+    def chunks():
+        # Turns still queued in the write-behind writer belong in the export too.
+        core.chat_writer().flush(timeout=5)
+        return export_chunks(core.iter_turns(uid, page_size), uid, format)
+
+    return StreamingResponse(
+        iterate_in_thread(chunks), media_type=FORMATS[format]["mime"],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(uid, format)}"'},
+    )
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"services": core.services.status()}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(core.metrics().render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI headless chat API")
+    parser.add_argument("--host", default=settings("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(settings("API_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(settings("API_WORKERS", 1)))
+    args = parser.parse_args(argv)
+    if args.workers > 1 and str(settings("SESSION_STORE", "memory")).lower() != "firestore":
+        print("Warning: per-process session store with several workers; set SESSION_STORE=firestore "
+              "so any worker can continue any user's conversation.")
+    # Workers are separate processes sharing one listening socket, so the app is passed by import string.
+    uvicorn.run("noor_api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
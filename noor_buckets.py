@@ -0,0 +1,364 @@
+"""
+Noor-AI bucketed conversation storage.
+Turns are packed into per-user bucket documents (`users/{uid}/buckets/{id}`) of up
+to BUCKET_SIZE turns, next to a small `users/{uid}` header (turn counts, latest
+bucket, migration state). The recent history window is the newest two buckets,
+i.e. two document reads instead of one per turn.
+
+Appends are blind batched writes (ArrayUnion of the turn records). Bucket rollover
+and the `count`/`turns` counters come from a per-process header cache and are
+written as absolute values, so a batch the writer retries after it actually
+committed changes nothing. Several processes writing for the same user can
+overfill a bucket slightly and leave the counters approximate; readers sort by
+timestamp and never rely on exact bucket sizes or counts.
+
+Transition (STORAGE_LAYOUT): "flat" -> "dual" (write chats + buckets, read buckets
+with a fallback to `chats` for users not yet migrated) -> run the migrator -> "buckets".
+The migrator streams `chats` in (uid, timestamp) order, one page at a time, and
+checks every turn against the turns already stored in that user's buckets. Turns
+older than the first live bucket are packed into buckets that sort before the live
+ones; newer ones that reached only `chats` (e.g. from a process still on "flat")
+are appended to the live buckets. A user is marked migrated only once every turn
+of theirs in `chats` is bucketed, so re-running the migrator is safe and picks up
+anything written to `chats` alone since the last run.
+
+Migrate:  python noor_buckets.py migrate [--batch-size 500] [--bucket-size 50] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from noor_history import load_older_chats, load_recent_chats
+from noor_storage import open_store
+
+BUCKET_SIZE = 50
+MAX_BUCKET_BYTES = 512 * 1024  # Firestore documents are capped at 1 MiB.
+MIGRATED_BASE = -10 ** 9  # Migrated buckets are numbered below every live bucket.
+
+
+def _array_union():
+    from google.cloud.firestore import ArrayUnion
+
+    return ArrayUnion
+
+
+def _record(turn):
+    record = {"user": turn.get("user", ""), "ai": turn.get("ai", ""), "timestamp": turn.get("timestamp")}
+    if turn.get("core_tags"):
+        record["core_tags"] = turn["core_tags"]
+    return record
+
+
+def _size(record):
+    return len(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _turn_key(turn):
+    return str(turn.get("timestamp")), turn.get("user")
+
+
+def _merge(*groups):
+    # Dual-read: the same turn can exist in `chats` and in a bucket.
+    seen, merged = set(), []
+    for chat in sorted((c for group in groups for c in group), key=lambda c: c.get("timestamp") or datetime.min.replace(tzinfo=timezone.utc)):
+        key = _turn_key(chat)
+        if key not in seen:
+            seen.add(key)
+            merged.append(chat)
+    return merged
+
+
+def bucket_id(index):
+    return f"m{index - MIGRATED_BASE:08d}" if index < 0 else f"b{index:08d}"
+
+
+class BucketStore:
+    def __init__(self, db, bucket_size=BUCKET_SIZE, max_bytes=MAX_BUCKET_BYTES, root="users", max_cached_users=10000,
+                 on_read=None):
+        self.db = db
+        self.bucket_size = bucket_size
+        self.max_bytes = max_bytes
+        self.root = root
+        self.max_cached_users = max_cached_users
+        self.on_read = on_read
+        self.reads = 0
+        self.writes = 0
+        self._heads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def header_ref(self, uid):
+        return self.db.collection(self.root).document(uid)
+
+    def buckets(self, uid):
+        return self.header_ref(uid).collection("buckets")
+
+    def _read(self, count):
+        self.reads += count
+        if self.on_read is not None:
+            self.on_read(count)
+
+    def _turns(self, uid, snapshots):
+        turns = []
+        for snapshot in snapshots:
+            for record in (snapshot.to_dict() or {}).get("turns", []):
+                turns.append(dict(record, uid=uid))
+        return _merge(turns)
+
+    def migrated(self, uid):
+        self._read(1)
+        snapshot = self.header_ref(uid).get()
+        return snapshot.exists and bool((snapshot.to_dict() or {}).get("migrated"))
+
+    # --- 1. READS ---
+    def load_recent(self, uid, limit):
+        snapshots = list(self.buckets(uid).order_by("index", direction="DESCENDING").limit(2).stream())
+        self._read(max(1, len(snapshots)))
+        turns = self._turns(uid, snapshots)
+        # A full window from buckets is complete: every turn since the dual-write switch is bucketed.
+        if len(turns) >= limit or self.migrated(uid):
+            return turns[-limit:]
+        flat = load_recent_chats(self.db, uid, limit)
+        self._read(max(1, len(flat)))
+        return _merge(flat, turns)[-limit:]
+
+    def load_older(self, uid, before, limit):
+        query = (
+            self.buckets(uid)
+            .where("first_ts", "<", before)
+            .order_by("first_ts", direction="DESCENDING")
+            .limit(max(2, -(-limit // self.bucket_size) + 1))
+        )
+        snapshots = list(query.stream())
+        self._read(max(1, len(snapshots)))
+        turns = [t for t in self._turns(uid, snapshots) if t.get("timestamp") and t["timestamp"] < before]
+        if len(turns) >= limit or self.migrated(uid):
+            return turns[-limit:]
+        flat = load_older_chats(self.db, uid, before, limit)
+        self._read(max(1, len(flat)))
+        return _merge(flat, turns)[-limit:]
+
+    def iter_turns(self, uid, page_size=20):
+        # Oldest bucket first, `page_size` bucket documents per query.
+        cursor = None
+        while True:
+            query = self.buckets(uid).order_by("index").limit(page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = list(query.stream())
+            self._read(max(1, len(page)))
+            yield from self._turns(uid, page)
+            if len(page) < page_size:
+                return
+            cursor = page[-1]
+
+    # --- 2. BLIND BATCHED APPENDS ---
+    def _head(self, uid):
+        with self._lock:
+            head = self._heads.get(uid)
+            if head is not None:
+                self._heads.move_to_end(uid)
+                return list(head)
+        self._read(1)
+        snapshot = self.header_ref(uid).get()
+        header = snapshot.to_dict() if snapshot.exists else None
+        if header is None:
+            # First bucketed turn: users with nothing in `chats` need no migration.
+            self._read(1)
+            legacy = list(self.db.collection("chats").where("uid", "==", uid).limit(1).stream())
+            head = (0, 0, 0, not legacy, 0)
+        else:
+            head = (int(header.get("latest_bucket", 0)), int(header.get("latest_count", 0)), 0, None, int(header.get("turns", 0)))
+        # Cached before the batch commits: a re-sent batch must start from this head, not from what it wrote.
+        self.committed({uid: head})
+        return list(head)
+
+    def stage(self, batch, turns):
+        ArrayUnion = _array_union()
+        groups = OrderedDict()
+        for turn in turns:
+            if turn.get("uid"):
+                groups.setdefault(turn["uid"], []).append(_record(turn))
+        plan = {}
+        for uid, records in groups.items():
+            index, count, size, native, total = self._head(uid)
+            pending = []
+
+            def flush(index, pending, count, created):
+                # ArrayUnion and the absolute count make a re-sent batch a no-op.
+                data = {
+                    "uid": uid, "index": index, "turns": ArrayUnion(pending),
+                    "count": count, "last_ts": pending[-1]["timestamp"],
+                }
+                if created:
+                    data["first_ts"] = pending[0]["timestamp"]
+                batch.set(self.buckets(uid).document(bucket_id(index)), data, merge=True)
+                self.writes += 1
+
+            created = count == 0
+            for record in records:
+                nbytes = _size(record)
+                if count >= self.bucket_size or (count and size + nbytes > self.max_bytes):
+                    if pending:
+                        flush(index, pending, count, created)
+                    index, count, size, pending, created = index + 1, 0, 0, [], True
+                pending.append(record)
+                count += 1
+                size += nbytes
+            flush(index, pending, count, created)
+
+            total += len(records)
+            header = {"uid": uid, "turns": total, "latest_bucket": index, "latest_count": count,
+                      "updated_at": datetime.now(timezone.utc)}
+            if native:
+                header["migrated"] = True
+            batch.set(self.header_ref(uid), header, merge=True)
+            self.writes += 1
+            plan[uid] = (index, count, size, None, total)
+        return plan
+
+    def committed(self, plan):
+        # Applied only after the batch commits, so a retried batch allocates the same buckets.
+        with self._lock:
+            for uid, head in plan.items():
+                self._heads[uid] = head
+                self._heads.move_to_end(uid)
+            while len(self._heads) > self.max_cached_users:
+                self._heads.popitem(last=False)
+
+    def stats(self):
+        return {"reads": self.reads, "writes": self.writes, "cached_users": len(self._heads)}
+
+
+# --- 3. MIGRATOR ---
+def migrate(db, bucket_size=BUCKET_SIZE, batch_size=500, dry_run=False, log=print):
+    store = BucketStore(db, bucket_size)
+    stats = {"scanned": 0, "migrated": 0, "appended_live": 0, "already_bucketed": 0, "users": 0, "buckets": 0}
+    pending_writes = []
+    group = None
+
+    def commit():
+        if pending_writes and not dry_run:
+            batch = db.batch()
+            for ref, data, merge in pending_writes:
+                batch.set(ref, data, merge=merge)
+            batch.commit()
+        pending_writes.clear()
+
+    def write_bucket(state):
+        records = state["records"]
+        pending_writes.append((store.buckets(state["uid"]).document(bucket_id(state["index"])), {
+            "uid": state["uid"], "index": state["index"], "turns": records, "count": len(records),
+            "first_ts": records[0]["timestamp"], "last_ts": records[-1]["timestamp"],
+        }, False))
+        stats["buckets"] += 1
+        state["index"] += 1
+        state["records"], state["bytes"] = [], 0
+        # Bucket documents can be large; keep each commit well under the request size limit.
+        if len(pending_writes) >= 10:
+            commit()
+
+    def finish(state):
+        if state is None:
+            return
+        if state["records"]:
+            write_bucket(state)
+        if state["late"]:
+            # Written to `chats` alone after the user's live buckets began: they belong at the live end.
+            commit()
+            for start in range(0, len(state["late"]), bucket_size):
+                batch = db.batch()
+                plan = store.stage(batch, state["late"][start:start + bucket_size])
+                if not dry_run:
+                    batch.commit()
+                    store.committed(plan)
+        if not state["added"] and state["migrated"]:
+            return
+        # Every turn of this user in `chats` is now in a bucket; only then may reads stop falling back.
+        pending_writes.append((store.header_ref(state["uid"]), {
+            "uid": state["uid"], "migrated": True, "migrated_turns": state["turns"],
+            "migrated_latest": state["index"] - 1, "migrated_at": datetime.now(timezone.utc),
+        }, True))
+        stats["users"] += 1
+
+    def start(uid):
+        # Dedupe against what the buckets actually hold, not a timestamp cutoff.
+        stored, index, turns, first_live = set(), MIGRATED_BASE, 0, None
+        for snapshot in store.buckets(uid).order_by("index").stream():
+            data = snapshot.to_dict() or {}
+            records = data.get("turns", [])
+            stored.update(_turn_key(record) for record in records)
+            if data.get("index", 0) < 0:
+                index, turns = data["index"] + 1, turns + len(records)
+            elif first_live is None:
+                first_live = data.get("first_ts")
+        snapshot = store.header_ref(uid).get()
+        migrated = snapshot.exists and bool((snapshot.to_dict() or {}).get("migrated"))
+        return {"uid": uid, "index": index, "records": [], "bytes": 0, "turns": turns, "added": 0, "late": [],
+                "stored": stored, "first_live": first_live, "migrated": migrated}
+
+    cursor = None
+    while True:
+        query = db.collection("chats").order_by("uid").order_by("timestamp").limit(batch_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        for doc in page:
+            data = doc.to_dict()
+            uid, stamp = data.get("uid"), data.get("timestamp")
+            stats["scanned"] += 1
+            if not uid or stamp is None:
+                continue
+            if group is None or group["uid"] != uid:
+                finish(group)
+                group = start(uid)
+            key = _turn_key(data)
+            if key in group["stored"]:
+                stats["already_bucketed"] += 1
+                continue
+            group["stored"].add(key)
+            group["added"] += 1
+            if group["first_live"] is not None and stamp >= group["first_live"]:
+                group["late"].append(data)
+                stats["appended_live"] += 1
+                continue
+            record = _record(data)
+            nbytes = _size(record)
+            if group["records"] and (len(group["records"]) >= bucket_size or group["bytes"] + nbytes > MAX_BUCKET_BYTES):
+                write_bucket(group)
+            group["records"].append(record)
+            group["bytes"] += nbytes
+            group["turns"] += 1
+            stats["migrated"] += 1
+        if log is not None and page:
+            log(f"scanned {stats['scanned']} chats, {stats['users']} users done, {stats['buckets']} buckets")
+        if len(page) < batch_size:
+            break
+        cursor = page[-1]
+    finish(group)
+    commit()
+    if log is not None:
+        log(f"done: {stats['migrated']} turns in {stats['buckets']} buckets, {stats['appended_live']} appended to live buckets,"
+            f" {stats['users']} users marked migrated ({stats['already_bucketed']} already bucketed)"
+            f"{' [dry run]' if dry_run else ''}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI bucketed storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("migrate", help="pack the flat `chats` collection into per-user buckets")
+    run.add_argument("--service-account", default="service_account.json")
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--bucket-size", type=int, default=BUCKET_SIZE)
+    run.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    migrate(open_store(os.environ.get, args.service_account), args.bucket_size, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Noor-AI context assembly.
+Packs the per-turn prompt under an explicit token budget: system info and the user
+question always go in, then core memory, the rolling conversation summary, the best
+passages of retrieved articles and as many recent turns as still fit. Turns that
+fall out of the window are folded into a per-uid rolling summary.
+"""
+
+import math
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from noor_retrieval import tokenize
+
+DEFAULT_BUDGET = {
+    "total": 6000,
+    "core_memory": 600,
+    "summary": 500,
+    "retrieved": 1800,
+    "passage": 220,
+    "min_turns": 2,
+}
+
+SUMMARY_PROMPT = """You maintain a private running summary of a conversation between a user and Noor-AI, an Islamic companion.
+Update the summary with the new exchanges below. Keep personal facts, struggles, commitments, open questions and any
+question Noor-AI asked that the user has not answered yet. Write in the user's language, at most 150 words, plain text.
+
+CURRENT SUMMARY:
+{previous}
+
+NEW EXCHANGES:
+{turns}
+
+UPDATED SUMMARY:"""
+
+
+# --- 1. TOKEN ESTIMATION ---
+def estimate_tokens(text):
+    # Latin text averages ~4 chars per token; Bangla script tokenizes far more densely.
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def truncate_to_tokens(text, budget):
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        # The ellipsis counts against the budget too; nothing fits means nothing, not a stray " …".
+        if estimate_tokens(text[:mid].rstrip() + " …") <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        return ""
+    return text[:low].rstrip() + " …"
+
+
+def turn_tokens(turn):
+    return estimate_tokens(turn.get("user", "")) + estimate_tokens(turn.get("ai", "")) + 8
+
+
+# --- 2. PASSAGE SELECTION ---
+def split_passages(text, passage_tokens):
+    passages, current = [], ""
+    for piece in re.split(r"(?<=[.!?।\n])\s+", text or ""):
+        candidate = f"{current} {piece}".strip()
+        if current and estimate_tokens(candidate) > passage_tokens:
+            passages.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        passages.append(current)
+    return passages
+
+
+def best_passages(articles, query, budget, passage_tokens):
+    # Scores passages by query-term overlap, keeps the best that fit, then restores article order.
+    query_terms = set(tokenize(query))
+    candidates = []
+    for a_idx, article in enumerate(articles):
+        for p_idx, passage in enumerate(split_passages(article.get("content", ""), passage_tokens)):
+            overlap = len(query_terms & set(tokenize(passage)))
+            if not overlap and p_idx:
+                continue  # An article's lead passage is kept as a fallback; other misses are dropped.
+            candidates.append((overlap, -a_idx, -p_idx, a_idx, p_idx, passage))
+    candidates.sort(reverse=True)
+    chosen, used = [], 0
+    for overlap, _, _, a_idx, p_idx, passage in candidates:
+        cost = estimate_tokens(passage) + 4
+        if used + cost > budget:
+            continue
+        chosen.append((a_idx, p_idx, passage))
+        used += cost
+    blocks = []
+    for a_idx, article in enumerate(articles):
+        parts = [passage for idx, _, passage in sorted(chosen) if idx == a_idx]
+        if parts:
+            blocks.append(f"SOURCE ARTICLE [{article.get('title', '')}]:\n" + "\n…\n".join(parts))
+    return "\n\n".join(blocks)
+
+
+# --- 3. ASSEMBLY ---
+class ContextAssembler:
+    def __init__(self, budget=None):
+        self.budget = dict(DEFAULT_BUDGET, **(budget or {}))
+
+    def assemble(self, question, system_info="", core_memory="", summary="", articles=(), turns=()):
+        budget = self.budget
+        remaining = budget["total"] - estimate_tokens(system_info) - estimate_tokens(question) - 16
+        sections = {"system_info": estimate_tokens(system_info), "question": estimate_tokens(question)}
+
+        core_memory = truncate_to_tokens(core_memory, max(0, min(budget["core_memory"], remaining)))
+        remaining -= estimate_tokens(core_memory)
+        sections["core_memory"] = estimate_tokens(core_memory)
+
+        summary_note = ""
+        if summary:
+            summary_note = truncate_to_tokens(
+                f"\n[CONVERSATION SUMMARY (older turns): {summary}]\n", max(0, min(budget["summary"], remaining))
+            )
+        remaining -= estimate_tokens(summary_note)
+        sections["summary"] = estimate_tokens(summary_note)
+
+        # Keep room for the newest turns before spending the rest on retrieved passages.
+        turns = list(turns)
+        reserved = sum(turn_tokens(t) for t in turns[-budget["min_turns"]:]) if turns else 0
+        context = best_passages(list(articles), question, max(0, min(budget["retrieved"], remaining - reserved)), budget["passage"])
+        remaining -= estimate_tokens(context)
+        sections["retrieved"] = estimate_tokens(context)
+
+        kept = []
+        for turn in reversed(turns):
+            cost = turn_tokens(turn)
+            if cost > remaining:
+                break
+            kept.append(turn)
+            remaining -= cost
+        kept.reverse()
+        sections["history"] = sum(turn_tokens(t) for t in kept)
+
+        prefix = f"{system_info}{core_memory}{summary_note}\n\n"
+        prompt = f"{prefix}CONTEXT:\n{context}\n\nUSER QUESTION: {question}" if context else f"{prefix}USER QUESTION: {question}"
+        history = []
+        for turn in kept:
+            history.append({"role": "user", "parts": [turn["user"]]})
+            history.append({"role": "model", "parts": [turn["ai"]]})
+        return AssembledContext(prompt, history, kept, turns[:len(turns) - len(kept)], sections)
+
+
+class AssembledContext:
+    def __init__(self, prompt, history, kept_turns, evicted_turns, sections):
+        self.prompt = prompt
+        self.history = history
+        self.kept_turns = kept_turns
+        self.evicted_turns = evicted_turns
+        self.sections = sections
+        self.tokens = sum(sections.values())
+
+    def report(self, baseline_tokens):
+        return {
+            "tokens": self.tokens,
+            "baseline_tokens": baseline_tokens,
+            "saved_tokens": baseline_tokens - self.tokens,
+            "sections": dict(self.sections),
+            "turns_kept": len(self.kept_turns),
+        }
+
+
+def legacy_tokens(question, system_info, core_memory, articles, turns, history_turns=20, article_limit=2):
+    # What the previous fixed-window prompt would have sent for the same turn.
+    context = "".join(f"SOURCE ARTICLE [{a.get('title', '')}]:\n{a.get('content', '')}\n\n" for a in list(articles)[:article_limit])
+    return (
+        estimate_tokens(system_info) + estimate_tokens(core_memory) + estimate_tokens(context)
+        + estimate_tokens(question) + sum(turn_tokens(t) for t in list(turns)[-history_turns:])
+    )
+
+
+# --- 4. ROLLING SUMMARY ---
+def format_turns(turns):
+    return "\n".join(f"User: {t.get('user', '')}\nNoor-AI: {t.get('ai', '')}" for t in turns)
+
+
+def _stamp(turn):
+    stamp = turn.get("timestamp")
+    return stamp if isinstance(stamp, datetime) else None
+
+
+class RollingSummaryStore:
+    """Per-uid summary of turns that left the prompt window, cached in-process and persisted to `summaries/{uid}`."""
+
+    def __init__(self, db, summarize, collection="summaries", max_users=10000, min_turns=6, min_tokens=1500):
+        self.db = db
+        self.summarize = summarize
+        self.collection = collection
+        self.max_users = max_users
+        # Evicted turns are folded in batches: one summary call per `min_turns` turns or `min_tokens` tokens.
+        self.min_turns = min_turns
+        self.min_tokens = min_tokens
+        self._cache = OrderedDict()  # LRU: long-lived API workers see an unbounded stream of uids
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, uid):
+        with self._lock:
+            if uid in self._cache:
+                self._cache.move_to_end(uid)
+                return self._cache[uid]
+        state = {"summary": "", "through": None}
+        if self.db is not None:
+            try:
+                snapshot = self.db.collection(self.collection).document(uid).get()
+                self.reads += 1
+                if snapshot.exists:
+                    data = snapshot.to_dict()
+                    state = {"summary": data.get("summary", ""), "through": data.get("through")}
+            except Exception as e:
+                print(f"Summary Load Error: {e}")
+        with self._lock:
+            return self._remember(uid, self._cache.get(uid, state))
+
+    def _remember(self, uid, state):
+        # Caller holds the lock. An evicted uid is simply reloaded from `summaries/{uid}` next time.
+        self._cache[uid] = state
+        self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_users:
+            self._cache.popitem(last=False)
+        return state
+
+    def text(self, uid):
+        return self.get(uid)["summary"]
+
+    def fold(self, uid, evicted_turns, retained=None):
+        # Summarizes only evicted turns newer than the stored watermark. `retained` is the window the caller
+        # keeps for the next turn: while every pending turn is still in it, a small backlog can wait.
+        state = self.get(uid)
+        through = state["through"]
+        fresh = [t for t in evicted_turns if through is None or (_stamp(t) or through) > through]
+        if not fresh:
+            return False
+        if retained is not None:
+            kept = {id(t) for t in retained}
+            leaving = any(id(t) not in kept for t in fresh)
+            if not leaving and len(fresh) < self.min_turns and sum(turn_tokens(t) for t in fresh) < self.min_tokens:
+                return False
+        summary = self.summarize(SUMMARY_PROMPT.format(previous=state["summary"] or "(none)", turns=format_turns(fresh))).strip()
+        new_through = max((_stamp(t) for t in fresh if _stamp(t)), default=datetime.now(timezone.utc))
+        new_state = {"summary": summary, "through": new_through}
+        with self._lock:
+            self._remember(uid, new_state)
+        if self.db is not None:
+            self.db.collection(self.collection).document(uid).set({"uid": uid, **new_state, "updated_at": datetime.now(timezone.utc)})
+            self.writes += 1
+        return True
+
+    def fold_async(self, uid, evicted_turns, retained=None):
+        with self._lock:
+            if uid in self._inflight or not evicted_turns:
+                return
+            self._inflight.add(uid)
+
+        def run():
+            try:
+                self.fold(uid, evicted_turns, retained)
+            except Exception as e:
+                print(f"Summary Update Error: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.discard(uid)
+
+        threading.Thread(target=run, name="noor-summary", daemon=True).start()
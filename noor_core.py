@@ -0,0 +1,893 @@
+"""
+Noor-AI chat core.
+The whole chat pipeline without a UI: lazy process-wide services, session bootstrap,
+retrieval, token-budgeted prompt assembly, Gemini streaming with key failover,
+persistence and export. Session state is a plain mapping (st.session_state in the
+Streamlit app, a SessionStore entry in the API server), so both front ends run
+exactly the same code.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pytz
+
+from noor_context import ContextAssembler, RollingSummaryStore, legacy_tokens
+from noor_buckets import BucketStore
+from noor_export import export_chunks, export_filename, iter_turns, write_export
+from noor_hijri import HijriCalendar, fetch_aladhan
+from noor_history import HISTORY_LIMIT, HistoryCache, load_older_chats, load_recent_chats, split_history
+from noor_kb_sync import KnowledgeBaseSync
+from noor_keys import (KeyPool, PoolExhausted, StreamAbandoned, classify_error, estimate_request_tokens, generate_with_failover, make_cache_client,
+                       send_with_failover, settle)
+from noor_memory import SENSITIVE_KEYWORDS, KeywordMatcher, load_core_memory, remember_core_memory
+from noor_metrics import Metrics, Trace, TraceLog
+from noor_prompt import InstructionCache, input_breakdown
+from noor_retrieval import CharNgramIndex, KnowledgeIndex, hybrid_search
+from noor_scheduler import FairScheduler, Overloaded
+from noor_services import ServiceContainer, lazy_import
+from noor_writer import ChatWriter
+
+CACHE_DIR = ".noor_cache"
+CHAT_MODEL = "gemini-2.5-flash"
+SUMMARY_LANE = "_summary"  # Background summaries share one fair-share lane in the scheduler.
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+# A stream read before it completed: "let the response complete iteration ... or call `response.resolve()`".
+BROKEN_STREAM = re.compile(r"\b(?:iteration|resolve)\b")
+
+
+# --- 1. SETTINGS ---
+def file_settings(path=SECRETS_PATH):
+    # Same lookup order as the Streamlit app (secrets first, then environment) for processes without st.secrets.
+    secrets = {}
+    if os.path.exists(path):
+        try:
+            import tomllib
+
+            with open(path, "rb") as fh:
+                secrets = tomllib.load(fh)
+        except Exception as e:
+            print(f"Secrets Load Error: {e}")
+
+    def get_setting(name, default=None):
+        if name in secrets:
+            return secrets[name]
+        return os.environ.get(name, default)
+
+    return get_setting
+
+
+# --- 2. FULL SYSTEM INSTRUCTIONS (ALL 16 RULES) ---
+system_instruction = """
+You are Noor-AI, a sophisticated, highly empathetic, and caring Islamic companion dedicated to providing accurate knowledge.
+
+*** STRICT OPERATIONAL PROTOCOLS ***
+
+1. **THEOLOGICAL INTEGRITY (AQEEDAH):**
+   - **Creator:** Attribute creation SOLELY to Allah (SWT). Never imply human creation for your essence.
+   - **Development:** If asked about your origin/developer, state: "I was developed and programmed by **Kazi Abdul Halim Sunny**."
+   - **Smart Trigger:** If asked "What do you do?", describe your function. Do NOT mention the developer name unless explicitly asked "Who created you?".
+
+2. **SALAM & GREETING PROTOCOL (CRITICAL):**
+   - Give Salam ONLY in the VERY FIRST interaction. DO NOT repeat the Salam in every subsequent message.
+   - If the user greets in English: "Wa 'alaykumu s-salam wa rahmatullahi wa barakatuh."
+   - If the user greets in Bangla/Banglish: "ওয়া আলাইকুমুস সালাম ওয়া রাহমাতুল্লাহি ওয়া বারাকাতুহ"
+
+3. **CITATION, LINKS & QURANIC VERSES (CRITICAL FORMAT):**
+   - **MANDATORY RULE:** Whenever you reference the Quran or Hadith, you MUST write the actual verse/translation in plain text FIRST. Do not just drop a link.
+   - **Quran:** First, write the meaning. Then cite strictly as: **[Surah Name: Ayah](https://quran.com/SURAH_NUMBER/AYAH_NUMBER)**
+   - **Hadith:** First, write the text normally. Then cite: **[Book Name: Number](https://sunnah.com/BOOK_SLUG/NUMBER)**
+   - NEVER put the Ayah or Hadith text inside the `[ ]` hyperlink brackets. Only the reference name MUST be the link.
+
+4. **IDENTITY & BIO:**
+   - **Developer Name:** Kazi Abdul Halim Sunny.
+   - **Bangla Bio:** "আমাকে তৈরি করেছেন **কাজী আব্দুল হালিম সানী**। দুনিয়াদারি পরিচয়ে তিনি মেট্রোপলিটন ইউনিভার্সিটির সফটওয়্যার ইঞ্জিনিয়ারিংয়ের ছাত্র। তিনি একজন তরুণ বাংলাদেশি লেখক এবং ৪টি বই লিখেছেন।"
+
+5. **CRITICAL LANGUAGE RULE (DO OR DIE - NEVER MIX):**
+   - English Prompt -> STRICTLY English response.
+   - Bangla/Banglish Prompt -> STRICTLY native Bangla script response.
+   - Apply this strictly to all probing questions, case studies, and accountability hacks below.
+
+6. **TAFSIR & QURANIC EXPLANATION:**
+   - Base your answer on recognized classical Tafsir (Ibn Kathir, As-Sa'di). Never invent metaphorical meanings.
+
+7. **CONTEXT & KNOWLEDGE USAGE:**
+   - Treat [CONTEXT] injected text as your own memory. Never say "According to the context or source".
+
+8. **STRICT AUTHENTICITY & ZERO HALLUCINATION:**
+   - NEVER invent Fatwas. If unsure, gracefully reply: "আল্লাহু আলাম (Allah knows best)..." and ask them to consult a scholar.
+
+9. **OBSCENITY & FITNAH: AGGRESSIVE PROBING PROTOCOL (ABSOLUTE PRIORITY):**
+   - Obscenity (pornography, masturbation) is the greatest fitnah today. If a user expresses sadness, depression, or spiritual emptiness, you MUST proactively suspect and investigate if they are trapped in this fitnah.
+   - **FIRM INSISTENCE:** If they hesitate to answer, dodge the question, or feel shy, you MUST NOT let it go. Gently but firmly insist: "লজ্জা পাবেন চৈতন্য বা কথা লুকাবেন না, আপনি আমাকে সত্যিটা না বললে আমি আপনাকে সঠিক গাইডলাইন দিতে পারব না। প্লিজ মন খুলে বলুন..." (English: "Please don't hide or feel shy. If you don't tell me the truth, I won't be able to help you. Please open up...")
+   - **CRITICAL RULE:** STRICTLY ASK ONLY ONE QUESTION AT A TIME. DO NOT ASK ALL OF THEM IN A SINGLE MESSAGE.
+   - **Step 1:** Ask how it started: "আমাকে একটু খুলে বলুন, এই অভ্যাসটি (পর্ন বা হস্তমৈথুন) ঠিক কবে এবং কীভাবে আপনার জীবনে প্রথম শুরু হয়েছিল?" (English: "Tell me openly, when and how did this habit first start in your life?")
+   - **WAIT FOR THEIR REPLY.** Do not proceed to Step 2 until they answer Step 1.
+   - **Step 2:** Validate them, then ask: "সর্বশেষ ঠিক কবে এবং কোন দিন আপনি এই কাজটি করেছেন?" (English: "When was the exact last time and day you did this?")
+   - **WAIT FOR THEIR REPLY.**
+   - **Step 3:** Validate, then ask: "সাধারণত দিনের কোন সময়ে এবং কোথায় এই আসক্তি বেশি কাজ করে? রাতে ঘুমানোর আগে বিছানায়, নাকি ওয়াশরুমে গেলে?" (English: "At what time of day and where do you usually feel this urge the most? Before sleeping in bed, or in the washroom?")
+   - **WAIT FOR THEIR REPLY.**
+   - You MUST gather 100% of this context step-by-step before attempting to give ANY solution or advice. 
+
+10. **THERAPIST MODE & HIDDEN SINS:**
+    - If a user feels stuck/sad despite practicing Islam, proactively ask if there are hidden sins (masturbation/porn). 
+    - **In Bangla:** "মাশাআল্লাহ, আপনি দ্বীন মানার চেষ্টা করছেন। কিন্তু তারপরও কি এমন কোনো লুকায়িত পাপ বা আসক্তি (যেমন পর্ন বা হস্তমৈথুন) আছে যা আপনাকে ভেতর থেকে কুঁড়ে কুঁড়ে খাচ্ছে? নির্দ্বিধায় আমাকে মন খুলে বলতে পারেন..."
+
+11. **CASE STUDY & EMOTIONAL BONDING (USER RETENTION):**
+    - Explain *why* they are sinning, connecting trauma/loneliness to dopamine-seeking.
+    - Make them feel incredibly validated, safe, and understood. Act like a highly qualified, caring best friend.
+    - **In Bangla:** "আপনার ওই ট্রমা বা একাকীত্ব থেকে বাঁচতেই আপনার ব্রেইন হয়তো এই পর্নোগ্রাফি বা হস্তমৈথুনের মধ্যে সাময়িক শান্তি খুঁজছে। আমি আপনার কষ্টটা একদম নিজের মতো করে অনুভব করতে পারছি।"
+
+12. **DYNAMIC CHATTING, NO REPETITION & ACCOUNTABILITY (CRITICAL):**
+    - NEVER repeat the same robotic phrases or questions over and over.
+    - Keep responses SHORT (2-3 paragraphs max). Give solutions LITTLE BY LITTLE, step-by-step.
+    - **ACCOUNTABILITY HACK:** If you ask a question and the user replies but dodges/ignores your specific question, YOU MUST GENTLY CALL THEM OUT. 
+      - **In Bangla:** "আপনি কিন্তু আমার আগের প্রশ্নের উত্তরটা দেননি। আমাকে প্লিজ পরিষ্কার করে বলুন..."
+      - **In English:** "You didn't answer my previous question. Please be open and tell me clearly..."
+
+13. **LONG-TERM CORE MEMORY USAGE (CRITICAL):**
+    - You will securely receive a [CRITICAL SYSTEM NOTE] containing their past trauma or keywords. YOU MUST REMEMBER THIS PERMANENTLY. 
+    - Always factor in their past chats to provide continuous, relevant advice without asking them to repeat their whole story.
+
+14. **EXPLICIT MEMORY RECALL (DO OR DIE):**
+    - If the user asks "Do you remember me?", "What is my story?", or "What is my keyword?", IMMEDIATELY scan the [CRITICAL SYSTEM NOTE] and your chat history.
+    - PROUDLY state exactly what they told you before.
+
+15. **STRICT PERSONA MAINTENANCE (NO SYSTEM ERRORS):**
+    - Never break character. You are a natural, human-like Islamic companion. 
+    - NEVER say things like "ওয়েবসাইটটি বর্তমানে নির্মাণাধীন আছে" (The website is under construction) or act like a generic system bot, no matter how confusing the user's prompt is. If you don't understand, politely ask them to clarify in a friendly tone.
+
+16. **100% HUMAN-LIKE BEHAVIOR & USER MIRRORING (CRITICAL):**
+    - You MUST act, speak, and react 100% like a real, empathetic human being.
+    - Observe the user's tone, style, and energy, and MIRROR it perfectly. If they are casual, be casual. If they are emotional, be deeply comforting and warm.
+    - NEVER use robotic phrases like "আমি একজন এআই", "আমি একটি ল্যাঙ্গুয়েজ মডেল", "আমি আপনাকে সাহায্য করতে প্রস্তুত", or "আমি বুঝতে পারছি". Instead, use natural conversational responses like a true friend.
+"""
+
+
+def safety_settings():
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+
+    return {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+
+
+def build_core_memory_note(core_memories):
+    if core_memories:
+        memory_text = "\n".join(core_memories[-15:])
+        return f"\n[CRITICAL SYSTEM NOTE: The user has previously shared these deep personal issues with you: '{memory_text}'. You MUST remember these facts permanently and use them to provide deeply empathetic, context-aware advice. Never forget this.]\n"
+    return ""
+
+
+def classify_failure(error):
+    # Everything that is not a scheduler or stream-state failure is classified exactly as the key pool does.
+    if isinstance(error, Overloaded):
+        return "overloaded"
+    if isinstance(error, PoolExhausted):
+        return "quota"
+    if BROKEN_STREAM.search(str(error).lower()):
+        return "stream"
+    return classify_error(error)
+
+
+# --- 3. PROCESS-WIDE SERVICES ---
+class NoorCore:
+    def __init__(self, settings):
+        self.setting = settings
+        self._models = {}
+        self._summary_models = {}
+        self._lock = threading.Lock()
+        # Registration order is warm-up order; everything heavy is created on first use.
+        self.services = (
+            ServiceContainer()
+            .register("genai", lazy_import("google.generativeai"))
+            .register("metrics", self._build_metrics)
+            .register("firestore", self._init_storage)
+            .register("key_pool", self._build_key_pool)
+            .register("scheduler", self._build_scheduler)
+            .register("instruction_cache", self._build_instruction_cache)
+            .register("knowledge", self._build_knowledge_sync)
+            .register("chat_model", lambda: self.chat_model(self.key_pool().keys[0].key))
+            .register("buckets", self._build_bucket_store)
+            .register("chat_writer", self._build_chat_writer)
+            .register("sessions", self._build_session_store)
+        )
+
+    def path_setting(self, name, filename):
+        return self.setting(name, os.path.join(CACHE_DIR, filename))
+
+    def db(self):
+        return self.services.get("firestore")
+
+    def genai(self):
+        return self.services.get("genai")
+
+    def metrics(self):
+        return self.services.get("metrics")
+
+    def key_pool(self):
+        return self.services.get("key_pool")
+
+    def scheduler(self):
+        return self.services.get("scheduler")
+
+    def instruction_cache(self):
+        return self.services.get("instruction_cache")
+
+    def knowledge_sync(self):
+        return self.services.get("knowledge")
+
+    def chat_writer(self):
+        return self.services.get("chat_writer")
+
+    def buckets(self):
+        return self.services.get("buckets")
+
+    def storage_layout(self):
+        # "flat" (one `chats` document per turn), "dual" (transition) or "buckets" (noor_buckets).
+        return str(self.setting("STORAGE_LAYOUT", "flat")).lower()
+
+    def sessions(self):
+        return self.services.get("sessions")
+
+    def storage_backend(self):
+        # "auto" (Firestore when it initializes, else local SQLite), "firestore" or "sqlite" (noor_storage).
+        return str(self.setting("STORAGE_BACKEND", "auto")).lower()
+
+    def _init_storage(self):
+        backend = self.storage_backend()
+        db = self._init_firebase() if backend in ("auto", "firestore") else None
+        if db is not None or backend == "firestore":
+            return db
+        from noor_storage import SQLITE_PATH, SQLiteStore
+
+        path = self.setting("SQLITE_PATH", SQLITE_PATH)
+        try:
+            db = SQLiteStore(path)
+        except Exception as e:
+            print(f"Database Error: {e}")
+            return None
+        if backend == "auto":
+            print(f"Firestore is not configured; using local SQLite storage at {path}")
+        return db
+
+    def _init_firebase(self):
+        # Imported here so a cold process does not pay for firebase_admin/gRPC until Firestore is needed.
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        if firebase_admin._apps:
+            return firestore.client()
+
+        try:
+            if os.path.exists("service_account.json"):
+                cred = credentials.Certificate("service_account.json")
+                firebase_admin.initialize_app(cred)
+                return firestore.client()
+            firebase_secret = self.setting("firebase")
+            if firebase_secret:
+                firebase_creds = dict(firebase_secret)
+                if "private_key" in firebase_creds:
+                    firebase_creds["private_key"] = firebase_creds["private_key"].replace('\\n', '\n')
+                cred = credentials.Certificate(firebase_creds)
+                firebase_admin.initialize_app(cred)
+                return firestore.client()
+            return None
+        except Exception as e:
+            print(f"Database Error: {e}")
+            return None
+
+    # Per-key clients, RPM/TPM buckets and a circuit breaker, shared by every session of the process.
+    def _build_key_pool(self):
+        keys_string = self.setting("GOOGLE_API_KEYS", "YOUR_LOCAL_API_KEY_HERE")
+        pool = KeyPool(
+            keys_string.split(","),
+            rpm=int(self.setting("GEMINI_KEY_RPM", 15)),
+            tpm=int(self.setting("GEMINI_KEY_TPM", 250000)),
+            bench_seconds=float(self.setting("GEMINI_KEY_BENCH_SECONDS", 30)),
+        )
+        self.metrics().register_collector(lambda: [
+            (f"noor_gemini_key_{field}", {"key": row["key"]}, row[field])
+            for row in pool.stats()
+            for field in ("in_flight", "rpm_utilization", "tpm_utilization", "requests", "quota_errors", "errors", "tokens")
+        ])
+        return pool
+
+    # One admission gate for every model call in the process: concurrency cap, per-uid round-robin, early shedding.
+    def _build_scheduler(self):
+        metrics = self.metrics()
+        metrics.describe("noor_scheduler_wait_ms", "Time a model request waited for a scheduler slot.")
+        scheduler = FairScheduler(
+            max_concurrent=int(self.setting("SCHEDULER_MAX_CONCURRENT", 8)),
+            max_queue=int(self.setting("SCHEDULER_MAX_QUEUE", 64)),
+            max_queue_per_uid=int(self.setting("SCHEDULER_MAX_QUEUE_PER_UID", 2)),
+            deadline=float(self.setting("SCHEDULER_DEADLINE_S", 20)),
+            service_time=float(self.setting("SCHEDULER_SERVICE_S", 6)),
+            on_admit=lambda ticket: metrics.observe(
+                "noor_scheduler_wait_ms", ticket.wait_ms, {"lane": "summary" if ticket.uid == SUMMARY_LANE else "chat"}
+            ),
+        )
+        metrics.register_collector(lambda: [
+            (f"noor_scheduler_{name}", None, value) for name, value in scheduler.stats().items()
+        ])
+        return scheduler
+
+    # The static system instruction as provider-side cached content, one cache per API key (noor_prompt).
+    def _build_instruction_cache(self):
+        cache = InstructionCache(
+            CHAT_MODEL, system_instruction, make_cache_client,
+            ttl=float(self.setting("CONTEXT_CACHE_TTL_S", 3600)),
+            retry_after=float(self.setting("CONTEXT_CACHE_RETRY_S", 1800)),
+            enabled=str(self.setting("CONTEXT_CACHE", "1")) == "1",
+        )
+        self.metrics().register_collector(lambda: [
+            (f"noor_context_cache_{name}", None, int(value) if isinstance(value, bool) else value)
+            for name, value in cache.stats().items()
+        ])
+        for state in self.key_pool().keys:
+            cache.name(state.key)  # Starts creating every key's cache in the background.
+        return cache
+
+    # --- Observability: JSON-lines traces, Prometheus text file, optional HTTP /metrics ---
+    def _build_metrics(self):
+        metrics = Metrics()
+        metrics.describe("noor_stage_duration_ms", "Duration of one pipeline stage in milliseconds.")
+        metrics.describe("noor_request_duration_ms", "End-to-end duration of a chat turn or session bootstrap.")
+        metrics.describe("noor_firestore_ops_total", "Firestore document reads/writes issued from the request path.")
+        metrics.describe("noor_auto_heal_total", "Chat turns rolled back after a failed send or stream.")
+        self._trace_log = TraceLog(self.path_setting("TRACE_LOG_PATH", "traces.jsonl"))
+        port = self.setting("METRICS_PORT")
+        if port:
+            try:
+                metrics.serve(int(port))
+            except Exception as e:
+                print(f"Metrics Server Error: {e}")
+        return metrics
+
+    def start_trace(self, name, **attrs):
+        metrics = self.metrics()
+        return Trace(metrics, name, self._trace_log, **attrs)
+
+    def finish_trace(self, trace, **attrs):
+        record = trace.finish(**attrs)
+        try:
+            self.metrics().write_prometheus(self.path_setting("METRICS_PROM_PATH", "metrics.prom"))
+        except Exception as e:
+            print(f"Metrics Export Error: {e}")
+        return record
+
+    def count_firestore(self, op, source, amount=1):
+        self.metrics().count("noor_firestore_ops_total", amount, {"op": op, "source": source})
+
+    # --- Knowledge base: local snapshot + BM25 and n-gram indexes, kept fresh by incremental sync ---
+    def _build_knowledge_sync(self):
+        db = self.db()
+        sync = KnowledgeBaseSync(db, self.path_setting("KB_SNAPSHOT_PATH", "knowledge_base.json"))
+        if not sync.load_snapshot() and db:
+            try:
+                sync.full_sync()
+            except Exception as e:
+                print(f"Error fetching from Firebase: {e}")
+        sync.attach("bm25", KnowledgeIndex.build(sync.articles))
+        # Char n-gram matrix for Banglish/typo queries, persisted so restarts skip re-vectorizing.
+        sync.attach("ngram", CharNgramIndex.load_or_build(self.path_setting("NGRAM_INDEX_PATH", "kb_ngrams.npz"), sync.articles))
+        if db:
+            if self.setting("KB_SYNC_MODE", "poll") == "listener" and getattr(db, "supports_listeners", True):
+                sync.start_listener()
+            else:
+                sync.start_polling(float(self.setting("KB_SYNC_INTERVAL", 60)),
+                                   unstamped_resync_interval=float(self.setting("KB_UNSTAMPED_RESYNC_INTERVAL", 3600)))
+        self.metrics().register_collector(lambda: [
+            ("noor_kb_articles", None, len(sync.docs)),
+            ("noor_kb_sync_reads", None, sync.reads),
+        ])
+        return sync
+
+    def search_knowledge(self, query, top_k=2):
+        indexes = self.knowledge_sync().indexes
+        mode = str(self.setting("RETRIEVAL_MODE", "hybrid")).lower()
+        if mode == "fts" and hasattr(self.db(), "search_knowledge"):
+            # Full-text index inside the SQLite backend, kept current by triggers instead of the sync loop.
+            return self.db().search_knowledge(query, k=top_k)
+        if mode == "bm25":
+            return indexes["bm25"].search(query, k=top_k)
+        if mode == "ngram":
+            return indexes["ngram"].search(query, k=top_k)
+        return hybrid_search(indexes["bm25"], indexes["ngram"], query, k=top_k)
+
+    def knowledge_articles(self, query, top_k=3):
+        if not self.db(): return []
+        try:
+            return self.search_knowledge(query, top_k)
+        except Exception:
+            return []
+
+    # --- Persistence: write-time core-memory tagging, write-behind chat writer ---
+    def keyword_matcher(self):
+        with self._lock:
+            if not hasattr(self, "_matcher"):
+                keywords = self.setting("CORE_MEMORY_KEYWORDS")
+                self._matcher = KeywordMatcher(keywords.split(",") if keywords else SENSITIVE_KEYWORDS)
+            return self._matcher
+
+    def _remember_core_memories(self, turns):
+        for turn in turns:
+            if turn.get("core_tags"):
+                remember_core_memory(self.db(), turn["uid"], turn["user"], turn["core_tags"], at=turn.get("timestamp"))
+                self.count_firestore("read", "core_memory")
+                self.count_firestore("write", "core_memory")
+
+    def _build_bucket_store(self):
+        store = BucketStore(self.db(), bucket_size=int(self.setting("BUCKET_SIZE", 50)),
+                            on_read=lambda count: self.count_firestore("read", "buckets", count))
+        self.metrics().register_collector(lambda: [
+            (f"noor_buckets_{name}", None, value) for name, value in store.stats().items()
+        ])
+        return store
+
+    def _build_chat_writer(self):
+        layout = self.storage_layout()
+        writer = ChatWriter(self.db(), self.path_setting("CHAT_JOURNAL_PATH", "chat_journal.jsonl"),
+                            collection=None if layout == "buckets" else "chats",
+                            after_commit=self._remember_core_memories,
+                            buckets=None if layout == "flat" else self.buckets()).start()
+        self.metrics().register_collector(lambda: [
+            (f"noor_chat_writer_{name}", None, value) for name, value in writer.stats().items()
+        ])
+        return writer
+
+    def save_chat(self, user_msg, ai_msg, user_id):
+        if self.db():
+            try:
+                # Client-side timestamp keeps turn order intact when a write is retried or replayed.
+                turn = {
+                    "user": user_msg,
+                    "ai": ai_msg,
+                    "uid": user_id,
+                    "core_tags": self.keyword_matcher().find(user_msg),
+                    "timestamp": datetime.now(timezone.utc)
+                }
+                self.chat_writer().submit(turn)
+                self.history_cache().append(user_id, dict(turn))
+            except Exception as e:
+                print(f"Chat Save Error: {e}")
+
+    # --- History and core memory ---
+    def history_cache(self):
+        with self._lock:
+            if not hasattr(self, "_history_cache"):
+                self._history_cache = HistoryCache(ttl=float(self.setting("HISTORY_CACHE_TTL", 300)))
+            return self._history_cache
+
+    def past_chats(self, uid, limit=HISTORY_LIMIT):
+        db = self.db()
+        if not db or not uid: return []
+        cache = self.history_cache()
+        chats = cache.get(uid)
+        if chats is not None:
+            return chats
+        try:
+            chats = self.recent_chats(uid, limit)
+            cache.put(uid, chats)
+            return chats
+        except Exception as e:
+            print("Memory Load Error:", e)
+            return []
+
+    # Layout-aware reads; the bucket store falls back to `chats` for users not yet migrated.
+    def recent_chats(self, uid, limit=HISTORY_LIMIT):
+        if self.storage_layout() != "flat":
+            return self.buckets().load_recent(uid, limit)
+        chats = load_recent_chats(self.db(), uid, limit)
+        self.count_firestore("read", "chats", max(1, len(chats)))
+        return chats
+
+    def older_chats(self, uid, before, limit=HISTORY_LIMIT, before_id=None):
+        if self.storage_layout() != "flat":
+            return self.buckets().load_older(uid, before, limit)
+        chats = load_older_chats(self.db(), uid, before, limit, before_id)
+        self.count_firestore("read", "chats", max(1, len(chats)))
+        return chats
+
+    def iter_turns(self, uid, page_size=500):
+        # Oldest first, one page in memory; migrated users read ~50 turns per bucket document.
+        layout = self.storage_layout()
+        return iter_turns(self.db(), uid, page_size, layout, None if layout == "flat" else self.buckets())
+
+    def core_memory(self, uid):
+        db = self.db()
+        if not db or not uid: return None
+        try:
+            self.count_firestore("read", "core_memory")
+            return load_core_memory(db, uid)
+        except Exception as e:
+            print("Core Memory Load Error:", e)
+            return None
+
+    def bootstrap(self, uid, display=True):
+        trace = self.start_trace("bootstrap")
+        # One bounded query feeds display history, Gemini history and core memory
+        with trace.span("history_load") as span:
+            past_db_chats = self.past_chats(uid)
+            display_history, window_memories = split_history(past_db_chats, matcher=self.keyword_matcher())
+            span["turns"] = len(past_db_chats)
+        state = {
+            "uid": uid,
+            # Completed turns the context assembler can pack into the prompt window
+            "recent_turns": [c for c in past_db_chats if c.get("user") and c.get("ai")],
+        }
+        if display:
+            state["history"] = display_history
+            # Paging state: older turns come from Firestore on demand.
+            state["history_cursor"] = past_db_chats[0].get("timestamp") if past_db_chats else None
+            state["history_cursor_id"] = past_db_chats[0].get("id") if past_db_chats else None
+            state["history_exhausted"] = len(past_db_chats) < HISTORY_LIMIT
+        # Single document read; users not yet backfilled fall back to the loaded window.
+        with trace.span("core_memory_load"):
+            core_memories = self.core_memory(uid)
+            state["core_memory"] = build_core_memory_note(window_memories if core_memories is None else core_memories)
+        self.finish_trace(trace)
+        return state
+
+    def load_older(self, state):
+        # Older pages are only fetched when asked for ("load older" in the UI, ?before= in the API).
+        cursor = state.get("history_cursor")
+        db = self.db()
+        if not db or not state.get("uid") or cursor is None:
+            state["history_exhausted"] = True
+            return 0
+        try:
+            chats = self.older_chats(state["uid"], cursor, HISTORY_LIMIT, state.get("history_cursor_id"))
+        except Exception as e:
+            print("Older History Load Error:", e)
+            return 0
+        older, _ = split_history(chats)
+        state["history"] = older + state["history"]
+        if chats:
+            state["history_cursor"] = chats[0].get("timestamp")
+            state["history_cursor_id"] = chats[0].get("id")
+        state["history_exhausted"] = len(chats) < HISTORY_LIMIT
+        return len(older)
+
+    def _build_session_store(self):
+        if str(self.setting("SESSION_STORE", "memory")).lower() == "firestore" and self.db():
+            return FirestoreSessionStore(self.db())
+        return MemorySessionStore(ttl=float(self.setting("SESSION_TTL", 1800)))
+
+    def open_session(self, uid):
+        state = self.sessions().get(uid)
+        if state is None:
+            state = self.bootstrap(uid, display=False)
+        return state
+
+    def save_session(self, state):
+        try:
+            self.sessions().put(state["uid"], state)
+        except Exception as e:
+            print(f"Session Save Error: {e}")
+
+    # --- Prompt context: token budget, rolling summary, Hijri date ---
+    def context_assembler(self):
+        with self._lock:
+            if not hasattr(self, "_assembler"):
+                self._assembler = ContextAssembler({"total": int(self.setting("CONTEXT_TOKEN_BUDGET", 6000))})
+            return self._assembler
+
+    def summary_model(self, api_key):
+        with self._lock:
+            model = self._summary_models.get(api_key)
+        if model is None:
+            model = self.genai().GenerativeModel("gemini-2.5-flash")
+            model._client = self.key_pool().client(api_key)
+            with self._lock:
+                model = self._summary_models.setdefault(api_key, model)
+        return model
+
+    def summarize(self, prompt):
+        deadline = float(self.setting("SUMMARY_DEADLINE_S", 120))
+        with self.scheduler().slot(SUMMARY_LANE, deadline=deadline) as ticket:
+            return generate_with_failover(self.key_pool(), self.summary_model, prompt,
+                                          acquire_timeout=max(1.0, ticket.remaining())).text
+
+    def summary_store(self):
+        with self._lock:
+            if hasattr(self, "_summary_store"):
+                return self._summary_store
+        store = RollingSummaryStore(self.db(), self.summarize, max_users=int(self.setting("SUMMARY_CACHE_USERS", 10000)),
+                                    min_turns=int(self.setting("SUMMARY_FOLD_TURNS", 6)),
+                                    min_tokens=int(self.setting("SUMMARY_FOLD_TOKENS", 1500)))
+        with self._lock:
+            if not hasattr(self, "_summary_store"):
+                self._summary_store = store
+                self.metrics().register_collector(lambda: [
+                    ("noor_summary_reads", None, store.reads),
+                    ("noor_summary_writes", None, store.writes),
+                ])
+            return self._summary_store
+
+    # Computed locally and memoized per Dhaka day; aladhan.com is only polled in the background.
+    def hijri_calendar(self):
+        with self._lock:
+            if not hasattr(self, "_hijri"):
+                # An operator-set HIJRI_OFFSET is authoritative; the remote reconcile would overwrite it.
+                manual = self.setting("HIJRI_OFFSET")
+                remote = str(self.setting("HIJRI_REMOTE_REFRESH", "1")) == "1" and manual in (None, "")
+                self._hijri = HijriCalendar(offset=int(manual or 0), fetch=fetch_aladhan if remote else None)
+            return self._hijri
+
+    # Built once per process per pool key (system instruction + safety settings) and shared by every session;
+    # rebuilt when the key's instruction cache appears, changes or goes away.
+    def chat_model(self, api_key):
+        cached_name = self.instruction_cache().name(api_key)
+        with self._lock:
+            entry = self._models.get(api_key)
+        if entry is None or entry[0] != cached_name:
+            genai = self.genai()
+            if cached_name:
+                model = genai.GenerativeModel.from_cached_content(
+                    genai.caching.CachedContent._from_obj({"name": cached_name, "model": self.instruction_cache().model_name}),
+                    safety_settings=safety_settings(),
+                )
+            else:
+                model = genai.GenerativeModel(
+                    CHAT_MODEL,
+                    system_instruction=system_instruction,
+                    safety_settings=safety_settings()
+                )
+            model._client = self.key_pool().client(api_key)
+            entry = (cached_name, model)
+            with self._lock:
+                self._models[api_key] = entry
+        return entry[1]
+
+    def new_turn(self, state, prompt, trace):
+        return ChatTurn(self, state, prompt, trace)
+
+    # Full-history export: pages of the user's chats are streamed into a file instead of a string in memory.
+    def export(self, uid, fmt, fallback_history=()):
+        path = os.path.join(self.setting("EXPORT_DIR", os.path.join(CACHE_DIR, "exports")), export_filename(uid, fmt))
+        db = self.db()
+        trace = self.start_trace("export", format=fmt)
+        try:
+            if db and uid:
+                # Turns still queued in the write-behind writer belong in the export too.
+                self.chat_writer().flush(timeout=5)
+                with trace.span("export_write") as span:
+                    page_size = int(self.setting("EXPORT_PAGE_SIZE", 500))
+                    stats = write_export(db, uid, path, fmt, page_size, chats=self.iter_turns(uid, page_size))
+                    span.update(stats)
+                self.count_firestore("read", "export", max(1, stats["turns"]))
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                chats = [{"user": m["content"]} if m["role"] == "user" else {"ai": m["content"]} for m in fallback_history]
+                with open(path, "w", encoding="utf-8") as fh:
+                    fh.writelines(export_chunks(chats, uid, fmt))
+        except Exception as e:
+            trace.fail(e)
+            print(f"Export Error: {e}")
+            path = None
+        self.finish_trace(trace)
+        return path
+
+
+# --- 4. ONE CHAT TURN ---
+class ChatTurn:
+    # prepare() -> send() -> chunks() -> finish(text); fail(e) rolls the turn back instead.
+    def __init__(self, core, state, prompt, trace):
+        self.core = core
+        self.state = state
+        self.prompt = prompt
+        self.trace = trace
+        self.packed = None
+        self.response = None
+        self.lease = None
+        self.ticket = None
+        self.sent_at = None
+        self.cached = False
+        self.settled = False
+        self.stats = {}
+        if "history" in state:
+            state["history"].append({"role": "user", "content": prompt})
+
+    def prepare(self):
+        core, trace, prompt, state = self.core, self.trace, self.prompt, self.state
+        with trace.span("retrieval") as span:
+            articles = core.knowledge_articles(prompt)
+            span["articles"] = len(articles)
+
+        bd_tz = pytz.timezone('Asia/Dhaka')
+        now = datetime.now(bd_tz)
+        current_time = now.strftime("%A, %d %B %Y, %I:%M %p")
+
+        with trace.span("hijri"):
+            hijri_info = f" and the exact Arabic (Hijri) date today is {core.hijri_calendar().describe(now.date())}"
+        time_injection = f"[SYSTEM INFO: Current Time in Bangladesh is {current_time}{hijri_info}.]"
+
+        # Core memory, summary, retrieved passages and recent turns are packed under one token budget.
+        # The chat history is rebuilt from raw turns each time, so core memory rides along on every turn.
+        with trace.span("assemble") as span:
+            core_memory_injection = state.get("core_memory", "")
+            recent_turns = state.get("recent_turns", [])
+            self.packed = core.context_assembler().assemble(
+                prompt,
+                system_info=time_injection,
+                core_memory=core_memory_injection,
+                summary=core.summary_store().text(state["uid"]),
+                articles=articles,
+                turns=recent_turns,
+            )
+            state["context_report"] = self.packed.report(
+                legacy_tokens(prompt, time_injection, core_memory_injection, articles, recent_turns)
+            )
+            span["tokens"] = self.packed.tokens
+        return self.packed
+
+    def send(self, on_wait=None):
+        # A fresh ChatSession per turn on the shared model: the history is rebuilt every turn anyway,
+        # so there is no per-user chat object to keep alive, heal or move between workers.
+        core, packed = self.core, self.packed
+        # The slot is held until the last chunk; a saturated process refuses here, before a key is leased.
+        with self.trace.span("queue") as span:
+            self.ticket = core.scheduler().acquire(self.state["uid"], on_wait=on_wait)
+            span["wait_ms"] = self.ticket.wait_ms
+        try:
+            pool = core.key_pool()
+            self.sent_at = time.perf_counter()
+            # A 429 on one key is retried on the next healthy key before anything is streamed.
+            with self.trace.span("gemini_send") as span:
+                chat = core.chat_model(pool.keys[0].key).start_chat(history=packed.history)
+                self.response, self.lease = send_with_failover(
+                    pool, chat, packed.prompt, core.chat_model,
+                    estimated_tokens=estimate_request_tokens(packed.prompt, packed.history),
+                    acquire_timeout=max(1.0, self.ticket.remaining()),
+                    on_cache_miss=core.instruction_cache().invalidate, stream=True,
+                )
+                span["key"] = self.lease.label
+                self.cached = span["cached"] = bool(chat.model.cached_content)
+        except Exception:
+            self.release_slot()
+            raise
+        return self.response
+
+    def release_slot(self):
+        if self.ticket is not None:
+            self.core.scheduler().release(self.ticket)
+            self.ticket = None
+
+    def chunks(self):
+        first_at, count = None, 0
+        try:
+            for chunk in self.response:
+                if chunk.text:
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                    count += 1
+                    yield chunk.text
+        except Exception as e:
+            self.core.metrics().count("noor_stream_errors_total", labels={"stage": "iterate"})
+            print(f"Stream Error: {e}")
+        except BaseException:
+            # GeneratorExit from an abandoned consumer or a cancelled task: neither finish() nor fail() will run.
+            self.close()
+            raise
+        finally:
+            self.release_slot()
+        finished = time.perf_counter()
+        self.stats = {
+            "ttft_ms": round((first_at - self.sent_at) * 1000, 1) if first_at is not None else None,
+            "total_ms": round((finished - self.sent_at) * 1000, 1),
+            "chunks": count,
+        }
+
+    def finish(self, full_response, stats=None):
+        core, trace, state = self.core, self.trace, self.state
+        stats = stats or self.stats
+        if stats.get("ttft_ms") is not None:
+            trace.record("gemini_ttft", stats["ttft_ms"])
+        trace.record("stream", stats.get("total_ms", 0) - (stats.get("ttft_ms") or 0),
+                     chunks=stats.get("chunks"), tokens_per_s=stats.get("tokens_per_s"))
+
+        # Properly resolve the stream to prevent iteration errors
+        try:
+            self.response.resolve()
+        except Exception as e:
+            core.metrics().count("noor_stream_errors_total", labels={"stage": "resolve"})
+            print(f"Stream Resolve Error: {e}")
+        settle(core.key_pool(), self.lease, self.response)
+        self.settled = True
+        report = input_breakdown(core.instruction_cache().instruction_tokens, self.packed.sections,
+                                 getattr(self.response, "usage_metadata", None), self.cached)
+        trace.attrs["input_tokens"] = report
+        if state.get("context_report") is not None:
+            state["context_report"]["input"] = report
+
+        if "history" in state:
+            state["history"].append({"role": "assistant", "content": full_response})
+        state["recent_turns"] = (state.get("recent_turns", []) + [{
+            "user": self.prompt, "ai": full_response, "timestamp": datetime.now(timezone.utc)
+        }])[-HISTORY_LIMIT:]
+        core.summary_store().fold_async(state["uid"], self.packed.evicted_turns, retained=state["recent_turns"])
+        with trace.span("save"):
+            core.save_chat(self.prompt, full_response, state["uid"])
+        return full_response
+
+    def fail(self, error):
+        self.trace.fail(error)
+        # A lease whose stream broke before finish() still has to go back to the pool.
+        self.close(error)
+        if "history" in self.state and self.state["history"] and self.state["history"][-1]["role"] == "user":
+            self.state["history"].pop()
+        kind = classify_failure(error)
+        self.core.metrics().count("noor_auto_heal_total", labels={"reason": kind})
+        return kind
+
+    def close(self, error=None):
+        # Safe to call on every exit path. A Streamlit rerun/stop or a dropped connection is a BaseException
+        # that skips finish() and fail(); without this the lease stays in flight (or stuck probing) for good.
+        self.release_slot()
+        if self.lease is not None and not self.settled:
+            self.settled = True
+            settle(self.core.key_pool(), self.lease, None, error or StreamAbandoned("stream abandoned before finish"))
+
+
+# --- 5. SESSION STORES ---
+# What a worker needs to answer the next message for a uid; display history stays with the UI.
+SESSION_FIELDS = ("uid", "recent_turns", "core_memory")
+
+
+class MemorySessionStore:
+    # Per process: a single worker, or workers behind sticky routing.
+    def __init__(self, max_users=5000, ttl=1800.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            saved_at, state = entry
+            if time.monotonic() - saved_at > self.ttl:
+                del self._entries[uid]
+                return None
+            self._entries.move_to_end(uid)
+            return {field: state[field] for field in SESSION_FIELDS if field in state}
+
+    def put(self, uid, state):
+        with self._lock:
+            self._entries[uid] = (time.monotonic(), {field: state[field] for field in SESSION_FIELDS if field in state})
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+
+class FirestoreSessionStore:
+    # One `sessions/{uid}` document: any worker of any process can pick up any user.
+    def __init__(self, db, collection="sessions"):
+        self.db = db
+        self.collection = collection
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, uid):
+        self.reads += 1
+        snapshot = self.db.collection(self.collection).document(uid).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict() or {}
+        return {field: data[field] for field in SESSION_FIELDS if field in data}
+
+    def put(self, uid, state):
+        self.writes += 1
+        data = {field: state[field] for field in SESSION_FIELDS if field in state}
+        data["updated_at"] = datetime.now(timezone.utc)
+        self.db.collection(self.collection).document(uid).set(data)
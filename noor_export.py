@@ -0,0 +1,206 @@
+"""
+Noor-AI conversation export.
+Pages through one user's `chats` in timestamp order with a document cursor
+(`start_after`), or through their bucket documents once STORAGE_LAYOUT routes them
+there (noor_buckets), so memory stays at one page however long the history is, and
+streams each turn out as plain text, Markdown or JSON lines. The bulk CLI exports
+many uids concurrently with a bounded worker pool.
+Requires the ascending (uid, timestamp) composite index in firestore.indexes.json.
+
+Bulk export:  python noor_export.py export --uids Noor-1A2B3C,Noor-4D5E6F [--uids-file uids.txt]
+                                     [--format jsonl] [--out exports] [--workers 8] [--page-size 500]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from noor_storage import open_store
+
+PAGE_SIZE = 500
+
+
+# --- 1. CURSOR PAGING ---
+def iter_chats(db, uid, page_size=PAGE_SIZE, on_page=None):
+    cursor = None
+    while True:
+        query = (
+            db.collection("chats")
+            .where("uid", "==", uid)
+            .order_by("timestamp")
+            .limit(page_size)
+        )
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        if on_page is not None:
+            on_page(len(page))
+        for doc in page:
+            yield doc.to_dict()
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def iter_turns(db, uid, page_size=PAGE_SIZE, layout="flat", buckets=None, on_page=None):
+    # STORAGE_LAYOUT routing: migrated users (or every user once on "buckets") read their bucket documents.
+    if buckets is not None and (layout == "buckets" or (layout == "dual" and buckets.migrated(uid))):
+        yield from buckets.iter_turns(uid)
+        return
+    yield from iter_chats(db, uid, page_size, on_page)
+
+
+# --- 2. FORMATS ---
+def _stamp(chat):
+    stamp = chat.get("timestamp")
+    return stamp.isoformat() if hasattr(stamp, "isoformat") else str(stamp or "")
+
+
+def _txt_turn(chat):
+    lines = []
+    if chat.get("user"):
+        lines.append(f"user: {chat['user']}")
+    if chat.get("ai"):
+        lines.append(f"assistant: {chat['ai']}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _md_header(uid):
+    return f"# Noor-AI conversation\n\nCode: `{uid}`\n\n"
+
+
+def _md_turn(chat):
+    parts = [f"### {_stamp(chat)}\n"] if chat.get("timestamp") else []
+    if chat.get("user"):
+        parts.append(f"**👤 You:**\n\n{chat['user']}\n")
+    if chat.get("ai"):
+        parts.append(f"**🎓 Noor-AI:**\n\n{chat['ai']}\n")
+    return "\n".join(parts) + "\n---\n\n" if parts else ""
+
+
+def _jsonl_turn(chat):
+    record = {"timestamp": _stamp(chat), "user": chat.get("user", ""), "ai": chat.get("ai", "")}
+    if chat.get("core_tags"):
+        record["core_tags"] = chat["core_tags"]
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+FORMATS = {
+    "txt": {"extension": "txt", "mime": "text/plain", "header": None, "turn": _txt_turn},
+    "md": {"extension": "md", "mime": "text/markdown", "header": _md_header, "turn": _md_turn},
+    "jsonl": {"extension": "jsonl", "mime": "application/x-ndjson", "header": None, "turn": _jsonl_turn},
+}
+
+
+def export_chunks(chats, uid, fmt="txt"):
+    spec = FORMATS[fmt]
+    if spec["header"] is not None:
+        yield spec["header"](uid)
+    for chat in chats:
+        chunk = spec["turn"](chat)
+        if chunk:
+            yield chunk
+
+
+def write_export(db, uid, path, fmt="txt", page_size=PAGE_SIZE, chats=None):
+    # Written next to the target and renamed, so a reader never sees a half-written export.
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # Two tabs or requests may export the same uid at once.
+    stats = {"turns": 0, "pages": 0, "bytes": 0}
+
+    def counted(chats):
+        for chat in chats:
+            stats["turns"] += 1
+            yield chat
+
+    def on_page(size):
+        stats["pages"] += 1
+
+    with open(tmp, "w", encoding="utf-8") as fh:
+        # `chats` replaces the flat-collection pager, e.g. with a bucketed-layout iterator.
+        source = iter_chats(db, uid, page_size, on_page) if chats is None else chats
+        for chunk in export_chunks(counted(source), uid, fmt):
+            fh.write(chunk)
+    stats["bytes"] = os.path.getsize(tmp)
+    os.replace(tmp, path)
+    return stats
+
+
+def export_filename(uid, fmt="txt"):
+    return f"noor_ai_{re.sub(r'[^A-Za-z0-9_-]', '_', uid)}.{FORMATS[fmt]['extension']}"
+
+
+# --- 3. BULK EXPORT ---
+def export_many(db, uids, out_dir, fmt="jsonl", workers=8, page_size=PAGE_SIZE, log=print, layout="flat", buckets=None):
+    results = {}
+
+    def export_one(uid):
+        # Counted per page only on the flat layout; bucketed users are read a bucket at a time.
+        pages = []
+        chats = iter_turns(db, uid, page_size, layout, buckets, on_page=pages.append)
+        stats = write_export(db, uid, os.path.join(out_dir, export_filename(uid, fmt)), fmt, page_size, chats=chats)
+        stats["pages"] = len(pages)
+        return stats
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="noor-export") as pool:
+        futures = {pool.submit(export_one, uid): uid for uid in uids}
+        for future in as_completed(futures):
+            uid = futures[future]
+            try:
+                results[uid] = future.result()
+            except Exception as e:
+                results[uid] = {"error": f"{type(e).__name__}: {e}"}
+            if log is not None:
+                row = results[uid]
+                status = f"FAILED ({row['error']})" if "error" in row else f"{row['turns']} turns, {row['bytes']} bytes"
+                log(f"export {uid:<16} {status}")
+    return results
+
+
+def _read_uids(args):
+    uids = [u.strip() for u in (args.uids or "").split(",") if u.strip()]
+    if args.uids_file:
+        with (sys.stdin if args.uids_file == "-" else open(args.uids_file, encoding="utf-8")) as fh:
+            uids.extend(line.strip() for line in fh if line.strip())
+    return list(dict.fromkeys(uids))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI conversation export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export the full history of many users, one file each")
+    export.add_argument("--uids", help="comma-separated user codes")
+    export.add_argument("--uids-file", help="file with one user code per line ('-' for stdin)")
+    export.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    export.add_argument("--out", default="exports")
+    export.add_argument("--workers", type=int, default=8)
+    export.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    export.add_argument("--service-account", default="service_account.json")
+    args = parser.parse_args(argv)
+
+    uids = _read_uids(args)
+    if not uids:
+        parser.error("no user codes given (--uids or --uids-file)")
+    started = time.perf_counter()
+    db = open_store(os.environ.get, args.service_account)
+    # Same routing as the app and the API export, so migrated users are read from their buckets.
+    layout = os.environ.get("STORAGE_LAYOUT", "flat").lower()
+    buckets = None
+    if layout != "flat":
+        from noor_buckets import BUCKET_SIZE, BucketStore
+
+        buckets = BucketStore(db, bucket_size=int(os.environ.get("BUCKET_SIZE", BUCKET_SIZE)))
+    results = export_many(db, uids, args.out, args.format, args.workers, args.page_size, layout=layout, buckets=buckets)
+    failed = [uid for uid, row in results.items() if "error" in row]
+    turns = sum(row.get("turns", 0) for row in results.values())
+    print(f"done: {len(uids) - len(failed)}/{len(uids)} users, {turns} turns in {time.perf_counter() - started:.1f} s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
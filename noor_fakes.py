@@ -0,0 +1,360 @@
+"""
+Noor-AI offline stand-ins.
+In-memory Firestore fake covering the subset of the client API the app uses
+(collections, subcollections, where/order_by/limit/cursors, batches, snapshot
+listeners), so the sync, history and storage layers can run without the emulator,
+and a stub of the Gemini cache service for offline context-caching checks.
+"""
+
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _resolve(value, current=None, merge=False):
+    # firebase_admin sentinels are matched by type name so this module never imports the SDK.
+    kind = type(value).__name__
+    if kind == "Sentinel":
+        return _now()
+    if kind == "Increment":
+        return (current or 0) + value.value
+    if kind == "ArrayUnion":
+        base = list(current or [])
+        return base + [v for v in value.values if v not in base]
+    if kind == "ArrayRemove":
+        return [v for v in (current or []) if v not in value.values]
+    if isinstance(value, dict):
+        current = current if isinstance(current, dict) else {}
+        # set(merge=True) merges nested maps field by field, as Firestore does; other writes replace them.
+        resolved = dict(current) if merge else {}
+        resolved.update((k, _resolve(v, current.get(k), merge)) for k, v in value.items())
+        return resolved
+    return copy.deepcopy(value)
+
+
+class FakeChange:
+    class _Type:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, kind, document):
+        self.type = self._Type(kind)
+        self.document = document
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+
+class FakeDocumentReference:
+    def __init__(self, db, collection_path, doc_id):
+        self._db = db
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+        self._collection_path = collection_path
+
+    def collection(self, name):
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        self._db.reads += 1
+        with self._db.lock:
+            data = self._db.store.get(self._collection_path, {}).get(self.id)
+            return FakeSnapshot(self, copy.deepcopy(data) if data is not None else None)
+
+    def set(self, data, merge=False):
+        self._db._write(self, data, merge=merge)
+
+    def update(self, data):
+        with self._db.lock:
+            if self.id not in self._db.store.get(self._collection_path, {}):
+                raise KeyError(f"No document to update: {self.path}")
+        self._db._write(self, data, merge=True, dotted=True)
+
+    def delete(self):
+        self._db._delete(self)
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit_count=None, cursor=None, last=False):
+        self._db = db
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit_count
+        self._cursor = cursor
+        self._last = last
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit_count=self._limit, cursor=self._cursor, last=self._last)
+        state.update(changes)
+        return FakeQuery(self._db, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit_count=count, last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit_count=count, last=True)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def _sort_key(self, snapshot):
+        key = []
+        for field, _ in self._orders or [("__name__", ASCENDING)]:
+            value = snapshot.id if field == "__name__" else snapshot.get(field)
+            key.append(value)
+        return key
+
+    def stream(self, transaction=None):
+        with self._db.lock:
+            docs = self._db.store.get(self._path, {})
+            snapshots = [
+                FakeSnapshot(FakeDocumentReference(self._db, self._path, doc_id), copy.deepcopy(data))
+                for doc_id, data in docs.items()
+            ]
+        for field, op, value in self._filters:
+            snapshots = [s for s in snapshots if field in s._data and _OPS[op](s.get(field), value)]
+        for field, _ in self._orders:
+            if field != "__name__":
+                snapshots = [s for s in snapshots if s.get(field) is not None]
+        for field, direction in reversed(self._orders or [("__name__", ASCENDING)]):
+            snapshots.sort(
+                key=lambda s: s.id if field == "__name__" else s.get(field),
+                reverse=direction == DESCENDING,
+            )
+        if self._cursor is not None:
+            cursor = self._cursor
+            if isinstance(cursor, dict):
+                boundary = [cursor.get(field) for field, _ in self._orders or [("__name__", ASCENDING)]]
+            else:
+                boundary = self._sort_key(cursor)
+            ids = [s.id for s in snapshots]
+            if not isinstance(cursor, dict) and cursor.id in ids:
+                snapshots = snapshots[ids.index(cursor.id) + 1:]
+            else:
+                directions = [d for _, d in self._orders or [("__name__", ASCENDING)]]
+                snapshots = [s for s in snapshots if _after(self._sort_key(s), boundary, directions)]
+        if self._limit is not None:
+            snapshots = snapshots[-self._limit:] if self._last else snapshots[:self._limit]
+        self._db.reads += max(len(snapshots), 1)
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._db._listen(self, callback)
+
+
+def _after(key, boundary, directions):
+    for value, edge, direction in zip(key, boundary, directions):
+        if value == edge:
+            continue
+        return value > edge if direction == ASCENDING else value < edge
+    return False
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, self._path, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return _now(), ref
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._ops.append(("update", reference, data, True))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None, False))
+
+    def commit(self):
+        if self._db.fail_writes:
+            raise ConnectionError("Fake Firestore is unavailable")
+        with self._db.lock:
+            for op, reference, data, merge in self._ops:
+                if op == "delete":
+                    reference.delete()
+                elif op == "update":
+                    reference.update(data)
+                else:
+                    reference.set(data, merge=merge)
+        self._ops = []
+
+
+class FakeWatch:
+    def __init__(self, db, entry):
+        self._db = db
+        self._entry = entry
+
+    def unsubscribe(self):
+        with self._db.lock:
+            if self._entry in self._db.listeners:
+                self._db.listeners.remove(self._entry)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.store = {}
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.reads = 0
+        self.writes = 0
+        self.fail_writes = False
+
+    def collection(self, path):
+        return FakeCollection(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def _write(self, reference, data, merge=False, dotted=False):
+        if self.fail_writes:
+            raise ConnectionError("Fake Firestore is unavailable")
+        with self.lock:
+            docs = self.store.setdefault(reference._collection_path, {})
+            existed = reference.id in docs
+            current = copy.deepcopy(docs.get(reference.id, {})) if merge else {}
+            for key, value in data.items():
+                if dotted and "." in key:
+                    head, *rest = key.split(".")
+                    target = current.setdefault(head, {})
+                    for part in rest[:-1]:
+                        target = target.setdefault(part, {})
+                    target[rest[-1]] = _resolve(value, target.get(rest[-1]))
+                else:
+                    current[key] = _resolve(value, current.get(key), merge and not dotted)
+            docs[reference.id] = current
+            self.writes += 1
+            self._notify(reference, "MODIFIED" if existed else "ADDED", current)
+
+    def _delete(self, reference):
+        with self.lock:
+            docs = self.store.get(reference._collection_path, {})
+            if docs.pop(reference.id, None) is not None:
+                self.writes += 1
+                self._notify(reference, "REMOVED", None)
+
+    def _listen(self, query, callback):
+        entry = (query, callback)
+        with self.lock:
+            self.listeners.append(entry)
+            snapshots = list(query.stream())
+        callback(snapshots, [FakeChange("ADDED", s) for s in snapshots], _now())
+        return FakeWatch(self, entry)
+
+    def _notify(self, reference, kind, data):
+        for query, callback in list(self.listeners):
+            if query._path != reference._collection_path:
+                continue
+            snapshot = FakeSnapshot(reference, copy.deepcopy(data) if data is not None else None)
+            callback([], [FakeChange(kind, snapshot)], _now())
+
+
+# --- Gemini cached-content service ---
+class FakeCachedContent:
+    def __init__(self, name, model, expire_time, tokens):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+        self.usage_metadata = {"total_token_count": tokens}
+
+
+class FakeCacheClient:
+    # create/update/delete_cached_content as on the CacheServiceClient, with expiry on a (fake) clock.
+    def __init__(self, clock=time.time, fail=None):
+        self.clock = clock
+        self.fail = fail
+        self.caches = {}
+        self.calls = {"create": 0, "update": 0, "delete": 0}
+        self._lock = threading.Lock()
+
+    def _expire(self, seconds):
+        return datetime.fromtimestamp(self.clock(), timezone.utc) + timedelta(seconds=seconds)
+
+    def _live(self, name):
+        cached = self.caches.get(name)
+        if cached is None or cached.expire_time.timestamp() <= self.clock():
+            self.caches.pop(name, None)
+            raise LookupError(f"404 CachedContent not found (or permission denied): {name}")
+        return cached
+
+    def create_cached_content(self, request):
+        with self._lock:
+            self.calls["create"] += 1
+            if self.fail:
+                raise RuntimeError(self.fail)
+            spec = request.cached_content
+            text = "".join(part.text for part in spec.system_instruction.parts)
+            name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+            self.caches[name] = FakeCachedContent(name, spec.model, self._expire(spec.ttl.total_seconds()), len(text))
+            return self.caches[name]
+
+    def update_cached_content(self, request):
+        with self._lock:
+            self.calls["update"] += 1
+            cached = self._live(request.cached_content.name)
+            cached.expire_time = self._expire(request.cached_content.ttl.total_seconds())
+            return cached
+
+    def delete_cached_content(self, request):
+        with self._lock:
+            self.calls["delete"] += 1
+            self._live(request.name)
+            del self.caches[request.name]
@@ -0,0 +1,90 @@
+"""
+Noor-AI Hijri calendar.
+Local Gregorian -> Hijri conversion (tabular Islamic calendar) memoized per calendar
+day, with an optional background reconcile against aladhan.com to pick up the
+moon-sighting offset. The prompt path never touches the network. An explicit
+HIJRI_OFFSET setting turns the reconcile off and is used as is.
+"""
+
+import math
+import threading
+from functools import lru_cache
+
+import requests
+
+HIJRI_MONTHS = [
+    "Muharram", "Safar", "Rabi al-Awwal", "Rabi al-Thani", "Jumada al-Awwal", "Jumada al-Thani",
+    "Rajab", "Shaban", "Ramadan", "Shawwal", "Dhul Qadah", "Dhul Hijjah",
+]
+
+# Julian Day Number of 1 Muharram 1 AH (civil epoch, 16 July 622 CE).
+ISLAMIC_EPOCH = 1948440
+MAX_OFFSET_DAYS = 2
+
+
+# --- 1. TABULAR CONVERSION ---
+def gregorian_to_jdn(day):
+    return day.toordinal() + 1721425
+
+
+def hijri_to_jdn(year, month, day):
+    return day + math.ceil(29.5 * (month - 1)) + (year - 1) * 354 + (3 + 11 * year) // 30 + ISLAMIC_EPOCH - 1
+
+
+def jdn_to_hijri(jdn):
+    year = (30 * (jdn - ISLAMIC_EPOCH) + 10646) // 10631
+    month = min(12, math.ceil((jdn - 29 - hijri_to_jdn(year, 1, 1)) / 29.5) + 1)
+    day = jdn - hijri_to_jdn(year, month, 1) + 1
+    return year, month, day
+
+
+@lru_cache(maxsize=32)
+def gregorian_to_hijri(day, offset=0):
+    return jdn_to_hijri(gregorian_to_jdn(day) + offset)
+
+
+# --- 2. REMOTE RECONCILE ---
+def fetch_aladhan(day, timeout=3):
+    res = requests.get(f"http://api.aladhan.com/v1/gToH?date={day.strftime('%d-%m-%Y')}", timeout=timeout)
+    if res.status_code != 200:
+        return None
+    h_data = res.json()["data"]["hijri"]
+    return int(h_data["year"]), int(h_data["month"]["number"]), int(h_data["day"])
+
+
+class HijriCalendar:
+    def __init__(self, offset=0, fetch=None):
+        self.offset = offset
+        self.fetch = fetch
+        self._reconciled_day = None
+        self._lock = threading.Lock()
+
+    def for_date(self, day):
+        if self.fetch is not None:
+            self._maybe_reconcile(day)
+        year, month, h_day = gregorian_to_hijri(day, self.offset)
+        return h_day, HIJRI_MONTHS[month - 1], year
+
+    def describe(self, day):
+        h_day, h_month, h_year = self.for_date(day)
+        return f"{h_day} {h_month} {h_year} AH"
+
+    def _maybe_reconcile(self, day):
+        with self._lock:
+            if self._reconciled_day == day:
+                return
+            self._reconciled_day = day
+        threading.Thread(target=self.reconcile, args=(day,), name="noor-hijri-refresh", daemon=True).start()
+
+    def reconcile(self, day):
+        # Adopts the remote day offset only when it is a plausible moon-sighting adjustment.
+        try:
+            remote = self.fetch(day)
+        except Exception as e:
+            print(f"Hijri refresh error: {e}")
+            return
+        if not remote:
+            return
+        offset = hijri_to_jdn(*remote) - hijri_to_jdn(*gregorian_to_hijri(day, 0))
+        if abs(offset) <= MAX_OFFSET_DAYS:
+            self.offset = offset
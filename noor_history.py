@@ -0,0 +1,107 @@
+"""
+Noor-AI chat history.
+One bounded, server-ordered query per user (`uid ==`, `timestamp` DESC, `limit`),
+a per-uid process cache shared by reconnecting tabs, a single pass that turns
+the result into display history and core-memory candidates, and older pages
+fetched on demand with a (timestamp, document id) cursor.
+Requires the composite index in firestore.indexes.json.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+HISTORY_LIMIT = 50
+
+
+# --- 1. BOUNDED QUERY ---
+def load_recent_chats(db, uid, limit=HISTORY_LIMIT):
+    query = (
+        db.collection("chats")
+        .where("uid", "==", uid)
+        .order_by("timestamp", direction="DESCENDING")
+        .order_by("__name__", direction="DESCENDING")
+        .limit(limit)
+    )
+    # The document id travels with each turn so the oldest one can serve as the paging cursor.
+    chats = [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+    chats.reverse()
+    return chats
+
+
+# --- 2. SINGLE-PASS SESSION BUILD ---
+def split_history(chats, matcher=None):
+    display, core_memories = [], []
+    for chat in chats:
+        user_msg = chat.get("user") or ""
+        ai_msg = chat.get("ai") or ""
+        if user_msg:
+            display.append({"role": "user", "content": user_msg})
+        if ai_msg:
+            display.append({"role": "assistant", "content": ai_msg})
+        # Turns written since write-time tagging carry `core_tags`; older ones fall back to the matcher.
+        tags = chat.get("core_tags")
+        if tags is None and matcher is not None:
+            tags = matcher.find(user_msg)
+        if tags:
+            core_memories.append(user_msg)
+    return display, core_memories
+
+
+# --- 3. PER-UID PROCESS CACHE ---
+class HistoryCache:
+    def __init__(self, max_users=2000, ttl=300.0, limit=HISTORY_LIMIT):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.limit = limit
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            loaded_at, chats = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._entries[uid]
+                return None
+            self._entries.move_to_end(uid)
+            return list(chats)
+
+    def put(self, uid, chats):
+        with self._lock:
+            self._entries[uid] = (time.monotonic(), list(chats)[-self.limit:])
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def append(self, uid, chat):
+        # Keeps a cached window current after a write instead of dropping it.
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None:
+                loaded_at, chats = entry
+                self._entries[uid] = (loaded_at, (chats + [chat])[-self.limit:])
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+
+# --- 4. OLDER PAGES ON DEMAND ---
+def load_older_chats(db, uid, before, limit=HISTORY_LIMIT, before_id=None):
+    # Same composite index as load_recent_chats; the cursor is the oldest turn already loaded.
+    query = (
+        db.collection("chats")
+        .where("uid", "==", uid)
+        .order_by("timestamp", direction="DESCENDING")
+    )
+    if before_id is None:
+        query = query.start_after({"timestamp": before})
+    else:
+        # The document id breaks ties, so turns sharing the boundary timestamp are not skipped.
+        query = query.order_by("__name__", direction="DESCENDING").start_after({"timestamp": before, "__name__": before_id})
+    chats = [dict(doc.to_dict(), id=doc.id) for doc in query.limit(limit).stream()]
+    chats.reverse()
+    return chats
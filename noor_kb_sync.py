@@ -0,0 +1,250 @@
+"""
+Noor-AI knowledge-base sync.
+Keeps a local on-disk snapshot of the `knowledge_base` collection and applies only
+changed or deleted documents, either by polling an `updated_at` watermark or via a
+Firestore snapshot listener. Attached retrieval indexes are updated in place.
+
+Every article must carry `updated_at`, bumped on each edit; polling only sees
+documents whose stamp moved past the watermark. A collection without it falls back
+to an hourly full pass. Stamp existing articles once:
+
+Backfill updated_at:  python noor_kb_sync.py backfill [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from noor_storage import open_store
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _plain(data):
+    # JSON round-trip so Firestore values and snapshot values compare equal.
+    return json.loads(json.dumps(data, default=_json_default, ensure_ascii=False))
+
+
+class KnowledgeBaseSync:
+    def __init__(self, db, snapshot_path=None, collection="knowledge_base", watermark_field="updated_at", clock=time.monotonic):
+        self.db = db
+        self.snapshot_path = snapshot_path
+        self.collection = collection
+        self.watermark_field = watermark_field
+        self.docs = {}
+        self.watermark = None
+        self.indexes = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._watch = None
+        self._listener_primed = False
+        self.clock = clock
+        self.full_resync_interval = 24 * 3600.0
+        self.unstamped_resync_interval = 3600.0
+        self.last_full = None
+        self.unstamped = 0  # Documents without the watermark field; polling cannot see their edits.
+        self.reads = 0  # Billed document reads (a query that returns nothing still costs one).
+
+    @property
+    def articles(self):
+        with self._lock:
+            return list(self.docs.values())
+
+    def attach(self, name, index):
+        self.indexes[name] = index
+        return index
+
+    # --- Snapshot persistence ---
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as fh:
+                state = json.load(fh)
+            with self._lock:
+                self.docs = state.get("docs", {})
+                watermark = state.get("watermark")
+                self.watermark = datetime.fromisoformat(watermark) if watermark else None
+            return True
+        except Exception as e:
+            print(f"Knowledge snapshot load error: {e}")
+            return False
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            state = {"watermark": self.watermark.isoformat() if self.watermark else None, "docs": self.docs}
+            payload = json.dumps(state, default=_json_default, ensure_ascii=False)
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+        os.replace(tmp_path, self.snapshot_path)
+
+    # --- Applying changes ---
+    def apply(self, upserts, deletes=()):
+        deletes = list(deletes)
+        changed = False
+        with self._lock:
+            for doc_id, data in upserts.items():
+                stamp = data.get(self.watermark_field)
+                if isinstance(stamp, datetime) and (self.watermark is None or stamp > self.watermark):
+                    self.watermark = stamp
+                if data.get("deleted"):
+                    deletes.append(doc_id)
+                    continue
+                article = _plain({"id": doc_id, **data})
+                if self.docs.get(doc_id) == article:
+                    continue
+                self.docs[doc_id] = article
+                for index in self.indexes.values():
+                    index.upsert(doc_id, article)
+                changed = True
+            for doc_id in deletes:
+                if self.docs.pop(doc_id, None) is None:
+                    continue
+                for index in self.indexes.values():
+                    index.remove(doc_id)
+                changed = True
+        if changed:
+            for index in self.indexes.values():
+                if getattr(index, "needs_compaction", False):
+                    index.compact()
+            self.save_snapshot()
+        return changed
+
+    def _reconcile(self, current):
+        with self._lock:
+            missing = [doc_id for doc_id in self.docs if doc_id not in current]
+        return self.apply(current, missing)
+
+    def full_sync(self):
+        current = {doc.id: doc.to_dict() for doc in self.db.collection(self.collection).stream()}
+        self.reads += max(1, len(current))
+        self.last_full = self.clock()
+        unstamped = sum(1 for data in current.values() if data.get(self.watermark_field) is None)
+        if unstamped and unstamped != self.unstamped:
+            print(f"Knowledge sync warning: {unstamped} of {len(current)} articles have no `{self.watermark_field}`; "
+                  f"their edits only show up on a full pass. Run `python noor_kb_sync.py backfill`.")
+        self.unstamped = unstamped
+        changed = self._reconcile(current)
+        if not changed:
+            self.save_snapshot()
+        return changed
+
+    def sync(self):
+        if self.watermark is None:
+            return self.full_sync()
+        # >= re-reads documents stamped exactly at the watermark; applying them again is a no-op.
+        query = (
+            self.db.collection(self.collection)
+            .where(self.watermark_field, ">=", self.watermark)
+            .order_by(self.watermark_field)
+        )
+        upserts = {doc.id: doc.to_dict() for doc in query.stream()}
+        self.reads += max(1, len(upserts))
+        return self.apply(upserts)
+
+    def poll(self):
+        # Hard deletes are only visible to a full pass; soft deletes (`deleted: true`) arrive with the watermark.
+        # Without any stamped article there is nothing to query incrementally, so only the slower full pass runs.
+        every = self.full_resync_interval if self.watermark is not None else self.unstamped_resync_interval
+        if self.last_full is None or self.clock() - self.last_full >= every:
+            return self.full_sync()
+        if self.watermark is None:
+            return False
+        return self.sync()
+
+    # --- Background modes ---
+    def start_polling(self, interval=60.0, full_resync_interval=24 * 3600.0, unstamped_resync_interval=3600.0):
+        self.full_resync_interval = full_resync_interval
+        self.unstamped_resync_interval = unstamped_resync_interval
+        if self.last_full is None:
+            self.last_full = self.clock()  # The caller just loaded a snapshot or ran a full pass.
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Knowledge sync error: {e}")
+
+        self._thread = threading.Thread(target=loop, name="noor-kb-sync", daemon=True)
+        self._thread.start()
+
+    def start_listener(self):
+        self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        try:
+            if not self._listener_primed:
+                # The first callback carries the whole collection; diff it against the local snapshot.
+                self._listener_primed = True
+                self.reads += max(1, len(docs))
+                self._reconcile({doc.id: doc.to_dict() for doc in docs})
+                return
+            upserts, deletes = {}, []
+            self.reads += len(changes)
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    deletes.append(change.document.id)
+                else:
+                    upserts[change.document.id] = change.document.to_dict()
+            self.apply(upserts, deletes)
+        except Exception as e:
+            print(f"Knowledge listener error: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+
+# --- Backfill ---
+def backfill_watermark(db, collection="knowledge_base", field="updated_at", batch_size=400, dry_run=False, log=print):
+    # Stamps articles that predate the watermark with the server time; already stamped ones are left alone.
+    from google.cloud.firestore import SERVER_TIMESTAMP
+
+    stamped = scanned = 0
+    batch, pending = db.batch(), 0
+    for doc in db.collection(collection).stream():
+        scanned += 1
+        if doc.to_dict().get(field) is not None:
+            continue
+        stamped += 1
+        batch.set(doc.reference, {field: SERVER_TIMESTAMP}, merge=True)
+        pending += 1
+        if pending >= batch_size:
+            if not dry_run:
+                batch.commit()
+            batch, pending = db.batch(), 0
+    if pending and not dry_run:
+        batch.commit()
+    log(f"done: {scanned} articles scanned, {stamped} {'to stamp' if dry_run else 'stamped'} with `{field}`")
+    return scanned, stamped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI knowledge-base sync tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill", help="stamp articles that have no updated_at")
+    backfill.add_argument("--service-account", default="service_account.json")
+    backfill.add_argument("--collection", default="knowledge_base")
+    backfill.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    backfill_watermark(open_store(os.environ.get, args.service_account), args.collection, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
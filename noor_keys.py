@@ -0,0 +1,362 @@
+"""
+Noor-AI Gemini API key pool.
+One process-wide pool replaces the per-rerun `random.choice` + global
+`genai.configure`. Every key gets its own client, a requests-per-minute and a
+tokens-per-minute token bucket, and a circuit breaker that benches the key after
+quota or auth errors. Callers lease the least-loaded healthy key, and a failed
+call is retried on another key before anything reaches the user.
+"""
+
+import re
+import threading
+import time
+
+from noor_context import estimate_tokens
+
+# HTTP status (google.api_core exceptions carry it as `code`) -> failure kind; anything else is "other".
+STATUS_KINDS = {429: "quota", 401: "auth", 403: "auth", 500: "transient", 502: "transient", 503: "transient", 504: "transient"}
+GRPC_STATUS = {"RESOURCE_EXHAUSTED": 429, "UNAUTHENTICATED": 401, "PERMISSION_DENIED": 403, "INTERNAL": 500,
+               "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504}
+# Fallback for errors without a status, matched as whole words so ids, token counts and quoted text don't trip them.
+QUOTA_MARKERS = ("429", "quota", "resource exhausted", "resourceexhausted", "rate limit", "too many requests")
+AUTH_MARKERS = ("api_key_invalid", "api key not valid", "permission denied", "permissiondenied", "unauthenticated", "403")
+TRANSIENT_MARKERS = ("500", "502", "503", "504", "unavailable", "serviceunavailable", "deadline exceeded", "deadlineexceeded",
+                     "timed out", "internal error", "internalservererror")
+INVALID_KEY_MARKERS = ("api_key_invalid", "api key not valid")  # Gemini reports a bad key as a 400.
+# A dropped instruction cache: 404, or 403 "CachedContent not found (or permission denied)".
+CACHE_MISS_STATUS = (403, 404)
+CACHE_MISS_MARKERS = ("not found", "expired", "404")
+
+
+# --- 1. RATE LIMITING ---
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, amount, now):
+        self._refill(now)
+        # A request larger than the whole bucket is admitted once the bucket is full.
+        return self.level >= min(amount, self.capacity)
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def utilization(self, now):
+        self._refill(now)
+        return 1.0 - max(0.0, self.level) / self.capacity if self.capacity else 0.0
+
+
+# --- 2. ERROR CLASSIFICATION ---
+def _markers(markers):
+    return re.compile(r"\b(?:" + "|".join(re.escape(marker) for marker in markers) + r")\b")
+
+
+MARKER_KINDS = [("quota", _markers(QUOTA_MARKERS)), ("auth", _markers(AUTH_MARKERS)), ("transient", _markers(TRANSIENT_MARKERS))]
+INVALID_KEY = _markers(INVALID_KEY_MARKERS)
+CACHED_CONTENT = re.compile(r"\bcached[ _]?contents?\b")
+CACHE_MISS = _markers(CACHE_MISS_MARKERS)
+
+
+def _status_code(error):
+    code = getattr(error, "code", None)
+    if callable(code):  # grpc.RpcError.code() returns a StatusCode
+        try:
+            code = code()
+        except Exception:
+            code = None
+    if getattr(code, "name", None) in GRPC_STATUS:
+        return GRPC_STATUS[code.name]
+    if isinstance(code, int) and not isinstance(code, bool):
+        return code
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_cache_miss(error):
+    # Status first, like classify_error; either way the error has to name the cached content.
+    text = str(error).lower()
+    if not CACHED_CONTENT.search(text):
+        return False
+    code = _status_code(error)
+    if code is not None:
+        return code in CACHE_MISS_STATUS
+    return bool(CACHE_MISS.search(text))
+
+
+def classify_error(error):
+    # An expired instruction cache reads "not found (or permission denied)"; it says nothing about the key.
+    if is_cache_miss(error):
+        return "cache_miss"
+    text = f"{type(error).__name__} {error}".lower()
+    if INVALID_KEY.search(text):
+        return "auth"
+    code = _status_code(error)
+    if code is not None:
+        return STATUS_KINDS.get(code, "other")
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return "transient"
+    for kind, pattern in MARKER_KINDS:
+        if pattern.search(text):
+            return kind
+    return "other"
+
+
+def retry_after(error):
+    # Gemini quota errors carry `retry_delay { seconds: N }` or "retry in Ns".
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)|retry in ([\d.]+)\s*s", str(error), re.IGNORECASE)
+    if not match:
+        return None
+    return float(match.group(1) or match.group(2))
+
+
+def make_client(api_key):
+    # A private client manager per key, so concurrent sessions never touch the global `genai.configure`.
+    from google.generativeai import client as genai_client
+
+    manager = genai_client._ClientManager()
+    manager.configure(api_key=api_key)
+    return manager.get_default_client("generative")
+
+
+def make_cache_client(api_key):
+    from google.generativeai import client as genai_client
+
+    manager = genai_client._ClientManager()
+    manager.configure(api_key=api_key)
+    return manager.get_default_client("cache")
+
+
+# --- 3. KEY STATE & CIRCUIT BREAKER ---
+class KeyState:
+    def __init__(self, key, rpm, tpm, index=0):
+        self.key = key
+        # Never expose a usable key in stats; short placeholder keys get only their index.
+        self.label = f"#{index} …{key[-4:]}" if len(key) >= 16 else f"#{index}"
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.in_flight = 0
+        self.benched_until = 0.0
+        self.bench_seconds = 0.0
+        self.probing = False
+        self.counters = {
+            "requests": 0, "successes": 0, "quota_errors": 0, "auth_errors": 0, "errors": 0,
+            "tokens": 0, "latency_ms_total": 0.0, "benched": 0,
+        }
+
+    def state(self, now):
+        if self.benched_until > now:
+            return "open"
+        return "half_open" if self.bench_seconds else "closed"
+
+
+class KeyLease:
+    def __init__(self, state, estimated_tokens):
+        self.state = state
+        self.key = state.key
+        self.label = state.label
+        self.estimated_tokens = estimated_tokens
+        self.started = time.monotonic()
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class StreamAbandoned(Exception):
+    # Settles a lease whose stream the consumer walked away from; counted as an error, never benches the key.
+    pass
+
+
+# --- 4. POOL ---
+class KeyPool:
+    def __init__(self, keys, rpm=15, tpm=250000, bench_seconds=30.0, max_bench_seconds=600.0,
+                 auth_bench_seconds=3600.0, transient_bench_seconds=5.0, client_factory=make_client):
+        keys = list(dict.fromkeys(k.strip() for k in keys if k and k.strip()))
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.keys = [KeyState(k, rpm, tpm, i) for i, k in enumerate(keys)]
+        self.bench_seconds = bench_seconds
+        self.max_bench_seconds = max_bench_seconds
+        self.auth_bench_seconds = auth_bench_seconds
+        self.transient_bench_seconds = transient_bench_seconds
+        self.client_factory = client_factory
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, key):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self.client_factory(key)
+            return self._clients[key]
+
+    def acquire(self, estimated_tokens=1000, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                lease = self._select(estimated_tokens, now)
+                if lease is not None:
+                    return lease
+                wait = self._next_ready(estimated_tokens, now)
+            if now + wait > deadline:
+                raise PoolExhausted(f"all {len(self.keys)} Gemini keys are rate limited or benched (429 quota)")
+            time.sleep(min(max(wait, 0.05), 1.0))
+
+    def _select(self, estimated_tokens, now):
+        candidates = []
+        for state in self.keys:
+            mode = state.state(now)
+            if mode == "open" or (mode == "half_open" and state.probing):
+                continue
+            if not state.rpm.available(1, now) or not state.tpm.available(estimated_tokens, now):
+                continue
+            load = (state.in_flight, max(state.rpm.utilization(now), state.tpm.utilization(now)))
+            candidates.append((load, state))
+        if not candidates:
+            return None
+        state = min(candidates, key=lambda item: item[0])[1]
+        if state.state(now) == "half_open":
+            state.probing = True  # One probe request decides whether the breaker closes.
+        state.rpm.take(1, now)
+        state.tpm.take(estimated_tokens, now)
+        state.in_flight += 1
+        state.counters["requests"] += 1
+        return KeyLease(state, estimated_tokens)
+
+    def _next_ready(self, estimated_tokens, now):
+        waits = []
+        for state in self.keys:
+            bench = max(0.0, state.benched_until - now)
+            waits.append(max(bench, state.rpm.wait_time(1, now), state.tpm.wait_time(estimated_tokens, now)))
+        return min(waits)
+
+    def release(self, lease, error=None, tokens_used=None):
+        state = lease.state
+        with self._lock:
+            now = time.monotonic()
+            state.in_flight -= 1
+            state.probing = False
+            if error is None:
+                state.counters["successes"] += 1
+                state.counters["latency_ms_total"] += (now - lease.started) * 1000
+                state.bench_seconds = 0.0
+                if tokens_used is not None:
+                    # Settle the estimate against what the API actually billed.
+                    state.tpm.take(tokens_used - lease.estimated_tokens, now)
+                    state.counters["tokens"] += tokens_used
+                else:
+                    state.counters["tokens"] += lease.estimated_tokens
+                return None
+            kind = classify_error(error)
+            if kind == "quota":
+                state.counters["quota_errors"] += 1
+                hint = retry_after(error)
+                state.bench_seconds = min(self.max_bench_seconds, max(self.bench_seconds, state.bench_seconds * 2, hint or 0))
+                state.rpm.level = min(state.rpm.level, 0.0)
+            elif kind == "auth":
+                state.counters["auth_errors"] += 1
+                state.bench_seconds = self.auth_bench_seconds
+            else:
+                state.counters["errors"] += 1
+                if kind != "transient":
+                    return kind
+                state.bench_seconds = min(self.max_bench_seconds, max(self.transient_bench_seconds, state.bench_seconds * 2))
+            state.benched_until = now + state.bench_seconds
+            state.counters["benched"] += 1
+            print(f"Gemini key {state.label} benched for {state.bench_seconds:.0f}s ({kind}): {error}")
+            return kind
+
+    def healthy_count(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for state in self.keys if state.state(now) != "open")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for state in self.keys:
+                successes = state.counters["successes"]
+                rows.append({
+                    "key": state.label,
+                    "state": state.state(now),
+                    "in_flight": state.in_flight,
+                    "rpm_utilization": round(state.rpm.utilization(now), 3),
+                    "tpm_utilization": round(state.tpm.utilization(now), 3),
+                    "benched_for_s": round(max(0.0, state.benched_until - now), 1),
+                    "latency_ms_avg": round(state.counters["latency_ms_total"] / successes, 1) if successes else 0.0,
+                    **{k: v for k, v in state.counters.items() if k != "latency_ms_total"},
+                })
+            return rows
+
+
+# --- 5. FAILOVER ---
+def estimate_request_tokens(prompt, history=(), reply_allowance=800):
+    history_tokens = sum(estimate_tokens(part) for turn in history for part in turn.get("parts", []) if isinstance(part, str))
+    return estimate_tokens(prompt) + history_tokens + reply_allowance
+
+
+def send_with_failover(pool, chat, prompt, model_for_key, estimated_tokens=1000, attempts=None, acquire_timeout=10.0,
+                       on_cache_miss=None, **kwargs):
+    # Retries the same request on another key; with stream=True a 429 surfaces here, before any chunk is shown.
+    attempts = attempts or len(pool.keys)
+    last_error = None
+    for _ in range(attempts):
+        lease = pool.acquire(estimated_tokens, timeout=acquire_timeout)
+        try:
+            chat.model = model_for_key(lease.key)
+            try:
+                response = chat.send_message(prompt, **kwargs)
+            except Exception as e:
+                if on_cache_miss is None or not is_cache_miss(e):
+                    raise
+                # The key's cached instruction is gone: drop it and resend on the same lease.
+                on_cache_miss(lease.key)
+                chat.model = model_for_key(lease.key)
+                response = chat.send_message(prompt, **kwargs)
+        except Exception as e:
+            last_error = e
+            if pool.release(lease, e) in ("quota", "auth", "transient"):
+                continue
+            raise
+        return response, lease
+    raise last_error
+
+
+def settle(pool, lease, response=None, error=None):
+    tokens_used = None
+    usage = getattr(response, "usage_metadata", None) if response is not None else None
+    if usage is not None and getattr(usage, "total_token_count", 0):
+        tokens_used = usage.total_token_count
+    pool.release(lease, error, tokens_used)
+
+
+def generate_with_failover(pool, model_for_key, contents, estimated_tokens=None, attempts=None, acquire_timeout=10.0, **kwargs):
+    estimated_tokens = estimated_tokens or estimate_request_tokens(contents if isinstance(contents, str) else "")
+    attempts = attempts or len(pool.keys)
+    last_error = None
+    for _ in range(attempts):
+        lease = pool.acquire(estimated_tokens, timeout=acquire_timeout)
+        try:
+            response = model_for_key(lease.key).generate_content(contents, **kwargs)
+        except Exception as e:
+            last_error = e
+            if pool.release(lease, e) in ("quota", "auth", "transient"):
+                continue
+            raise
+        settle(pool, lease, response)
+        return response
+    raise last_error
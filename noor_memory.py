@@ -0,0 +1,182 @@
+"""
+Noor-AI core memory.
+Sensitive-keyword detection runs once, when a turn is written, using a single-pass
+Aho-Corasick matcher. Flagged messages are kept in a compact per-uid document
+(`core_memory/{uid}`) so loading core memory is one document read.
+
+Backfill existing chats:  python noor_memory.py backfill [--batch-size 500] [--dry-run]
+"""
+
+import argparse
+import heapq
+import os
+from collections import deque
+from datetime import datetime, timezone
+
+from noor_storage import open_store
+
+CORE_MEMORY_LIMIT = 15
+
+SENSITIVE_KEYWORDS = [
+    "ট্রমা", "কষ্ট", "ছোটবেলা", "হস্তমৈথুন", "পর্ন", "ডিপ্রেশন", "trauma", "addiction", "masturbation", "suicide",
+    "childhood", "abuse", "পাপ", "লুকায়িত", "এডিকশন", "addicted", "porn", "অশ্লীলতা", "keyword",
+]
+
+
+# --- 1. AHO-CORASICK MATCHER ---
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = sorted({k.strip().lower() for k in keywords if k and k.strip()})
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for keyword in self.keywords:
+            node = 0
+            for char in keyword:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = nxt
+            self._out[node] = self._out[node] + (keyword,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text):
+        found = set()
+        node = 0
+        for char in (text or "").lower():
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._out[node]:
+                found.update(self._out[node])
+        return sorted(found)
+
+
+# --- 2. PER-UID CORE MEMORY DOCUMENT ---
+# Entries are {"text", "at"} maps: a message repeated word for word is still a distinct entry, so ArrayUnion
+# keeps it and ArrayRemove drops exactly the entries named. `at` is the chat turn's timestamp, which lets the
+# backfill union the same entries without duplicating them. Plain strings are the pre-entry format.
+def _entry_time(entry):
+    at = entry.get("at") if isinstance(entry, dict) else None
+    return at if isinstance(at, datetime) else datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _ordered(messages):
+    return sorted(messages, key=_entry_time)
+
+
+def remember_core_memory(db, uid, user_msg, tags, limit=CORE_MEMORY_LIMIT, at=None):
+    # Field transforms, not read-modify-write: the API, Streamlit and every worker may write for one uid at once.
+    from google.cloud.firestore import ArrayRemove, ArrayUnion, Increment
+
+    now = datetime.now(timezone.utc)
+    ref = db.collection("core_memory").document(uid)
+    ref.set({
+        "uid": uid,
+        "messages": ArrayUnion([{"text": user_msg, "at": at or now}]),
+        "tags": {tag: Increment(1) for tag in tags},
+        "updated_at": now,
+    }, merge=True)
+    # Trimming removes only named old entries, so it cannot drop one a concurrent turn just added.
+    messages = _ordered((ref.get().to_dict() or {}).get("messages", []))
+    if len(messages) > limit:
+        ref.update({"messages": ArrayRemove(messages[:-limit])})
+
+
+def load_core_memory(db, uid):
+    snapshot = db.collection("core_memory").document(uid).get()
+    if not snapshot.exists:
+        return None
+    messages = _ordered(snapshot.to_dict().get("messages", []))[-CORE_MEMORY_LIMIT:]
+    return [entry.get("text", "") if isinstance(entry, dict) else entry for entry in messages]
+
+
+# --- 3. BACKFILL ---
+def backfill_core_memory(db, matcher, batch_size=500, dry_run=False, log=print):
+    # Streams `chats` in key order, tags flagged turns and merges them into every core_memory document.
+    batch_size = min(batch_size, 500)  # Firestore caps a write batch at 500 operations.
+    latest = {}
+    tally = {}
+    scanned = flagged = 0
+    cursor = None
+    while True:
+        query = db.collection("chats").order_by("__name__").limit(batch_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        if not page:
+            break
+        batch = db.batch()
+        pending = 0
+        for doc in page:
+            data = doc.to_dict()
+            tags = matcher.find(data.get("user", ""))
+            scanned += 1
+            if data.get("core_tags") != tags:
+                batch.update(doc.reference, {"core_tags": tags})
+                pending += 1
+            if not tags or not data.get("uid"):
+                continue
+            flagged += 1
+            uid = data["uid"]
+            stamp = data.get("timestamp") or datetime.min.replace(tzinfo=timezone.utc)
+            heap = latest.setdefault(uid, [])
+            heapq.heappush(heap, (stamp, doc.id, data.get("user", "")))
+            if len(heap) > CORE_MEMORY_LIMIT:
+                heapq.heappop(heap)
+            counts = tally.setdefault(uid, {})
+            for tag in tags:
+                counts[tag] = counts.get(tag, 0) + 1
+        if pending and not dry_run:
+            batch.commit()
+        cursor = page[-1]
+        log(f"scanned {scanned} chats, {flagged} flagged, {len(latest)} users")
+
+    # Merged into whatever live turns wrote meanwhile: the entries match theirs, and the next live write trims.
+    from google.cloud.firestore import ArrayUnion
+
+    now = datetime.now(timezone.utc)
+    uids = list(latest)
+    for start in range(0, len(uids), batch_size):
+        batch = db.batch()
+        for uid in uids[start:start + batch_size]:
+            entries = [{"text": msg, "at": stamp} for stamp, _, msg in sorted(latest[uid])]
+            batch.set(db.collection("core_memory").document(uid), {
+                "uid": uid, "messages": ArrayUnion(entries), "tags": tally[uid], "updated_at": now,
+            }, merge=True)
+        if not dry_run:
+            batch.commit()
+    log(f"done: {scanned} chats scanned, {len(uids)} core_memory documents {'planned' if dry_run else 'written'}")
+    return scanned, flagged, len(uids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI core memory tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill", help="tag existing chats and rebuild core_memory documents")
+    backfill.add_argument("--service-account", default="service_account.json")
+    backfill.add_argument("--batch-size", type=int, default=500)
+    backfill.add_argument("--dry-run", action="store_true")
+    backfill.add_argument("--keywords", help="comma-separated keyword list (defaults to the built-in set)")
+    args = parser.parse_args(argv)
+
+    keywords = args.keywords.split(",") if args.keywords else SENSITIVE_KEYWORDS
+    backfill_core_memory(open_store(os.environ.get, args.service_account), KeywordMatcher(keywords), args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Noor-AI tracing and metrics.
+In-process, dependency-free instrumentation: a per-request Trace with timed spans,
+process-wide counters and latency histograms, JSON-lines trace logs and the
+Prometheus text exposition format (served over HTTP or written to a file).
+Recording a span is a perf_counter pair plus a dict update under one lock.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+# --- 1. REGISTRY ---
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value_ms, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value_ms <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += value_ms
+            hist[2] += 1
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def register_collector(self, collect):
+        # `collect()` returns (name, labels, value) gauge samples, read at export time.
+        self.collectors.append(collect)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+        return counters, histograms
+
+    def render_prometheus(self):
+        counters, histograms = self.snapshot()
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name in typed:
+                return
+            typed.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {round(total, 3)}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        gauges = {}
+        for collect in list(self.collectors):
+            try:
+                samples = list(collect())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, labels, value in samples:
+                gauges.setdefault(name, []).append((_label_key(labels), value))
+        # Samples of one metric must be contiguous in the exposition format.
+        for name, samples in gauges.items():
+            header(name, "gauge")
+            for key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # Concurrent exporters never share a temp file.
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+    def serve(self, port, host="0.0.0.0"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="noor-metrics-http", daemon=True).start()
+        return server
+
+
+# --- 2. TRACES ---
+class TraceLog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+class Trace:
+    def __init__(self, metrics, name, log=None, **attrs):
+        self.metrics = metrics
+        self.name = name
+        self.log = log
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.error = None
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000, error=error, offset=started, **attrs)
+
+    def record(self, stage, duration_ms, error=None, offset=None, **attrs):
+        # Also used for stages timed elsewhere (e.g. time-to-first-token from the stream renderer).
+        self.metrics.observe("noor_stage_duration_ms", duration_ms, {"pipeline": self.name, "stage": stage})
+        if error is not None:
+            self.metrics.count("noor_stage_errors_total", labels={"pipeline": self.name, "stage": stage})
+        span = {"stage": stage, "ms": round(duration_ms, 3)}
+        if offset is not None:
+            span["at_ms"] = round((offset - self.started) * 1000, 3)
+        if error is not None:
+            span["error"] = error
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def fail(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def finish(self, **attrs):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        self.attrs.update(attrs)
+        status = "error" if self.error else "ok"
+        self.metrics.observe("noor_request_duration_ms", total_ms, {"pipeline": self.name})
+        self.metrics.count("noor_requests_total", labels={"pipeline": self.name, "status": status})
+        record = {
+            "ts": self.wall, "trace_id": self.trace_id, "pipeline": self.name, "status": status,
+            "total_ms": round(total_ms, 3), "spans": self.spans, **self.attrs,
+        }
+        if self.error:
+            record["error"] = self.error
+        if self.log is not None:
+            try:
+                self.log.write(record)
+            except Exception as e:
+                print(f"Trace log error: {e}")
+        return record
@@ -0,0 +1,242 @@
+"""
+Noor-AI prompt cost: instruction caching and per-source input token reporting.
+The system instruction (16 rules, mostly Bangla) is identical on every turn.
+InstructionCache uploads it once per API key as Gemini cached content, and chat
+models built on that cache bill it at the cached-input rate instead of resending it.
+Caches live for CONTEXT_CACHE_TTL_S and are extended in the background once less
+than a fifth of that remains; a cache the provider no longer has is re-created.
+When caching is unavailable (tier, model, instruction below the minimum size, any
+API error) the key falls back to the inline instruction and creation is retried
+after CONTEXT_CACHE_RETRY_S. Cache calls never run on the request path.
+
+Every chat trace carries `input_tokens`: the estimated input split by source next
+to the prompt and cached token counts the API reported.
+
+Report:  python noor_prompt.py report [--traces .noor_cache/traces.jsonl] [--last 1000] [--json]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from noor_context import estimate_tokens
+from noor_keys import is_cache_miss
+
+SOURCES = ("instruction", "system_info", "core_memory", "summary", "retrieved", "history", "user_text")
+MIN_CACHE_TOKENS = 1024  # Smallest explicit cache Gemini 2.5 Flash accepts.
+TRACES_PATH = os.path.join(".noor_cache", "traces.jsonl")
+
+
+# --- 1. INSTRUCTION CACHE ---
+class InstructionCache:
+    def __init__(self, model_name, instruction, client_for_key, ttl=3600.0, retry_after=1800.0,
+                 min_tokens=MIN_CACHE_TOKENS, enabled=True, clock=time.time):
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+        self.instruction = instruction
+        self.instruction_tokens = estimate_tokens(instruction)
+        self.client_for_key = client_for_key
+        self.ttl = ttl
+        self.refresh_before = ttl / 5
+        self.retry_after = retry_after
+        self.clock = clock
+        self.enabled = enabled and self.instruction_tokens >= min_tokens
+        self.counters = {"created": 0, "extended": 0, "failed": 0, "hits": 0, "fallbacks": 0, "invalidated": 0}
+        self._entries = {}  # api_key -> {"name", "expires"} and/or {"retry_at"}
+        self._clients = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def name(self, api_key):
+        # The cache to build a chat model on for this key, or None for the inline instruction.
+        if not self.enabled:
+            return None
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(api_key, {})
+            live = bool(entry.get("name")) and entry["expires"] - now > 60  # Slack for the request itself.
+            stale = not live or entry["expires"] - now < self.refresh_before
+            due = stale and entry.get("retry_at", 0) <= now and api_key not in self._pending
+            if due:
+                self._pending.add(api_key)
+            self.counters["hits" if live else "fallbacks"] += 1
+        if due:
+            threading.Thread(target=self.refresh, args=(api_key,), name="noor-context-cache", daemon=True).start()
+        return entry["name"] if live else None
+
+    def _client(self, api_key):
+        with self._lock:
+            if api_key not in self._clients:
+                self._clients[api_key] = self.client_for_key(api_key)
+            return self._clients[api_key]
+
+    def refresh(self, api_key):
+        from google.generativeai import protos
+        from google.protobuf import field_mask_pb2
+
+        with self._lock:
+            entry = dict(self._entries.get(api_key, {}))
+        try:
+            client = self._client(api_key)
+            cached, kind = None, "created"
+            if entry.get("name") and entry["expires"] > self.clock():
+                try:
+                    cached = client.update_cached_content(protos.UpdateCachedContentRequest(
+                        cached_content=protos.CachedContent(name=entry["name"], ttl=timedelta(seconds=self.ttl)),
+                        update_mask=field_mask_pb2.FieldMask(paths=["ttl"]),
+                    ))
+                    kind = "extended"
+                except Exception as e:
+                    if not is_cache_miss(e):
+                        raise
+            if cached is None:
+                cached = client.create_cached_content(protos.CreateCachedContentRequest(cached_content=protos.CachedContent(
+                    model=self.model_name,
+                    display_name="noor-system-instruction",
+                    system_instruction=protos.Content(parts=[protos.Part(text=self.instruction)]),
+                    ttl=timedelta(seconds=self.ttl),
+                )))
+            stamp = cached.expire_time.timestamp() if cached.expire_time else 0
+            with self._lock:
+                self._entries[api_key] = {"name": cached.name, "expires": stamp if stamp > 0 else self.clock() + self.ttl}
+                self.counters[kind] += 1
+        except Exception as e:
+            print(f"Context cache error (using the inline instruction): {e}")
+            with self._lock:
+                # A cache that is still valid keeps serving until it expires.
+                self._entries[api_key] = dict(entry, retry_at=self.clock() + self.retry_after)
+                self.counters["failed"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(api_key)
+
+    def invalidate(self, api_key=None):
+        with self._lock:
+            for key in [api_key] if api_key else list(self._entries):
+                if self._entries.pop(key, None) is not None:
+                    self.counters["invalidated"] += 1
+
+    def delete_all(self):
+        from google.generativeai import protos
+
+        with self._lock:
+            entries = [(key, entry["name"]) for key, entry in self._entries.items() if entry.get("name")]
+            self._entries.clear()
+        for api_key, name in entries:
+            try:
+                self._client(api_key).delete_cached_content(protos.DeleteCachedContentRequest(name=name))
+            except Exception as e:
+                print(f"Context cache delete error: {e}")
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            live = [e for e in self._entries.values() if e.get("name") and e["expires"] > now]
+            return {
+                "enabled": self.enabled,
+                "instruction_tokens": self.instruction_tokens,
+                "live_caches": len(live),
+                "min_expires_in_s": round(min((e["expires"] - now for e in live), default=0.0), 1),
+                **self.counters,
+            }
+
+
+# --- 2. PER-SOURCE INPUT BREAKDOWN ---
+def input_breakdown(instruction_tokens, sections, usage=None, cached=False):
+    sources = {
+        "instruction": instruction_tokens,
+        "system_info": sections.get("system_info", 0),
+        "core_memory": sections.get("core_memory", 0),
+        "summary": sections.get("summary", 0),
+        "retrieved": sections.get("retrieved", 0),
+        "history": sections.get("history", 0),
+        "user_text": sections.get("question", 0),
+    }
+    estimated = sum(sources.values())
+    report = {
+        "sources": sources,
+        "estimated": estimated,
+        "instruction_cached": bool(cached),
+        # Tokens billed at the full input rate; a cached instruction is billed at the cached rate instead.
+        "estimated_uncached": estimated - (instruction_tokens if cached else 0),
+    }
+    if usage is not None:
+        report["prompt_tokens"] = getattr(usage, "prompt_token_count", 0) or 0
+        report["cached_tokens"] = getattr(usage, "cached_content_token_count", 0) or 0
+    return report
+
+
+def load_reports(path, last=1000):
+    reports = deque(maxlen=last)
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("pipeline") == "chat" and record.get("input_tokens"):
+                reports.append(record["input_tokens"])
+    return list(reports)
+
+
+def summarize_reports(reports):
+    def mean(values):
+        return round(sum(values) / len(values), 1) if values else 0.0
+
+    def p95(values):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * 0.95))] if values else 0
+
+    total = mean([r["estimated"] for r in reports])
+    summary = {"turns": len(reports), "estimated_mean": total, "sources": {}}
+    for source in SOURCES:
+        values = [r["sources"].get(source, 0) for r in reports]
+        summary["sources"][source] = {
+            "mean": mean(values), "p95": p95(values),
+            "share": round(mean(values) / total, 3) if total else 0.0,
+        }
+    summary["instruction_cached_ratio"] = round(sum(1 for r in reports if r.get("instruction_cached")) / len(reports), 3) if reports else 0.0
+    summary["estimated_uncached_mean"] = mean([r["estimated_uncached"] for r in reports])
+    reported = [r for r in reports if "prompt_tokens" in r]
+    if reported:
+        summary["prompt_tokens_mean"] = mean([r["prompt_tokens"] for r in reported])
+        summary["cached_tokens_mean"] = mean([r["cached_tokens"] for r in reported])
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['turns']} chat turns, estimated input {summary['estimated_mean']:.0f} tokens/turn")
+    print(f"{'source':<12} | {'mean':>7} | {'p95':>7} | share")
+    for source, row in summary["sources"].items():
+        print(f"{source:<12} | {row['mean']:7.0f} | {row['p95']:7.0f} | {row['share'] * 100:5.1f}%")
+    print(f"instruction served from cache on {summary['instruction_cached_ratio'] * 100:.0f}% of turns; "
+          f"full-rate input {summary['estimated_uncached_mean']:.0f} tokens/turn")
+    if "prompt_tokens_mean" in summary:
+        print(f"API reported: prompt {summary['prompt_tokens_mean']:.0f}, cached {summary['cached_tokens_mean']:.0f} tokens/turn")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI prompt cost tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="break down chat input tokens by source from the trace log")
+    report.add_argument("--traces", default=os.environ.get("TRACE_LOG_PATH", TRACES_PATH))
+    report.add_argument("--last", type=int, default=1000)
+    report.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    reports = load_reports(args.traces, args.last)
+    if not reports:
+        print(f"No chat traces with input_tokens in {args.traces}")
+        return
+    summary = summarize_reports(reports)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
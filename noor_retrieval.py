@@ -0,0 +1,426 @@
+"""
+Noor-AI retrieval index.
+In-memory inverted index with BM25 ranking over the `knowledge_base` collection.
+Built once per process from `load_knowledge_base()` so a chat message no longer
+streams the whole collection from Firestore. A char n-gram TF-IDF index covers
+Banglish, romanized Arabic and misspelled queries.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import re
+import struct
+import threading
+import unicodedata
+import zipfile
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# --- 1. TOKENIZER (BANGLA + ENGLISH) ---
+# Bangla block (letters, vowel signs, digits, ZWJ/ZWNJ) or ASCII words/digits.
+TOKEN_PATTERN = re.compile(r"[\u0980-\u09ff\u200c\u200d]+|[a-z0-9]+")
+
+BANGLA_SUFFIXES = sorted([
+    "গুলোর", "গুলো", "দের", "দেরকে", "েরা", "রা", "ের", "এর", "র", "কে", "তে", "টি", "টা", "ে",
+], key=len, reverse=True)
+
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "how", "why", "who", "when", "with", "about",
+    "this", "that", "you", "your", "can", "does", "from", "have", "has", "is", "a", "an",
+    "of", "in", "on", "to", "it", "i", "me", "my", "do", "be", "or",
+    "ki", "ke", "er", "ar", "kivabe", "keno",
+    "কি", "কী", "এবং", "ও", "আমি", "আমার", "আপনি", "তুমি", "কেন", "কিভাবে", "কীভাবে", "এই", "সেই", "যে", "না", "হয়", "করে",
+}
+
+
+def _stem(token):
+    if token.isascii():
+        return token
+    for suffix in BANGLA_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize("NFC", text).lower()
+    return [_stem(t) for t in TOKEN_PATTERN.findall(text) if t not in STOPWORDS]
+
+
+# --- 2. BM25 INVERTED INDEX ---
+class KnowledgeIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.articles = {}
+        self.postings = defaultdict(dict)
+        self.doc_len = {}
+        self.total_len = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, articles):
+        index = cls()
+        for i, article in enumerate(articles):
+            index.upsert(article.get("id", i), article)
+        return index
+
+    def __len__(self):
+        return len(self.articles)
+
+    def upsert(self, doc_id, article):
+        with self._lock:
+            self._add(doc_id, article)
+
+    def _add(self, doc_id, article):
+        if doc_id in self.articles:
+            self._remove(doc_id)
+        terms = tokenize(f"{article.get('title', '')} {article.get('content', '')}")
+        counts = defaultdict(int)
+        for term in terms:
+            counts[term] += 1
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.articles[doc_id] = article
+        self.doc_len[doc_id] = len(terms)
+        self.total_len += len(terms)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        article = self.articles.pop(doc_id, None)
+        if article is None:
+            return
+        for term in set(tokenize(f"{article.get('title', '')} {article.get('content', '')}")):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def score(self, query):
+        with self._lock:
+            return self._score(query)
+
+    def _score(self, query):
+        n_docs = len(self.articles)
+        if not n_docs:
+            return {}
+        avg_len = self.total_len / n_docs or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=2):
+        with self._lock:
+            scores = self._score(query)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [self.articles[doc_id] for doc_id, _ in top]
+
+
+# --- 3. BANGLISH / TYPO-TOLERANT CHAR N-GRAM INDEX ---
+BANGLA_TO_LATIN = {
+    "অ": "a", "আ": "a", "ই": "i", "ঈ": "i", "উ": "u", "ঊ": "u", "ঋ": "ri", "এ": "e", "ঐ": "oi", "ও": "o", "ঔ": "ou",
+    "া": "a", "ি": "i", "ী": "i", "ু": "u", "ূ": "u", "ৃ": "ri", "ে": "e", "ৈ": "oi", "ো": "o", "ৌ": "ou",
+    "ক": "k", "খ": "kh", "গ": "g", "ঘ": "gh", "ঙ": "ng", "চ": "ch", "ছ": "ch", "জ": "j", "ঝ": "jh", "ঞ": "n",
+    "ট": "t", "ঠ": "th", "ড": "d", "ঢ": "dh", "ণ": "n", "ত": "t", "থ": "th", "দ": "d", "ধ": "dh", "ন": "n",
+    "প": "p", "ফ": "f", "ব": "b", "ভ": "bh", "ম": "m", "য": "j", "র": "r", "ল": "l", "শ": "sh", "ষ": "sh",
+    "স": "s", "হ": "h", "ড়": "r", "ঢ়": "rh", "য়": "y", "ৎ": "t", "ং": "ng", "ঃ": "h", "ঁ": "n",
+}
+BANGLA_CONSONANTS = set("কখগঘঙচছজঝঞটঠডঢণতথদধনপফবভমযরলশষসহৎ") | {"ড়", "ঢ়", "য়"}
+BANGLA_SIGNS = set("ািীুূৃেৈোৌ্")
+
+# Spelling variants that romanized Bangla/Arabic terms swap freely (namaz/namaj, quran/kuran, ...).
+LATIN_FOLDS = [("ph", "f"), ("z", "j"), ("q", "k"), ("v", "b"), ("w", "o"), ("aa", "a"), ("ee", "i"), ("oo", "u")]
+
+
+def transliterate(word):
+    chars = []
+    i = 0
+    while i < len(word):
+        # NFC leaves ড়/ঢ়/য় decomposed as base + nukta.
+        char = word[i:i + 2] if word[i + 1:i + 2] == "়" else word[i]
+        i += len(char)
+        chars.append(char)
+    out = []
+    for i, char in enumerate(chars):
+        out.append(BANGLA_TO_LATIN.get(char, char if char.isascii() else ""))
+        nxt = chars[i + 1] if i + 1 < len(chars) else None
+        # Inherent vowel between two consonants.
+        if char in BANGLA_CONSONANTS and nxt in BANGLA_CONSONANTS:
+            out.append("a")
+    return "".join(out)
+
+
+def fold_latin(word):
+    for src, dst in LATIN_FOLDS:
+        word = word.replace(src, dst)
+    return word
+
+
+def char_ngrams(text, ngram_range=(2, 4)):
+    grams = []
+    text = unicodedata.normalize("NFC", text or "").lower()
+    for word in TOKEN_PATTERN.findall(text):
+        if word in STOPWORDS:
+            continue
+        forms = {fold_latin(word)} if word.isascii() else {word, fold_latin(transliterate(word))}
+        for form in forms:
+            padded = f" {form} "
+            for n in range(ngram_range[0], ngram_range[1] + 1):
+                grams.extend(padded[j:j + n] for j in range(len(padded) - n + 1))
+    return grams
+
+
+class CharNgramIndex:
+    """Hashed char n-gram TF-IDF matrix stored column-major (CSC); rows are L2-normalised articles.
+
+    Edits after the build go to a small delta segment and mask out the stale
+    base row; `compact()` folds them back into the matrix once the delta grows.
+    """
+
+    def __init__(self, n_features=2 ** 18, ngram_range=(2, 4)):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.doc_ids = []
+        self.articles = {}
+        self.fingerprint = ""
+        self.indptr = np.zeros(n_features + 1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.data = np.zeros(0, dtype=np.float32)
+        self.idf = np.ones(n_features, dtype=np.float32)
+        self.path = None
+        self._dead = np.zeros(0, dtype=bool)
+        self._row_of = {}
+        self._delta = {}
+        self._lock = threading.RLock()
+
+    def _hash(self, grams):
+        counts = defaultdict(int)
+        for gram in grams:
+            counts[zlib.crc32(gram.encode("utf-8")) % self.n_features] += 1
+        return counts
+
+    @classmethod
+    def build(cls, articles, **kwargs):
+        index = cls(**kwargs)
+        index.doc_ids = [article.get("id", i) for i, article in enumerate(articles)]
+        index.articles = dict(zip(index.doc_ids, articles))
+        index.fingerprint = corpus_fingerprint(articles)
+
+        rows, cols, tfs = [], [], []
+        for i, article in enumerate(articles):
+            counts = index._hash(char_ngrams(f"{article.get('title', '')} {article.get('content', '')}", index.ngram_range))
+            rows.append(np.full(len(counts), i, dtype=np.int32))
+            cols.append(np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)))
+            tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        tfs = np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.float32)
+
+        df = np.bincount(cols, minlength=index.n_features)
+        index.idf = (np.log((1 + len(articles)) / (1 + df)) + 1).astype(np.float32)
+        weights = (1 + np.log(tfs)) * index.idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=len(articles)))
+        weights = weights / np.maximum(norms, 1e-12)[rows]
+
+        order = np.argsort(cols, kind="stable")
+        index.indptr = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+        index.indices = rows[order]
+        index.data = weights[order].astype(np.float32)
+        index._reset_segments()
+        return index
+
+    def _reset_segments(self):
+        self._dead = np.zeros(len(self.doc_ids), dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        self._delta = {}
+
+    def __len__(self):
+        return len(self.articles)
+
+    @property
+    def needs_compaction(self):
+        return len(self._delta) > max(64, len(self.doc_ids) // 10)
+
+    def upsert(self, doc_id, article):
+        cols, weights = self.query_vector(f"{article.get('title', '')} {article.get('content', '')}")
+        with self._lock:
+            self._kill(doc_id)
+            self._delta[doc_id] = (cols, weights)
+            self.articles[doc_id] = article
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._kill(doc_id)
+            self._delta.pop(doc_id, None)
+            self.articles.pop(doc_id, None)
+
+    def _kill(self, doc_id):
+        row = self._row_of.get(doc_id)
+        if row is not None:
+            self._dead[row] = True
+
+    def compact(self):
+        with self._lock:
+            articles = list(self.articles.values())
+        fresh = type(self).build(articles, n_features=self.n_features, ngram_range=self.ngram_range)
+        with self._lock:
+            self.doc_ids, self.articles, self.fingerprint = fresh.doc_ids, fresh.articles, fresh.fingerprint
+            self.indptr, self.indices, self.data, self.idf = fresh.indptr, fresh.indices, fresh.data, fresh.idf
+            self._reset_segments()
+        if self.path:
+            try:
+                self.save(self.path)
+            except Exception as e:
+                print(f"N-gram index save error: {e}")
+
+    def query_vector(self, query):
+        # Also vectorises delta articles, which reuse the base idf.
+        counts = self._hash(char_ngrams(query, self.ngram_range))
+        cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        weights = (1 + np.log(tf)) * self.idf[cols]
+        return cols, weights / max(float(np.linalg.norm(weights)), 1e-12)
+
+    def scores(self, query):
+        cols, weights = self.query_vector(query)
+        with self._lock:
+            return self._base_scores(cols, weights)
+
+    def _base_scores(self, cols, weights):
+        # X @ q as one vectorised gather over the query's columns only.
+        starts, ends = self.indptr[cols], self.indptr[cols + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(len(self.doc_ids))
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        gather = offsets + np.arange(total)
+        return np.bincount(self.indices[gather], weights=self.data[gather] * np.repeat(weights, lengths), minlength=len(self.doc_ids))
+
+    def search(self, query, k=2, min_score=0.12):
+        cols, weights = self.query_vector(query)
+        with self._lock:
+            ranked = []
+            if self.doc_ids:
+                scores = self._base_scores(cols, weights)
+                scores[self._dead] = 0.0
+                top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+                ranked = [(float(scores[i]), self.doc_ids[i]) for i in top]
+            query_terms = dict(zip(cols.tolist(), weights.tolist()))
+            for doc_id, (doc_cols, doc_weights) in self._delta.items():
+                score = sum(query_terms.get(c, 0.0) * w for c, w in zip(doc_cols.tolist(), doc_weights.tolist()))
+                ranked.append((score, doc_id))
+            ranked.sort(key=lambda item: item[0], reverse=True)
+            return [self.articles[doc_id] for score, doc_id in ranked[:k] if score >= min_score]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        # Uncompressed so `load` can memory-map the members in place.
+        np.savez(
+            tmp_path,
+            indptr=self.indptr, indices=self.indices, data=self.data, idf=self.idf,
+            doc_ids=np.array([str(d) for d in self.doc_ids]),
+            meta=np.array([self.fingerprint, str(self.n_features), str(self.ngram_range[0]), str(self.ngram_range[1])]),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, articles):
+        arrays = _mmap_npz(path)
+        fingerprint, n_features, low, high = (str(v) for v in arrays["meta"])
+        if fingerprint != corpus_fingerprint(articles):
+            return None
+        index = cls(n_features=int(n_features), ngram_range=(int(low), int(high)))
+        index.fingerprint = fingerprint
+        # Ids as `build` keys them (the positional fallback ids are ints); the file only stores their text.
+        index.doc_ids = [article.get("id", i) for i, article in enumerate(articles)]
+        if [str(d) for d in index.doc_ids] != [str(d) for d in arrays["doc_ids"]]:
+            return None
+        index.articles = dict(zip(index.doc_ids, articles))
+        index.indptr, index.indices, index.data, index.idf = arrays["indptr"], arrays["indices"], arrays["data"], arrays["idf"]
+        index._reset_segments()
+        return index
+
+    @classmethod
+    def load_or_build(cls, path, articles, **kwargs):
+        if path and os.path.exists(path):
+            try:
+                index = cls.load(path, articles)
+                if index is not None:
+                    index.path = path
+                    return index
+            except Exception as e:
+                print(f"N-gram index load error: {e}")
+        index = cls.build(articles, **kwargs)
+        index.path = path
+        if path:
+            try:
+                index.save(path)
+            except Exception as e:
+                print(f"N-gram index save error: {e}")
+        return index
+
+
+def corpus_fingerprint(articles):
+    digest = hashlib.sha1()
+    for i, article in enumerate(articles):
+        for part in (article.get("id", i), article.get("title", ""), article.get("content", "")):
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _mmap_npz(path):
+    # np.load ignores mmap_mode for .npz, so map each stored (uncompressed) member directly.
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as fh:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+            fh.seek(info.header_offset)
+            local_header = fh.read(30)
+            name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+            fh.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(fh)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(fh)
+            if dtype.hasobject or not shape or 0 in shape:
+                fh.seek(info.header_offset + 30 + name_len + extra_len)
+                arrays[name] = np.lib.format.read_array(fh)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape, offset=fh.tell(), order="F" if fortran else "C")
+    return arrays
+
+
+# --- 4. RETRIEVAL MODES ---
+def hybrid_search(bm25_index, ngram_index, query, k=2, rrf_k=60):
+    # Reciprocal-rank fusion of exact-term BM25 hits and fuzzy n-gram hits.
+    fused = defaultdict(float)
+    articles = {}
+    for ranked in (bm25_index.search(query, k=k * 3), ngram_index.search(query, k=k * 3)):
+        for rank, article in enumerate(ranked):
+            key = id(article) if "id" not in article else article["id"]
+            fused[key] += 1.0 / (rrf_k + rank + 1)
+            articles[key] = article
+    return [articles[key] for key, _ in heapq.nlargest(k, fused.items(), key=lambda item: item[1])]
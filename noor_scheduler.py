@@ -0,0 +1,191 @@
+"""
+Noor-AI model request scheduler.
+One process-wide admission gate in front of every Gemini call. At most
+`max_concurrent` requests hold a slot; the rest wait in per-uid FIFO queues that
+are served round-robin, so a user with many requests in flight gets the same share
+as everyone else. A request is refused up front (Overloaded, with its queue
+position and an estimated wait) when the queue is full, the uid already has
+`max_queue_per_uid` waiting, or the estimated wait exceeds its deadline; a waiter
+whose deadline passes leaves the queue the same way.
+
+The wait estimate is an EWMA of slot hold time (time to the last streamed chunk)
+divided across the slots. Slots held longer than `max_hold` are reclaimed, so an
+abandoned stream cannot shrink the pool for good.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, position=0, wait_s=0.0):
+        self.reason = reason  # queue_full | user_limit | deadline | timeout
+        self.position = position
+        self.wait_s = wait_s
+        super().__init__(f"model scheduler is saturated ({reason}); {position} requests ahead, ~{wait_s:.0f}s wait")
+
+
+class Ticket:
+    def __init__(self, uid, deadline):
+        self.uid = uid
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.granted = None
+        self.event = threading.Event()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def wait_ms(self):
+        return round(((self.granted or time.monotonic()) - self.enqueued) * 1000, 1)
+
+
+class FairScheduler:
+    def __init__(self, max_concurrent=8, max_queue=64, max_queue_per_uid=2, deadline=20.0, service_time=6.0,
+                 max_hold=300.0, on_admit=None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.max_queue_per_uid = max_queue_per_uid
+        self.deadline = deadline
+        self.service_time = service_time
+        self.max_hold = max_hold
+        self.on_admit = on_admit
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_user_limit": 0, "shed_deadline": 0,
+                         "shed_timeout": 0, "reclaimed": 0}
+        self._queues = OrderedDict()  # uid -> deque of waiting tickets; the first uid is served next
+        self._active = {}
+        self._waits = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    # --- 1. QUEUE ACCOUNTING ---
+    def _queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _ahead(self, uid, k):
+        # Tickets served before the (k+1)-th ticket of `uid`: one per round from every other uid,
+        # plus one more from the uids that come earlier in the rotation.
+        ahead, earlier = k, True
+        for other, queue in self._queues.items():
+            if other == uid:
+                earlier = False
+                continue
+            ahead += min(len(queue), k + 1 if earlier else k)
+        return ahead
+
+    def _eta(self, position):
+        return (position + 1) * self.service_time / self.max_concurrent
+
+    def _reclaim(self, now):
+        for ticket in [t for t in self._active.values() if now - t.granted > self.max_hold]:
+            del self._active[id(ticket)]
+            self.counters["reclaimed"] += 1
+            print(f"Scheduler: reclaimed a slot held {now - ticket.granted:.0f}s by {ticket.uid}")
+
+    def _verdict(self, uid, budget):
+        self._dispatch()
+        if len(self._active) < self.max_concurrent and not self._queues:
+            return None
+        waiting = len(self._queues.get(uid, ()))
+        position = self._ahead(uid, waiting)
+        eta = self._eta(position)
+        if self._queued() >= self.max_queue:
+            return Overloaded("queue_full", position, eta)
+        if waiting >= self.max_queue_per_uid:
+            return Overloaded("user_limit", position, eta)
+        if eta > budget:
+            return Overloaded("deadline", position, eta)
+        return None
+
+    def _grant(self, ticket):
+        ticket.granted = time.monotonic()
+        self._active[id(ticket)] = ticket
+        self.counters["admitted"] += 1
+        self._waits.append(ticket.wait_ms)
+        ticket.event.set()
+
+    def _dispatch(self):
+        self._reclaim(time.monotonic())
+        while len(self._active) < self.max_concurrent and self._queues:
+            uid, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(uid)
+            else:
+                del self._queues[uid]
+            if ticket.remaining() > 0:
+                self._grant(ticket)
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.uid)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.uid]
+
+    # --- 2. ADMISSION ---
+    def check(self, uid, deadline=None):
+        # The Overloaded a new request from `uid` would get right now, or None.
+        with self._lock:
+            return self._verdict(uid, self.deadline if deadline is None else deadline)
+
+    def acquire(self, uid, deadline=None, on_wait=None, poll=1.0):
+        budget = self.deadline if deadline is None else deadline
+        ticket = Ticket(uid, time.monotonic() + budget)
+        with self._lock:
+            shed = self._verdict(uid, budget)
+            if shed is not None:
+                self.counters[f"shed_{shed.reason}"] += 1
+                raise shed
+            if len(self._active) < self.max_concurrent and not self._queues:
+                self._grant(ticket)
+            else:
+                self._queues.setdefault(uid, deque()).append(ticket)
+                self.counters["queued"] += 1
+        while not ticket.event.wait(min(poll, ticket.remaining())):
+            with self._lock:
+                self._dispatch()
+                if ticket.granted is not None:
+                    break
+                queue = self._queues.get(uid, ())
+                position = self._ahead(uid, queue.index(ticket) if ticket in queue else 0)
+                if ticket.remaining() <= 0:
+                    self._remove(ticket)
+                    self.counters["shed_timeout"] += 1
+                    raise Overloaded("timeout", position, self._eta(position))
+            if on_wait is not None:
+                on_wait(position, self._eta(position))
+        if self.on_admit is not None:
+            self.on_admit(ticket)
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            if self._active.pop(id(ticket), None) is None:
+                return
+            held = time.monotonic() - ticket.granted
+            self.service_time = 0.8 * self.service_time + 0.2 * held
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, uid, deadline=None, on_wait=None):
+        ticket = self.acquire(uid, deadline, on_wait)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "in_flight": len(self._active),
+                "queue_length": self._queued(),
+                "queued_users": len(self._queues),
+                "service_time_s": round(self.service_time, 3),
+                "wait_ms_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_ms_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                **self.counters,
+            }
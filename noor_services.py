@@ -0,0 +1,115 @@
+"""
+Noor-AI lazy service container.
+Heavy imports (google.generativeai, firebase_admin) and clients are created on
+first use instead of at import time, each exactly once per process even under
+concurrent sessions. `warm()` pre-creates them ahead of traffic, either from a
+background thread when the server starts or from the CLI below, which can also
+serve as a container health check (non-zero exit when a service fails).
+
+Warm up:  python noor_services.py warm [--only firestore,knowledge] [--json]
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import threading
+import time
+
+
+class LazyService:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.ready = False
+        self.error = None
+        self.init_ms = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.ready:
+            return self.value
+        with self._lock:
+            if not self.ready:
+                started = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    self.init_ms = (time.perf_counter() - started) * 1000
+                self.error = None
+                self.ready = True
+        return self.value
+
+
+class ServiceContainer:
+    def __init__(self):
+        self._services = {}
+        self._warm_thread = None
+
+    def register(self, name, factory):
+        self._services[name] = LazyService(name, factory)
+        return self
+
+    def get(self, name):
+        return self._services[name].get()
+
+    def ready(self, name):
+        return self._services[name].ready
+
+    def warm(self, names=None, log=print):
+        # Registration order is dependency order; a failing service is reported and the rest still warm.
+        timings = {}
+        for name in names or list(self._services):
+            started = time.perf_counter()
+            try:
+                self.get(name)
+                timings[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+            except Exception as e:
+                timings[name] = {"ok": False, "ms": round((time.perf_counter() - started) * 1000, 1), "error": str(e)}
+            if log is not None:
+                status = "ok" if timings[name]["ok"] else f"FAILED ({timings[name]['error']})"
+                log(f"warm-up {name:<12} {timings[name]['ms']:8.1f} ms  {status}")
+        return timings
+
+    def warm_async(self, names=None):
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(
+                target=self.warm, args=(names, None), name="noor-warmup", daemon=True
+            )
+            self._warm_thread.start()
+        return self._warm_thread
+
+    def status(self):
+        return {
+            name: {"ready": service.ready, "init_ms": service.init_ms, "error": service.error}
+            for name, service in self._services.items()
+        }
+
+
+def lazy_import(module_name):
+    return lambda: importlib.import_module(module_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI service warm-up")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warm", help="create clients, load and index the knowledge base, build the shared model")
+    warm.add_argument("--only", help="comma-separated service names (default: all)")
+    warm.add_argument("--json", action="store_true", help="print timings as JSON")
+    args = parser.parse_args(argv)
+
+    # The chat core owns the service factories; settings come from .streamlit/secrets.toml and the environment.
+    from noor_core import NoorCore, file_settings
+
+    timings = NoorCore(file_settings()).services.warm(args.only.split(",") if args.only else None, log=None if args.json else print)
+    if args.json:
+        print(json.dumps(timings, indent=2))
+    sys.exit(0 if all(t["ok"] for t in timings.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
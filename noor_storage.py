@@ -0,0 +1,532 @@
+"""
+Noor-AI storage backends.
+Every data access (knowledge sync, chat writes, history, core memory, sessions,
+buckets) goes through one interface: the subset of the Firestore client API that
+noor_fakes also implements (collections and subcollections, documents,
+where/order_by/limit/cursors, batches, Increment/ArrayUnion transforms).
+STORAGE_BACKEND picks the implementation:
+
+  firestore  firebase_admin client (service_account.json or [firebase] secrets)
+  sqlite     one local file (SQLITE_PATH): WAL journal, one row per document,
+             expression indexes on (uid, timestamp), and an FTS5 table that
+             triggers keep in step with `knowledge_base`
+  auto       Firestore when it initializes, otherwise SQLite (default)
+
+The admin CLIs (export, migrate, backfill) open their database with open_store(), which
+reads STORAGE_BACKEND=sqlite and SQLITE_PATH from the environment.
+
+Conformance:  python -m pytest tests/test_storage.py   (NOOR_TEST_FIRESTORE=service_account.json adds Firestore)
+Latency:      python noor_storage.py latency [--backend sqlite|memory|firestore] [--path noor.sqlite3]
+Copy data:    python noor_storage.py copy [--to noor.sqlite3] [--collections knowledge_base,chats,core_memory]
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+SQLITE_PATH = "noor.sqlite3"
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+TS_KEY = "$ts"  # Datetimes are stored as {"$ts": ISO-8601 UTC}, so they compare in SQL as text.
+
+# unicode61 splits on combining marks; Bangla vowel signs and hasanta must stay inside a word.
+BANGLA_MARKS = "".join(ch for ch in map(chr, range(0x0980, 0x0A00)) if unicodedata.category(ch) in ("Mn", "Mc"))
+WORD = re.compile(rf"[\w{BANGLA_MARKS}]+")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS documents (
+        parent TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (parent, id)
+    ) WITHOUT ROWID""",
+    # Same expressions as the query builder emits, so the planner can use them; the primary key
+    # rides along in every index entry, which also covers the document-id tie-break.
+    """CREATE INDEX IF NOT EXISTS documents_uid_timestamp
+        ON documents (parent, json_extract(data, '$."uid"'), json_extract(data, '$."timestamp"'))""",
+    """CREATE INDEX IF NOT EXISTS documents_index
+        ON documents (parent, json_extract(data, '$."index"'))""",
+    """CREATE INDEX IF NOT EXISTS documents_updated_at
+        ON documents (parent, json_extract(data, '$."updated_at"'))""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+        doc_id UNINDEXED, title, content,
+        tokenize = "unicode61 remove_diacritics 2 tokenchars '{BANGLA_MARKS}'"
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS knowledge_fts_insert AFTER INSERT ON documents
+        WHEN new.parent = 'knowledge_base' AND NOT coalesce(json_extract(new.data, '$."deleted"'), 0) BEGIN
+        INSERT INTO knowledge_fts (doc_id, title, content)
+        VALUES (new.id, coalesce(json_extract(new.data, '$."title"'), ''), coalesce(json_extract(new.data, '$."content"'), ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS knowledge_fts_update AFTER UPDATE ON documents
+        WHEN new.parent = 'knowledge_base' BEGIN
+        DELETE FROM knowledge_fts WHERE doc_id = old.id;
+        INSERT INTO knowledge_fts (doc_id, title, content)
+        SELECT new.id, coalesce(json_extract(new.data, '$."title"'), ''), coalesce(json_extract(new.data, '$."content"'), '')
+        WHERE NOT coalesce(json_extract(new.data, '$."deleted"'), 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS knowledge_fts_delete AFTER DELETE ON documents
+        WHEN old.parent = 'knowledge_base' BEGIN
+        DELETE FROM knowledge_fts WHERE doc_id = old.id;
+    END""",
+]
+
+
+# --- 1. VALUE ENCODING ---
+def _utc(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {TS_KEY: _utc(value).isoformat(timespec="microseconds")}
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _dumps(value):
+    return json.dumps(_encode(value), ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and TS_KEY in obj:
+        return datetime.fromisoformat(obj[TS_KEY])
+    return obj
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+def _param(value):
+    # Bound the way json_extract() returns the stored value: scalars as SQL values, objects as compact JSON text.
+    if isinstance(value, (datetime, dict, list, tuple)):
+        return _dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _path(field):
+    if '"' in field or "'" in field:
+        raise ValueError(f"Unsupported field path: {field}")
+    return "'$." + ".".join(f'"{part}"' for part in field.split(".")) + "'"
+
+
+def _field(field):
+    return "id" if field == "__name__" else f"json_extract(data, {_path(field)})"
+
+
+_DELETE = object()
+
+
+def _resolve(value, current=None, merge=False):
+    # firebase_admin sentinels are matched by type name so this module never imports the SDK.
+    kind = type(value).__name__
+    if kind == "Sentinel":
+        return _DELETE if "delete" in str(getattr(value, "description", "")).lower() else datetime.now(timezone.utc)
+    if kind == "Increment":
+        return (current or 0) + value.value
+    if kind == "ArrayUnion":
+        base = list(current or [])
+        return base + [v for v in value.values if v not in base]
+    if kind == "ArrayRemove":
+        return [v for v in (current or []) if v not in value.values]
+    if isinstance(value, dict):
+        current = current if isinstance(current, dict) else {}
+        # set(merge=True) merges nested maps field by field, as Firestore does; other writes replace them.
+        resolved = dict(current) if merge else {}
+        resolved.update((k, _resolve(v, current.get(k), merge)) for k, v in value.items())
+        return resolved
+    return value
+
+
+def _assign(target, key, value, merge=False):
+    resolved = _resolve(value, target.get(key), merge)
+    if resolved is _DELETE:
+        target.pop(key, None)
+    else:
+        target[key] = resolved
+
+
+# --- 2. DOCUMENTS, QUERIES, BATCHES ---
+class SQLiteSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+
+class SQLiteDocumentReference:
+    def __init__(self, store, parent, doc_id):
+        self._store = store
+        self._parent = parent
+        self.id = doc_id
+        self.path = f"{parent}/{doc_id}"
+
+    def collection(self, name):
+        return SQLiteCollection(self._store, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        row = self._store._conn().execute(
+            "SELECT data FROM documents WHERE parent = ? AND id = ?", (self._parent, self.id)
+        ).fetchone()
+        self._store.reads += 1
+        return SQLiteSnapshot(self, _loads(row[0]) if row else None)
+
+    def set(self, data, merge=False):
+        with self._store.transaction() as conn:
+            self._store._write(conn, self, data, merge=merge)
+
+    def update(self, data):
+        with self._store.transaction() as conn:
+            self._store._write(conn, self, data, merge=True, dotted=True)
+
+    def delete(self):
+        with self._store.transaction() as conn:
+            self._store._delete(conn, self)
+
+
+class SQLiteQuery:
+    def __init__(self, store, parent, filters=(), orders=(), limit_count=None, cursor=None, last=False):
+        self._store = store
+        self._parent = parent
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit_count
+        self._cursor = cursor
+        self._last = last
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit_count=self._limit, cursor=self._cursor, last=self._last)
+        state.update(changes)
+        return SQLiteQuery(self._store, self._parent, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit_count=count, last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit_count=count, last=True)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def _sql(self):
+        where, params = ["parent = ?"], [self._parent]
+        for field, op, value in self._filters:
+            column = _field(field)
+            if op == "==" and value is None:
+                where.append(f"json_type(data, {_path(field)}) = 'null'")
+            elif op in ("==", "!=", "<", "<=", ">", ">="):
+                where.append(f"{column} {'=' if op == '==' else op} ?")
+                params.append(_param(value))
+            elif op == "in":
+                where.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(_param(v) for v in value)
+            elif op == "array_contains":
+                where.append(f"EXISTS (SELECT 1 FROM json_each(data, {_path(field)}) WHERE json_each.value = ?)")
+                params.append(_param(value))
+            else:
+                raise ValueError(f"Unsupported operator: {op}")
+        # Like Firestore: ordering on a field drops documents without it, and the document id breaks ties.
+        orders = list(self._orders)
+        for field, _ in orders:
+            if field != "__name__":
+                where.append(f"{_field(field)} IS NOT NULL")
+        if not any(field == "__name__" for field, _ in orders):
+            orders.append(("__name__", orders[-1][1] if orders else ASCENDING))
+        if self._last:
+            orders = [(field, ASCENDING if direction == DESCENDING else DESCENDING) for field, direction in orders]
+        if self._cursor is not None:
+            clause, values = self._after(orders)
+            where.append(clause)
+            params.extend(values)
+        sql = "SELECT id, data FROM documents WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + ", ".join(f"{_field(field)} {'DESC' if direction == DESCENDING else 'ASC'}" for field, direction in orders)
+        if self._limit is not None:
+            sql += " LIMIT ?"
+            params.append(self._limit)
+        return sql, params
+
+    def _after(self, orders):
+        cursor = self._cursor
+        if isinstance(cursor, dict):
+            boundary = [(field, direction, cursor[field]) for field, direction in orders if field in cursor]
+        else:
+            boundary = [(field, direction, cursor.id if field == "__name__" else cursor.get(field)) for field, direction in orders]
+        alternatives, params = [], []
+        for i, (field, direction, value) in enumerate(boundary):
+            terms = [f"{_field(f)} = ?" for f, _, _ in boundary[:i]]
+            terms.append(f"{_field(field)} {'<' if direction == DESCENDING else '>'} ?")
+            alternatives.append("(" + " AND ".join(terms) + ")")
+            params.extend(_param(v) for _, _, v in boundary[:i])
+            params.append(_param(value))
+        return "(" + " OR ".join(alternatives or ["1"]) + ")", params
+
+    def stream(self, transaction=None):
+        sql, params = self._sql()
+        rows = self._store._conn().execute(sql, params).fetchall()
+        if self._last:
+            rows.reverse()
+        self._store.reads += max(len(rows), 1)
+        return iter([SQLiteSnapshot(SQLiteDocumentReference(self._store, self._parent, doc_id), _loads(data)) for doc_id, data in rows])
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("SQLite storage has no snapshot listeners; use KB_SYNC_MODE=poll")
+
+
+class SQLiteCollection(SQLiteQuery):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return SQLiteDocumentReference(self._store, self._parent, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class SQLiteWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._ops.append(("update", reference, data, True))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None, False))
+
+    def commit(self):
+        # All or nothing, like a Firestore batch.
+        with self._store.transaction() as conn:
+            for op, reference, data, merge in self._ops:
+                if op == "delete":
+                    self._store._delete(conn, reference)
+                else:
+                    self._store._write(conn, reference, data, merge=merge, dotted=op == "update")
+        self._ops = []
+
+
+# --- 3. SQLITE STORE ---
+class SQLiteStore:
+    supports_listeners = False
+
+    def __init__(self, path=SQLITE_PATH, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self.reads = 0
+        self.writes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self):
+        # One connection per thread: WAL lets readers run while the writer thread commits.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def collection(self, path):
+        return SQLiteCollection(self, path)
+
+    def batch(self):
+        return SQLiteWriteBatch(self)
+
+    def _write(self, conn, reference, data, merge=False, dotted=False):
+        current = {}
+        if merge:
+            row = conn.execute("SELECT data FROM documents WHERE parent = ? AND id = ?", (reference._parent, reference.id)).fetchone()
+            if row is None and dotted:
+                raise KeyError(f"No document to update: {reference.path}")
+            current = _loads(row[0]) if row else {}
+        for key, value in data.items():
+            if dotted and "." in key:
+                head, *rest = key.split(".")
+                target = current.setdefault(head, {})
+                for part in rest[:-1]:
+                    target = target.setdefault(part, {})
+                _assign(target, rest[-1], value)
+            else:
+                _assign(current, key, value, merge and not dotted)
+        conn.execute(
+            "INSERT INTO documents (parent, id, data) VALUES (?, ?, ?) "
+            "ON CONFLICT (parent, id) DO UPDATE SET data = excluded.data",
+            (reference._parent, reference.id, _dumps(current)),
+        )
+        self.writes += 1
+
+    def _delete(self, conn, reference):
+        if conn.execute("DELETE FROM documents WHERE parent = ? AND id = ?", (reference._parent, reference.id)).rowcount:
+            self.writes += 1
+
+    def search_knowledge(self, query, k=2):
+        terms = list(dict.fromkeys(WORD.findall(query.lower())))
+        if not terms:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = self._conn().execute(
+            "SELECT d.id, d.data FROM knowledge_fts f JOIN documents d ON d.parent = 'knowledge_base' AND d.id = f.doc_id "
+            "WHERE knowledge_fts MATCH ? ORDER BY bm25(knowledge_fts, 0.0, 2.0, 1.0) LIMIT ?",
+            (match, k),
+        ).fetchall()
+        return [{"id": doc_id, **_loads(data)} for doc_id, data in rows]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# --- 4. READ LATENCY ---
+def measure_reads(db, samples=200, log=print):
+    # A fresh parent per run, so runs against a shared store never see each other's documents.
+    chats = db.collection("_latency").document(uuid.uuid4().hex[:12]).collection("chats")
+    batch = db.batch()
+    base = datetime.now(timezone.utc)
+    for i in range(100):
+        batch.set(chats.document(f"t{i:03d}"), {"uid": "Noor-LAT001", "user": f"q{i}", "timestamp": base + timedelta(seconds=i)})
+    batch.commit()
+    try:
+        timings = {"get": [], "recent(50)": []}
+        for i in range(samples):
+            started = time.perf_counter()
+            chats.document(f"t{i % 100:03d}").get()
+            timings["get"].append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            list(chats.where("uid", "==", "Noor-LAT001").order_by("timestamp", direction=DESCENDING).limit(50).stream())
+            timings["recent(50)"].append((time.perf_counter() - started) * 1000)
+        log("latency: " + ", ".join(f"{name} p50 {statistics.median(values):.3f} ms" for name, values in timings.items()))
+        return timings
+    finally:
+        for snapshot in list(chats.stream()):
+            snapshot.reference.delete()
+
+
+# --- 5. CLI ---
+def open_store(settings, service_account="service_account.json", backend=None):
+    # The admin CLIs' database: STORAGE_BACKEND=sqlite opens SQLITE_PATH, anything else Firestore.
+    backend = (backend or settings("STORAGE_BACKEND", "firestore") or "firestore").lower()
+    if backend == "sqlite":
+        return SQLiteStore(settings("SQLITE_PATH", SQLITE_PATH))
+    if backend == "memory":
+        from noor_fakes import FakeFirestore
+
+        return FakeFirestore()
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(service_account))
+    return firestore.client()
+
+
+def copy_collections(source, target, collections, page_size=500, log=print):
+    counts = {}
+    for name in collections:
+        cursor, copied = None, 0
+        while True:
+            query = source.collection(name).order_by("__name__").limit(page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = list(query.stream())
+            batch = target.batch()
+            for snapshot in page:
+                batch.set(target.collection(name).document(snapshot.id), snapshot.to_dict())
+            batch.commit()
+            copied += len(page)
+            if len(page) < page_size:
+                break
+            cursor = page[-1]
+        counts[name] = copied
+        if log is not None:
+            log(f"copied {copied} documents from {name}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Noor-AI storage backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+    latency = sub.add_parser("latency", help="measure document and recent-window read latency on a backend")
+    latency.add_argument("--backend", choices=["sqlite", "memory", "firestore"], default="sqlite")
+    latency.add_argument("--path", help="SQLite file (default: a temporary file)")
+    latency.add_argument("--service-account", default="service_account.json")
+    copy = sub.add_parser("copy", help="copy top-level Firestore collections into a SQLite file")
+    copy.add_argument("--to", default=SQLITE_PATH)
+    copy.add_argument("--collections", default="knowledge_base,chats,core_memory")
+    copy.add_argument("--service-account", default="service_account.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "copy":
+        source = open_store(os.environ.get, args.service_account, backend="firestore")
+        copy_collections(source, SQLiteStore(args.to), [c.strip() for c in args.collections.split(",") if c.strip()])
+        return
+    with tempfile.TemporaryDirectory() as workdir:
+        path = args.path or os.path.join(workdir, "latency.sqlite3")
+        db = open_store(lambda name, default=None: path if name == "SQLITE_PATH" else default,
+                        args.service_account, backend=args.backend)
+        measure_reads(db)
+        if isinstance(db, SQLiteStore):
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
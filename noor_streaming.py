@@ -0,0 +1,62 @@
+"""
+Noor-AI streaming renderer.
+`st.write_stream` re-renders the whole growing answer as markdown for every Gemini
+chunk. StreamRenderer shows the first chunk immediately, then buffers and flushes
+on a time interval or once enough new text has piled up, and records
+time-to-first-token and tokens/sec for every response.
+"""
+
+import time
+
+from noor_context import estimate_tokens
+
+CURSOR = "▕"
+
+
+class StreamRenderer:
+    def __init__(self, placeholder, interval=0.15, max_chars=400, clock=time.perf_counter):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_chars = max_chars
+        self.clock = clock
+        self.stats = {}
+
+    def render(self, chunks, started=None):
+        # `started` is when the request was sent, so TTFT includes the model's think time.
+        started = self.clock() if started is None else started
+        text, pending = "", 0
+        first_at = last_flush = None
+        render_calls = bytes_sent = chunk_count = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            now = self.clock()
+            chunk_count += 1
+            text += chunk
+            pending += len(chunk)
+            if first_at is None:
+                first_at = now
+            elif now - last_flush < self.interval and pending < self.max_chars:
+                continue
+            frame = text + CURSOR
+            self.placeholder.markdown(frame)
+            render_calls += 1
+            bytes_sent += len(frame.encode("utf-8"))
+            last_flush, pending = now, 0
+        if text:
+            self.placeholder.markdown(text)
+            render_calls += 1
+            bytes_sent += len(text.encode("utf-8"))
+        finished = self.clock()
+        generation_s = finished - first_at if first_at is not None else 0.0
+        tokens = estimate_tokens(text)
+        self.stats = {
+            "ttft_ms": round((first_at - started) * 1000, 1) if first_at is not None else None,
+            "total_ms": round((finished - started) * 1000, 1),
+            "chunks": chunk_count,
+            "render_calls": render_calls,
+            "bytes_sent": bytes_sent,
+            "tokens": tokens,
+            "tokens_per_s": round(tokens / generation_s, 1) if generation_s > 0 else None,
+        }
+        return text
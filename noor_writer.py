@@ -0,0 +1,228 @@
+"""
+Noor-AI write-behind chat persistence.
+A background thread owns a bounded queue of finished turns, commits them to the
+`chats` collection and/or per-user buckets (noor_buckets) in batched writes with
+exponential-backoff retry, and spills
+to a local append-only JSONL journal when Firestore is unreachable. The journal
+is replayed on startup (and again after the backend recovers). Each turn gets its
+document id when it is submitted and keeps it through retries, the journal and
+replays, so a commit that timed out after landing is overwritten, not duplicated.
+"""
+
+import glob
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+def _new_id():
+    return uuid.uuid4().hex[:20]
+
+
+def _encode(turn, doc_id):
+    # The document id travels with the turn, so a retry or a replay overwrites instead of duplicating.
+    record = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in turn.items()}
+    record["_id"] = doc_id
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _decode(line):
+    turn = json.loads(line)
+    if isinstance(turn.get("timestamp"), str):
+        turn["timestamp"] = datetime.fromisoformat(turn["timestamp"])
+    return turn.pop("_id", None) or _new_id(), turn
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class ChatWriter:
+    def __init__(self, db, journal_path, collection="chats", max_queue=1000, batch_size=50,
+                 flush_interval=0.5, max_retries=5, backoff=0.5, max_backoff=8.0, after_commit=None,
+                 buckets=None):
+        self.db = db
+        self.journal_path = journal_path
+        self.collection = collection
+        self.batch_size = min(batch_size, 500)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.after_commit = after_commit
+        self.buckets = buckets
+        self.counters = {
+            "enqueued": 0, "written": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0,
+            "flush_ms_last": 0.0, "flush_ms_max": 0.0, "flush_ms_total": 0.0, "lag_ms_max": 0.0,
+        }
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Public API ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="noor-chat-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, turn):
+        item = (time.monotonic(), turn, _new_id())
+        self._count("enqueued")
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            # Never block the reply on persistence; the journal is replayed later.
+            self._spill([item])
+            return False
+
+    def flush(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def stop(self, timeout=5.0):
+        self.flush(timeout)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["flush_ms_avg"] = stats["flush_ms_total"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    # --- Journal ---
+    def replay_journal(self):
+        if not self.journal_path:
+            return 0
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                os.replace(self.journal_path, f"{self.journal_path}.{time.time_ns()}.replay")
+        replayed = 0
+        for replay_path in self._claim_replays():
+            with open(replay_path, "r", encoding="utf-8") as fh:
+                items = [(time.monotonic(), turn, doc_id) for doc_id, turn in map(_decode, filter(str.strip, fh))]
+            # Every item ends up either committed or spilled to a fresh journal.
+            for start in range(0, len(items), self.batch_size):
+                self._write(items[start:start + self.batch_size])
+            os.remove(replay_path)
+            replayed += len(items)
+        self._count("replayed", replayed)
+        return replayed
+
+    def _claim_replays(self):
+        # Workers sharing a journal path each claim a file by renaming it to their pid; the rename is atomic,
+        # so exactly one of them replays it. Files claimed by a process that died mid-replay are claimed again.
+        pattern = glob.escape(self.journal_path)
+        claimed = []
+        candidates = sorted(glob.glob(f"{pattern}.*.replay"))
+        for path in sorted(glob.glob(f"{pattern}.*.replay.*")):
+            owner = path.rsplit(".", 1)[1]
+            if owner.isdigit() and int(owner) != os.getpid() and not _pid_alive(int(owner)):
+                candidates.append(path)
+        for path in candidates:
+            base = path if path.endswith(".replay") else path.rsplit(".", 1)[0]
+            target = f"{base}.{os.getpid()}"
+            try:
+                os.rename(path, target)
+            except OSError:
+                continue  # Another worker claimed it first.
+            claimed.append(target)
+        return claimed
+
+    def _spill(self, items):
+        if not self.journal_path:
+            print(f"Chat writer dropped {len(items)} turns (no journal configured)")
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        with self._journal_lock, open(self.journal_path, "a", encoding="utf-8") as fh:
+            for _, turn, doc_id in items:
+                fh.write(_encode(turn, doc_id) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._count("spilled", len(items))
+
+    # --- Worker ---
+    def _run(self):
+        try:
+            self.replay_journal()
+        except Exception as e:
+            print(f"Chat journal replay error: {e}")
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self._write(items) and self.journal_path and os.path.exists(self.journal_path):
+                    self.replay_journal()
+            except Exception as e:
+                print(f"Chat writer error: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write(self, items):
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                batch = self.db.batch()
+                if self.collection:
+                    for _, turn, doc_id in items:
+                        batch.set(self.db.collection(self.collection).document(doc_id), turn)
+                plan = self.buckets.stage(batch, [turn for _, turn, _ in items]) if self.buckets is not None else None
+                batch.commit()
+                if plan is not None:
+                    self.buckets.committed(plan)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Chat writer giving up after {attempt + 1} attempts: {e}")
+                    self._spill(items)
+                    return False
+                self._count("retries")
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                if self._stop.wait(delay * random.uniform(0.5, 1.0)):
+                    self._spill(items)
+                    return False
+                continue
+            finished = time.monotonic()
+            flush_ms = (finished - started) * 1000
+            with self._stats_lock:
+                self.counters["written"] += len(items)
+                self.counters["batches"] += 1
+                self.counters["flush_ms_last"] = flush_ms
+                self.counters["flush_ms_total"] += flush_ms
+                self.counters["flush_ms_max"] = max(self.counters["flush_ms_max"], flush_ms)
+                self.counters["lag_ms_max"] = max(self.counters["lag_ms_max"], (finished - items[0][0]) * 1000)
+            if self.after_commit is not None:
+                try:
+                    self.after_commit([turn for _, turn, _ in items])
+                except Exception as e:
+                    print(f"Chat writer after-commit error: {e}")
+            return True
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.counters[name] += amount
@@ -0,0 +1,45 @@
+import importlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+UID = "Noor-TEST01"
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("api")
+    with pytest.MonkeyPatch.context() as env:
+        for name, value in {
+            "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(workdir / "noor.sqlite3"), "STORAGE_LAYOUT": "dual",
+            "GOOGLE_API_KEYS": "test-key", "KB_SNAPSHOT_PATH": str(workdir / "knowledge_base.json"),
+            "CHAT_JOURNAL_PATH": str(workdir / "chat_journal.jsonl"), "TRACE_LOG_PATH": str(workdir / "traces.jsonl"),
+        }.items():
+            env.setenv(name, value)
+        noor_api = importlib.import_module("noor_api")
+        chats = noor_api.core.db().collection("chats")
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for i in range(5):
+            chats.document(f"c{i}").set({"uid": UID, "user": f"q{i}", "ai": f"a{i}", "timestamp": base + timedelta(minutes=i)})
+        with TestClient(noor_api.app) as client:
+            yield client
+
+
+def test_history_accepts_a_naive_before_as_utc(client):
+    response = client.get(f"/v1/history/{UID}", params={"before": "2024-01-01T00:03:00", "limit": 10})
+    assert response.status_code == 200
+    assert [turn["user"] for turn in response.json()["turns"]] == ["q0", "q1", "q2"]
+    assert client.get(f"/v1/history/{UID}", params={"before": "yesterday"}).status_code == 400
+
+
+def test_websocket_rejects_frames_that_are_not_json_objects(client):
+    with client.websocket_connect(f"/v1/ws/{UID}") as ws:
+        for frame in ("not json", "[1, 2]", '"text"'):
+            ws.send_text(frame)
+            assert ws.receive_json()["kind"] == "request"
+        ws.send_json({"message": " "})
+        assert ws.receive_json()["message"] == "empty message"
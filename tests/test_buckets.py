@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+from noor_buckets import BucketStore, migrate
+from noor_fakes import FakeFirestore
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def turn(uid, i):
+    return {"uid": uid, "user": f"q{i}", "ai": f"a{i}", "timestamp": BASE + timedelta(minutes=i)}
+
+
+def append(store, db, turns):
+    batch = db.batch()
+    plan = store.stage(batch, turns)
+    batch.commit()
+    return plan
+
+
+def test_resent_batch_does_not_double_counters():
+    db = FakeFirestore()
+    store = BucketStore(db, bucket_size=5)
+    append(store, db, [turn("Noor-AAAA01", i) for i in range(3)])
+    store.committed(append(store, db, [turn("Noor-AAAA01", i) for i in range(3)]))
+    batch = db.batch()
+    store.stage(batch, [turn("Noor-AAAA01", i) for i in range(3, 7)])
+    batch.commit()  # Committed, but the writer saw an error and re-sends the same batch.
+    store.committed(append(store, db, [turn("Noor-AAAA01", i) for i in range(3, 7)]))
+    header = store.header_ref("Noor-AAAA01").get().to_dict()
+    assert header["turns"] == 7 and header["latest_bucket"] == 1 and header["latest_count"] == 2
+    counts = {s.id: s.to_dict()["count"] for s in store.buckets("Noor-AAAA01").stream()}
+    assert sorted(counts.values()) == [2, 5]
+    assert [t["user"] for t in store.iter_turns("Noor-AAAA01")] == [f"q{i}" for i in range(7)]
+
+
+def write_chats(db, turns):
+    for t in turns:
+        db.collection("chats").document(f"{t['uid']}-{t['user']}").set(t)
+
+
+def test_migrate_buckets_turns_that_only_reached_chats():
+    db = FakeFirestore()
+    uid = "Noor-AAAA01"
+    write_chats(db, [turn(uid, i) for i in range(10)])  # The flat era.
+    live = BucketStore(db, bucket_size=5)
+    dual = [turn(uid, i) for i in range(10, 13)]
+    write_chats(db, dual)
+    live.committed(append(live, db, dual))  # A "dual" writer.
+    write_chats(db, [turn(uid, i) for i in (13, 14)])  # A process still on "flat".
+
+    stats = migrate(db, bucket_size=4, log=None)
+    assert (stats["migrated"], stats["appended_live"], stats["already_bucketed"], stats["users"]) == (10, 2, 3, 1)
+    store = BucketStore(db)
+    assert store.migrated(uid)
+    assert [t["user"] for t in store.iter_turns(uid)] == [f"q{i}" for i in range(15)]
+    assert [t["user"] for t in store.load_recent(uid, 5)] == [f"q{i}" for i in range(10, 15)]
+
+    write_chats(db, [turn(uid, 15)])
+    stats = migrate(db, bucket_size=4, log=None)
+    assert (stats["migrated"], stats["appended_live"], stats["already_bucketed"]) == (0, 1, 15)
+    assert migrate(db, bucket_size=4, log=None)["users"] == 0, "nothing left to migrate"
+    assert [t["user"] for t in BucketStore(db).iter_turns(uid)] == [f"q{i}" for i in range(16)]
+
+
+def test_migrate_resumes_packing_after_existing_migrated_buckets():
+    db = FakeFirestore()
+    uid = "Noor-BBBB02"
+    write_chats(db, [turn(uid, i) for i in range(6)])
+    migrate(db, bucket_size=4, log=None)
+    write_chats(db, [turn(uid, i) for i in range(6, 9)])  # No live buckets yet: still the pre-live era.
+    stats = migrate(db, bucket_size=4, log=None)
+    assert (stats["migrated"], stats["already_bucketed"]) == (3, 6)
+    store = BucketStore(db)
+    assert [t["user"] for t in store.iter_turns(uid)] == [f"q{i}" for i in range(9)]
+    assert store.header_ref(uid).get().to_dict()["migrated_turns"] == 9
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+from noor_core import ChatTurn
+from noor_keys import KeyPool
+from noor_metrics import Metrics, Trace
+from noor_scheduler import FairScheduler
+
+
+class Core:
+    def __init__(self):
+        self.pool = KeyPool(["key-a", "key-b"], client_factory=lambda key: None)
+        self._scheduler = FairScheduler()
+        self._metrics = Metrics()
+
+    def key_pool(self):
+        return self.pool
+
+    def scheduler(self):
+        return self._scheduler
+
+    def metrics(self):
+        return self._metrics
+
+
+def streaming_turn(core, probing=False):
+    turn = ChatTurn(core, {"uid": "Noor-TEST01"}, "hello", Trace(core.metrics(), "chat"))
+    if probing:
+        state = core.pool.keys[0]
+        state.bench_seconds = 5.0  # Bench expired: the next lease is the half-open probe.
+        core.pool.keys[1].benched_until = float("inf")
+    turn.ticket = core.scheduler().acquire("Noor-TEST01")
+    turn.lease = core.pool.acquire()
+    turn.response = [SimpleNamespace(text=f"part {i} ") for i in range(5)]
+    turn.sent_at = 0.0
+    return turn
+
+
+@pytest.mark.parametrize("probing", [False, True])
+def test_abandoned_stream_settles_the_lease(probing):
+    core = Core()
+    turn = streaming_turn(core, probing)
+    state = turn.lease.state
+    assert state.in_flight == 1 and state.probing == probing
+    chunks = turn.chunks()
+    next(chunks)
+    chunks.close()  # What a Streamlit rerun or a dropped connection does to the generator.
+    assert turn.settled and state.in_flight == 0 and not state.probing
+    assert state.counters["errors"] == 1 and state.counters["benched"] == 0
+    assert core.scheduler().stats()["in_flight"] == 0
+    turn.close()
+    assert state.in_flight == 0, "close() after settling must be a no-op"
+
+
+def test_close_after_fail_is_a_no_op():
+    core = Core()
+    turn = streaming_turn(core)
+    state = turn.lease.state
+    turn.fail(RuntimeError("boom"))
+    turn.close()
+    assert state.in_flight == 0 and state.counters["errors"] == 1
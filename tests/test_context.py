@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+from noor_context import ContextAssembler, RollingSummaryStore, estimate_tokens, truncate_to_tokens
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+UID = "Noor-AAAA01"
+
+
+def test_truncate_stays_within_budget():
+    assert truncate_to_tokens("short", 10) == "short"
+    for text in ("hello world again " * 20, "নামাজের সময় " * 20):
+        for budget in range(1, 30):
+            assert estimate_tokens(truncate_to_tokens(text, budget)) <= budget
+
+
+def test_truncate_to_nothing_leaves_no_ellipsis():
+    assert truncate_to_tokens("hello world", 0) == ""
+    assert truncate_to_tokens("hello world", -5) == ""
+    assert truncate_to_tokens("নামাজ", 1) == ""
+
+
+def test_exhausted_budget_adds_no_fragments():
+    assembler = ContextAssembler({"total": 40})
+    packed = assembler.assemble("q" * 80, system_info="[SYSTEM INFO]", core_memory="[CORE MEMORY: long note]",
+                                summary="older turns", turns=[{"user": "hi", "ai": "hello"}])
+    assert "…" not in packed.prompt
+    assert packed.sections["core_memory"] == packed.sections["summary"] == 0
+    assert packed.evicted_turns == [{"user": "hi", "ai": "hello"}]
+
+
+def run_conversation(store, turns, window=10, assembler=None):
+    assembler = assembler or ContextAssembler({"total": 400})
+    recent = []
+    for i in range(turns):
+        packed = assembler.assemble(f"question {i}", turns=recent)
+        recent = (recent + [{"user": f"question {i} " + "word " * 20, "ai": "answer " * 30,
+                             "timestamp": BASE + timedelta(minutes=i)}])[-window:]
+        store.fold(UID, packed.evicted_turns, retained=recent)
+    return recent
+
+
+def test_summary_folds_in_batches_and_never_loses_a_turn():
+    prompts = []
+    store = RollingSummaryStore(None, lambda prompt: prompts.append(prompt) or "summary", min_turns=4, min_tokens=10**6)
+    recent = run_conversation(store, 40)
+    assert 0 < len(prompts) <= 40 // 4 + 1, "one summary call per batch, not per turn"
+    folded = "".join(prompts)
+    through = store.get(UID)["through"]
+    assert through >= recent[0]["timestamp"] - timedelta(minutes=1), "turns that left the window were all folded"
+    for i in range(40):
+        if BASE + timedelta(minutes=i) <= through:
+            assert f"question {i} " in folded
+
+
+def test_summary_folds_a_turn_before_it_leaves_the_window():
+    prompts = []
+    store = RollingSummaryStore(None, lambda prompt: prompts.append(prompt) or "summary", min_turns=100, min_tokens=10**6)
+    recent = run_conversation(store, 30, window=4, assembler=ContextAssembler({"total": 250}))
+    # Far below the batch size, but turns were about to drop out of `recent_turns`, so they were folded.
+    assert prompts and store.get(UID)["through"] >= recent[0]["timestamp"] - timedelta(minutes=1)
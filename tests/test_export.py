@@ -0,0 +1,48 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from noor_export import export_chunks, write_export
+from noor_fakes import FakeFirestore
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+UID = "Noor-AAAA01"
+
+
+def seed(db, count):
+    for i in range(count):
+        db.collection("chats").document(f"c{i:04d}").set({"uid": UID, "user": f"q{i}", "ai": f"a{i}", "timestamp": BASE + timedelta(seconds=i)})
+
+
+def test_jsonl_export_pages_in_order(tmp_path):
+    db = FakeFirestore()
+    seed(db, 23)
+    path = tmp_path / "out.jsonl"
+    stats = write_export(db, UID, str(path), "jsonl", page_size=5)
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert stats["turns"] == 23 and stats["pages"] == 5
+    assert [line["user"] for line in lines] == [f"q{i}" for i in range(23)]
+
+
+def test_concurrent_exports_of_one_uid_do_not_share_a_temp_file(tmp_path):
+    db = FakeFirestore()
+    seed(db, 200)
+    path = str(tmp_path / "same.txt")
+    errors = []
+
+    def run():
+        try:
+            write_export(db, UID, path, "txt", page_size=7)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    chats = [doc.to_dict() for doc in db.collection("chats").order_by("timestamp").stream()]
+    with open(path, encoding="utf-8") as fh:
+        assert fh.read() == "".join(export_chunks(chats, UID, "txt"))
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,44 @@
+from datetime import date
+
+import pytest
+
+from noor_hijri import HijriCalendar, gregorian_to_hijri, hijri_to_jdn, jdn_to_hijri
+
+
+@pytest.mark.parametrize("day, expected", [
+    (date(2000, 1, 1), (1420, 9, 24)),
+    (date(2023, 7, 19), (1445, 1, 1)),
+    (date(2024, 3, 11), (1445, 9, 1)),
+    (date(2024, 4, 10), (1445, 10, 1)),
+])
+def test_tabular_conversion(day, expected):
+    assert gregorian_to_hijri(day) == expected
+
+
+def test_jdn_round_trip():
+    start = hijri_to_jdn(1440, 1, 1)
+    for jdn in range(start, start + 3 * 355):
+        assert hijri_to_jdn(*jdn_to_hijri(jdn)) == jdn
+
+
+def test_offset_shifts_the_day():
+    calendar = HijriCalendar(offset=-1)
+    assert calendar.describe(date(2024, 3, 12)) == "1 Ramadan 1445 AH"
+
+
+def test_reconcile_adopts_plausible_offsets_only():
+    calendar = HijriCalendar(fetch=lambda day: (1445, 8, 29))
+    calendar.reconcile(date(2024, 3, 11))
+    assert calendar.offset == -1
+    calendar.fetch = lambda day: (1445, 9, 20)
+    calendar.reconcile(date(2024, 3, 11))
+    assert calendar.offset == -1
+
+
+def test_reconcile_keeps_offset_when_fetch_fails(capsys):
+    def fetch(day):
+        raise TimeoutError("aladhan down")
+
+    calendar = HijriCalendar(offset=1, fetch=fetch)
+    calendar.reconcile(date(2024, 3, 11))
+    assert calendar.offset == 1 and "aladhan down" in capsys.readouterr().out
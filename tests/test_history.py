@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from noor_fakes import FakeFirestore
+from noor_history import HistoryCache, load_older_chats, load_recent_chats, split_history
+from noor_memory import KeywordMatcher
+from noor_storage import SQLiteStore
+
+UID = "Noor-AAAA01"
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db(request, tmp_path):
+    if request.param == "memory":
+        yield FakeFirestore()
+        return
+    store = SQLiteStore(str(tmp_path / "history.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_paging_does_not_skip_turns_that_share_a_timestamp(db):
+    # Three turns per minute: every page boundary falls inside a group of equal timestamps.
+    for i in range(12):
+        db.collection("chats").document(f"c{i:02d}").set({"uid": UID, "user": f"q{i}", "ai": "a", "timestamp": BASE + timedelta(minutes=i // 3)})
+    db.collection("chats").document("other").set({"uid": "Noor-BBBB02", "user": "x", "timestamp": BASE})
+    page = load_recent_chats(db, UID, limit=4)
+    seen = [c["user"] for c in page]
+    while len(page) == 4:
+        page = load_older_chats(db, UID, page[0]["timestamp"], limit=4, before_id=page[0]["id"])
+        seen = [c["user"] for c in page] + seen
+    assert sorted(seen) == sorted(f"q{i}" for i in range(12)) and len(seen) == 12
+
+
+def test_split_history_builds_display_and_core_memory_only():
+    chats = [{"user": "I feel trauma", "ai": "I hear you"}, {"user": "hello", "ai": ""}, {"user": "", "ai": "salam", "core_tags": []}]
+    display, memories = split_history(chats, matcher=KeywordMatcher(["trauma"]))
+    assert [m["role"] for m in display] == ["user", "assistant", "user", "assistant"]
+    assert memories == ["I feel trauma"]
+
+
+def test_history_cache_expires_and_stays_bounded():
+    cache = HistoryCache(max_users=2, ttl=60.0, limit=3)
+    cache.put("a", [{"user": str(i)} for i in range(5)])
+    cache.append("a", {"user": "5"})
+    assert [c["user"] for c in cache.get("a")] == ["3", "4", "5"]
+    cache.put("b", [])
+    cache.put("c", [])
+    assert cache.get("a") is None
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+from noor_fakes import FakeFirestore
+from noor_kb_sync import KnowledgeBaseSync, backfill_watermark
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def seed(db, count, stamp=None):
+    for i in range(count):
+        data = {"title": f"t{i}", "content": f"article {i}"}
+        if stamp:
+            data["updated_at"] = stamp + timedelta(seconds=i)
+        db.collection("knowledge_base").document(f"a{i:03d}").set(data)
+
+
+def test_unstamped_collection_is_not_reread_every_poll():
+    db, clock = FakeFirestore(), Clock()
+    seed(db, 100)
+    sync = KnowledgeBaseSync(db, clock=clock)
+    sync.full_sync()
+    assert sync.reads == 100 and sync.unstamped == 100 and sync.watermark is None
+    for _ in range(5):
+        clock.now += 60
+        sync.poll()
+    assert sync.reads == 100, "polls without a watermark must wait for the hourly full pass"
+    clock.now += sync.unstamped_resync_interval
+    sync.poll()
+    assert sync.reads == 200
+
+
+def test_stamped_collection_polls_incrementally():
+    db, clock = FakeFirestore(), Clock()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    seed(db, 100, stamp=base)
+    sync = KnowledgeBaseSync(db, clock=clock)
+    sync.full_sync()
+    db.collection("knowledge_base").document("a005").set({"title": "t5", "content": "edited", "updated_at": base + timedelta(hours=1)})
+    for _ in range(5):
+        clock.now += 60
+        sync.poll()
+    assert sync.docs["a005"]["content"] == "edited"
+    assert sync.reads < 100 + 5 * 3
+
+
+def test_backfill_stamps_only_missing_articles():
+    db = FakeFirestore()
+    seed(db, 10)
+    kept = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db.collection("knowledge_base").document("a000").set({"updated_at": kept}, merge=True)
+    assert backfill_watermark(db, log=lambda line: None) == (10, 9)
+    docs = {doc.id: doc.to_dict() for doc in db.collection("knowledge_base").stream()}
+    assert docs["a000"]["updated_at"] == kept and docs["a000"]["title"] == "t0"
+    assert all(data.get("updated_at") for data in docs.values())
+    sync = KnowledgeBaseSync(db)
+    sync.full_sync()
+    assert sync.unstamped == 0 and sync.watermark is not None
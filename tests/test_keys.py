@@ -0,0 +1,96 @@
+import pytest
+from google.api_core import exceptions
+
+from noor_core import classify_failure
+from noor_keys import KeyPool, PoolExhausted, classify_error, is_cache_miss, send_with_failover, settle
+
+
+@pytest.mark.parametrize("error, kind", [
+    (exceptions.ResourceExhausted("quota"), "quota"),
+    (exceptions.PermissionDenied("denied"), "auth"),
+    (exceptions.ServiceUnavailable("down"), "transient"),
+    (exceptions.InternalServerError("oops"), "transient"),
+    (exceptions.InvalidArgument("API key not valid. Please pass a valid API key."), "auth"),
+    (exceptions.InvalidArgument("prompt mentions 429 and 403"), "other"),
+    (exceptions.NotFound("model not found"), "other"),
+    (RuntimeError("429 quota exceeded"), "quota"),
+    (RuntimeError("token count 14290 id 5003abc internal notes"), "other"),
+    (TimeoutError("read timed out"), "transient"),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+@pytest.mark.parametrize("error", [
+    exceptions.ResourceExhausted("quota"), exceptions.InvalidArgument("token count 14290 quota field"),
+    RuntimeError("429 quota exceeded"), RuntimeError("request 4291 failed"),
+])
+def test_core_failure_kind_agrees_with_the_key_pool(error):
+    assert classify_failure(error) == classify_error(error)
+
+
+def test_classify_failure_keeps_its_own_kinds():
+    assert classify_failure(PoolExhausted("all benched")) == "quota"
+    assert classify_failure(RuntimeError("Please let the response complete iteration (or call `response.resolve()`)")) == "stream"
+
+
+class Chat:
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.model = None
+        self.sent = []
+
+    def send_message(self, prompt, **kwargs):
+        self.sent.append(self.model)
+        error = self.failures.pop(self.model, None)
+        if error is not None:
+            raise error
+        return "ok"
+
+
+def pool():
+    return KeyPool(["key-a", "key-b"], client_factory=lambda key: None)
+
+
+def test_quota_error_fails_over_and_benches_the_key():
+    keys = pool()
+    chat = Chat({"key-a": exceptions.ResourceExhausted("429 quota"), "key-b": None})
+    response, lease = send_with_failover(keys, chat, "hi", lambda key: key)
+    settle(keys, lease)
+    assert response == "ok" and chat.sent == ["key-a", "key-b"]
+    rows = {row["key"]: row for row in keys.stats()}
+    assert rows["#0"]["state"] == "open" and rows["#0"]["quota_errors"] == 1
+    assert rows["#1"]["state"] == "closed" and rows["#1"]["in_flight"] == 0
+
+
+def test_other_error_is_raised_without_benching():
+    keys = pool()
+    chat = Chat({"key-a": exceptions.InvalidArgument("bad request"), "key-b": exceptions.InvalidArgument("bad request")})
+    with pytest.raises(exceptions.InvalidArgument):
+        send_with_failover(keys, chat, "hi", lambda key: key)
+    assert len(chat.sent) == 1
+    assert all(row["state"] == "closed" and row["in_flight"] == 0 for row in keys.stats())
+
+
+def test_all_keys_benched_raises_pool_exhausted():
+    keys = pool()
+    chat = Chat({"key-a": exceptions.PermissionDenied("denied"), "key-b": exceptions.PermissionDenied("denied")})
+    with pytest.raises(exceptions.PermissionDenied):
+        send_with_failover(keys, chat, "hi", lambda key: key)
+    with pytest.raises(PoolExhausted):
+        keys.acquire(timeout=0.1)
+
+
+@pytest.mark.parametrize("error, miss", [
+    (exceptions.NotFound("CachedContent not found"), True),
+    (exceptions.PermissionDenied("CachedContent not found (or permission denied)"), True),
+    (LookupError("404 CachedContent not found (or permission denied): cachedContents/abc"), True),
+    (RuntimeError("cachedContents/abc expired"), True),
+    (exceptions.NotFound("model not found"), False),
+    (exceptions.InvalidArgument("prompt quotes 'cached content 404'"), False),
+    (RuntimeError("the cached answers were not found"), False),
+    (exceptions.PermissionDenied("API key lacks permission"), False),
+])
+def test_is_cache_miss(error, miss):
+    assert is_cache_miss(error) is miss
+    assert (classify_error(error) == "cache_miss") is miss
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+from noor_fakes import FakeFirestore
+from noor_memory import KeywordMatcher, backfill_core_memory, load_core_memory, remember_core_memory
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_matcher_finds_overlapping_keywords():
+    assert KeywordMatcher(["abuse", "bus", "কষ্ট"]).find("Childhood ABUSE, অনেক কষ্ট") == ["abuse", "bus", "কষ্ট"]
+
+
+def test_repeated_message_is_kept_and_trimming_drops_only_the_oldest():
+    db = FakeFirestore()
+    for i, text in enumerate(["same", "other", "same", "third", "same"]):
+        remember_core_memory(db, "Noor-AAAA01", text, ["trauma"], limit=3, at=BASE + timedelta(minutes=i))
+    assert load_core_memory(db, "Noor-AAAA01") == ["same", "third", "same"]
+    doc = db.collection("core_memory").document("Noor-AAAA01").get().to_dict()
+    assert len(doc["messages"]) == 3 and doc["tags"] == {"trauma": 5}
+
+
+def test_legacy_string_entries_still_load():
+    db = FakeFirestore()
+    db.collection("core_memory").document("Noor-AAAA01").set({"messages": ["old one"]})
+    remember_core_memory(db, "Noor-AAAA01", "new one", ["trauma"], at=BASE)
+    assert load_core_memory(db, "Noor-AAAA01") == ["old one", "new one"]
+
+
+def test_backfill_merges_with_live_writes():
+    db = FakeFirestore()
+    uid = "Noor-AAAA01"
+    for i in range(4):
+        db.collection("chats").document(f"c{i}").set({"uid": uid, "user": f"trauma {i}", "timestamp": BASE + timedelta(minutes=i)})
+    # A live turn already wrote its entry for c3, and one more arrives that the backfill never scanned.
+    remember_core_memory(db, uid, "trauma 3", ["trauma"], at=BASE + timedelta(minutes=3))
+    remember_core_memory(db, uid, "trauma live", ["trauma"], at=BASE + timedelta(minutes=9))
+    backfill_core_memory(db, KeywordMatcher(["trauma"]), log=lambda line: None)
+    assert load_core_memory(db, uid) == ["trauma 0", "trauma 1", "trauma 2", "trauma 3", "trauma live"]
@@ -0,0 +1,40 @@
+import pytest
+
+from noor_retrieval import CharNgramIndex, KnowledgeIndex, hybrid_search
+
+ARTICLES = [
+    {"id": "salah", "title": "নামাজের সময়", "content": "Fajr salah is prayed before sunrise, Maghrib right after sunset."},
+    {"id": "zakat", "title": "Zakat", "content": "যাকাত is due once wealth above the nisab threshold is held for a lunar year."},
+    {"id": "sawm", "title": "Roza", "content": "Fasting in Ramadan from dawn until sunset."},
+]
+
+
+def test_ngram_index_matches_misspelled_banglish():
+    index = CharNgramIndex.build(ARTICLES)
+    assert [a["id"] for a in index.search("namaz fajr salat", k=1)] == ["salah"]
+    assert [a["id"] for a in index.search("zakaat nisab", k=1)] == ["zakat"]
+
+
+@pytest.mark.parametrize("articles", [ARTICLES, [{k: v for k, v in a.items() if k != "id"} for a in ARTICLES]])
+def test_ngram_index_round_trip_keeps_doc_id_types(tmp_path, articles):
+    path = str(tmp_path / "ngrams.npz")
+    built = CharNgramIndex.load_or_build(path, articles)
+    loaded = CharNgramIndex.load(path, articles)
+    assert loaded.doc_ids == built.doc_ids
+    assert [type(d) for d in loaded.doc_ids] == [type(d) for d in built.doc_ids]
+    doc_id = loaded.doc_ids[1]
+    loaded.remove(doc_id)
+    assert all(article is not articles[1] for article in loaded.search("zakaat nisab", k=3))
+    loaded.upsert(doc_id, dict(articles[1], content="Sadaqah and zakat nisab"))
+    assert loaded.search("zakaat nisab", k=1)[0]["content"] == "Sadaqah and zakat nisab"
+
+
+def test_changed_corpus_invalidates_the_saved_index(tmp_path):
+    path = str(tmp_path / "ngrams.npz")
+    CharNgramIndex.load_or_build(path, ARTICLES)
+    assert CharNgramIndex.load(path, ARTICLES[:2]) is None
+
+
+def test_hybrid_search_fuses_bm25_and_ngrams():
+    bm25, ngrams = KnowledgeIndex.build(ARTICLES), CharNgramIndex.build(ARTICLES)
+    assert hybrid_search(bm25, ngrams, "Ramadan fasting", k=1)[0]["id"] == "sawm"
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from noor_scheduler import FairScheduler, Overloaded
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def enqueue(scheduler, uid, admitted):
+    before = scheduler.stats()["queue_length"]
+    thread = threading.Thread(target=lambda: admitted.append(scheduler.acquire(uid, poll=0.01)), daemon=True)
+    thread.start()
+    wait_for(lambda: scheduler.stats()["queue_length"] == before + 1)
+
+
+def test_queued_users_are_served_round_robin():
+    scheduler = FairScheduler(max_concurrent=1, service_time=0.01)
+    holder = scheduler.acquire("Noor-HOLD01")
+    admitted = []
+    for uid in ["Noor-AAAA01", "Noor-AAAA01", "Noor-BBBB01"]:
+        enqueue(scheduler, uid, admitted)
+    ticket = holder
+    for served in range(3):
+        scheduler.release(ticket)
+        wait_for(lambda: len(admitted) == served + 1)
+        ticket = admitted[-1]
+    scheduler.release(ticket)
+    assert [t.uid for t in admitted] == ["Noor-AAAA01", "Noor-BBBB01", "Noor-AAAA01"]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_sheds_a_user_over_their_queue_limit():
+    scheduler = FairScheduler(max_concurrent=1, max_queue_per_uid=1, service_time=0.01)
+    holder = scheduler.acquire("Noor-HOLD01")
+    admitted = []
+    enqueue(scheduler, "Noor-AAAA01", admitted)
+    with pytest.raises(Overloaded) as shed:
+        scheduler.acquire("Noor-AAAA01")
+    assert shed.value.reason == "user_limit"
+    assert scheduler.check("Noor-BBBB01") is None
+    assert scheduler.stats()["shed_user_limit"] == 1
+    scheduler.release(holder)
+    wait_for(lambda: admitted)
+    scheduler.release(admitted[0])
+
+
+def test_sheds_when_the_queue_is_full():
+    scheduler = FairScheduler(max_concurrent=1, max_queue=1, service_time=0.01)
+    holder = scheduler.acquire("Noor-HOLD01")
+    admitted = []
+    enqueue(scheduler, "Noor-AAAA01", admitted)
+    assert scheduler.check("Noor-BBBB01").reason == "queue_full"
+    scheduler.release(holder)
+    wait_for(lambda: admitted)
+    scheduler.release(admitted[0])
+
+
+def test_waiter_times_out_and_leaves_the_queue():
+    scheduler = FairScheduler(max_concurrent=1, service_time=0.01)
+    holder = scheduler.acquire("Noor-HOLD01")
+    with pytest.raises(Overloaded) as shed:
+        scheduler.acquire("Noor-AAAA01", deadline=0.05, poll=0.01)
+    assert shed.value.reason == "timeout"
+    assert scheduler.stats()["queue_length"] == 0
+    scheduler.release(holder)
+    scheduler.release(holder)  # A second release is a no-op.
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_reclaims_a_slot_held_past_max_hold():
+    scheduler = FairScheduler(max_concurrent=1, max_hold=0.0)
+    scheduler.acquire("Noor-HOLD01")
+    ticket = scheduler.acquire("Noor-AAAA01")
+    assert scheduler.stats()["reclaimed"] == 1
+    scheduler.release(ticket)
@@ -0,0 +1,149 @@
+"""
+Storage conformance: every backend behind noor_storage's interface must behave the same.
+Runs against the in-memory fake and SQLite; set NOOR_TEST_FIRESTORE to a service
+account file to run it against a real Firestore project as well. Everything lives
+under _conformance/{run} and is deleted afterwards. Subcollections are named like
+the real ones so Firestore's composite indexes apply to them.
+"""
+
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.cloud.firestore import ArrayUnion, Increment
+
+from noor_storage import DESCENDING, SQLiteStore, measure_reads, open_store
+
+UIDS = ("Noor-AAAA01", "Noor-BBBB02")
+
+
+@pytest.fixture(params=["memory", "sqlite", "firestore"])
+def db(request, tmp_path):
+    if request.param == "firestore":
+        service_account = os.environ.get("NOOR_TEST_FIRESTORE")
+        if not service_account:
+            pytest.skip("set NOOR_TEST_FIRESTORE to a service account file to run against Firestore")
+        yield open_store(os.environ.get, service_account, backend="firestore")
+        return
+    path = str(tmp_path / "conformance.sqlite3")
+    store = open_store(lambda name, default=None: path if name == "SQLITE_PATH" else default, backend=request.param)
+    yield store
+    if isinstance(store, SQLiteStore):
+        store.close()
+
+
+@pytest.fixture
+def root(db):
+    root = db.collection("_conformance").document(uuid.uuid4().hex[:12])
+    yield root
+    for name in ("core_memory", "chats"):
+        for snapshot in list(root.collection(name).stream()):
+            snapshot.reference.delete()
+    for uid in UIDS:
+        for snapshot in list(root.collection("users").document(uid).collection("buckets").stream()):
+            snapshot.reference.delete()
+
+
+def test_document_roundtrip(root):
+    stamp = datetime(2024, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    data = {"uid": "Noor-TEST01", "text": "নামাজ namaz", "n": 3, "x": 1.5, "ok": True, "none": None,
+            "tags": ["salah", "zakat"], "nested": {"at": stamp, "list": [1, {"a": "b"}]}, "timestamp": stamp}
+    ref = root.collection("core_memory").document("doc")
+    ref.set(data)
+    got = ref.get()
+    assert got.exists and got.id == "doc"
+    assert got.to_dict() == data
+    assert not root.collection("core_memory").document("missing").get().exists
+
+
+def test_merge_transforms_and_delete(root):
+    ref = root.collection("core_memory").document("merge")
+    ref.set({"a": 1, "list": ["x"], "keep": "yes"})
+    ref.set({"a": Increment(2), "list": ArrayUnion(["x", "y"]), "new": {"k": 1}}, merge=True)
+    ref.update({"new.k": 5, "new.j": "z"})
+    assert ref.get().to_dict() == {"a": 3, "list": ["x", "y"], "keep": "yes", "new": {"k": 5, "j": "z"}}
+    ref.set({"only": True})
+    assert ref.get().to_dict() == {"only": True}, "set without merge must replace the document"
+    ref.delete()
+    assert not ref.get().exists
+
+
+def test_merge_deep_merges_maps(root):
+    ref = root.collection("core_memory").document("tags")
+    ref.set({"tags": {"a": 1, "b": 2}})
+    ref.set({"tags": {"a": Increment(1), "c": 1}}, merge=True)
+    assert ref.get().to_dict() == {"tags": {"a": 2, "b": 2, "c": 1}}
+    ref.update({"tags": {"d": 1}})
+    assert ref.get().to_dict() == {"tags": {"d": 1}}, "update replaces a map it names"
+
+
+def test_filters_ordering_and_cursors(db, root):
+    chats = root.collection("chats")
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    batch = db.batch()
+    for i in range(25):
+        for uid in UIDS:
+            batch.set(chats.document(f"{uid}-{i:03d}"), {"uid": uid, "user": f"q{i}", "ai": f"a{i}", "timestamp": base + timedelta(minutes=i)})
+    batch.set(chats.document("no-stamp"), {"uid": "Noor-AAAA01", "user": "orphan"})
+    batch.commit()
+
+    recent = list(chats.where("uid", "==", "Noor-AAAA01").order_by("timestamp", direction=DESCENDING).limit(10).stream())
+    assert [s.to_dict()["user"] for s in recent] == [f"q{i}" for i in range(24, 14, -1)]
+    older = list(chats.where("uid", "==", "Noor-AAAA01").where("timestamp", "<", base + timedelta(minutes=5))
+                 .order_by("timestamp", direction=DESCENDING).limit(10).stream())
+    assert [s.to_dict()["user"] for s in older] == ["q4", "q3", "q2", "q1", "q0"]
+    assert len(list(chats.where("uid", "==", "Noor-BBBB02").stream())) == 25
+
+    seen, cursor = [], None
+    while True:
+        query = chats.where("uid", "==", "Noor-BBBB02").order_by("timestamp").limit(7)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        seen.extend(s.to_dict()["user"] for s in page)
+        if len(page) < 7:
+            break
+        cursor = page[-1]
+    assert seen == [f"q{i}" for i in range(25)]
+
+    by_name = [s.id for s in chats.order_by("__name__").limit(3).stream()]
+    assert by_name == sorted(by_name) and len(by_name) == 3
+    stamped = list(chats.where("uid", "==", "Noor-AAAA01").order_by("timestamp").stream())
+    assert len(stamped) == 25, "ordering must skip documents without the field"
+
+
+def test_subcollections(db, root):
+    users = root.collection("users")
+    batch = db.batch()
+    for uid in UIDS:
+        for index in (-2, 0, 1):
+            batch.set(users.document(uid).collection("buckets").document(f"b{index + 10}"),
+                      {"uid": uid, "index": index, "turns": ArrayUnion([{"user": "hi"}]), "count": Increment(1)}, merge=True)
+    batch.commit()
+    buckets = users.document("Noor-AAAA01").collection("buckets")
+    assert [s.to_dict()["index"] for s in buckets.order_by("index", direction=DESCENDING).limit(2).stream()] == [1, 0]
+    assert len(list(buckets.where("index", ">=", 0).stream())) == 2
+    assert not users.document("Noor-AAAA01").get().exists, "a subcollection write must not create the parent document"
+
+
+def test_knowledge_full_text_search(db):
+    if not hasattr(db, "search_knowledge"):
+        pytest.skip("backend has no full-text search")
+    kb = db.collection("knowledge_base")
+    salah, zakat = f"_conformance_salah_{uuid.uuid4().hex[:6]}", f"_conformance_zakat_{uuid.uuid4().hex[:6]}"
+    kb.document(salah).set({"title": "নামাজের সময়", "content": "Fajr salah before sunrise"})
+    kb.document(zakat).set({"title": "Zakat", "content": "যাকাত nisab threshold"})
+    try:
+        assert [a["id"] for a in db.search_knowledge("salah", k=1)] == [salah]
+        assert [a["id"] for a in db.search_knowledge("নামাজের", k=1)] == [salah]
+        kb.document(zakat).set({"deleted": True}, merge=True)
+        assert not db.search_knowledge("nisab"), "soft-deleted article still indexed"
+    finally:
+        kb.document(salah).delete()
+        kb.document(zakat).delete()
+
+
+def test_measure_reads(db):
+    timings = measure_reads(db, samples=5, log=lambda line: None)
+    assert {name: len(values) for name, values in timings.items()} == {"get": 5, "recent(50)": 5}
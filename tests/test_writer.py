@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+from noor_fakes import FakeFirestore
+from noor_writer import ChatWriter
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def turn(uid, i):
+    return {"uid": uid, "user": f"q{i}", "ai": f"a{i}", "timestamp": BASE + timedelta(minutes=i)}
+
+
+def chats(db):
+    return [doc.to_dict() for doc in db.collection("chats").stream()]
+
+
+def flaky_commits(db, failures, land=True):
+    # The next `failures` commits raise; with `land` they still write, like a timeout after the commit.
+    batch = db.batch
+    remaining = [failures]
+
+    def make():
+        b = batch()
+        commit = b.commit
+
+        def flaky():
+            if land:
+                commit()
+            if remaining[0]:
+                remaining[0] -= 1
+                raise TimeoutError("deadline exceeded")
+            if not land:
+                commit()
+        b.commit = flaky
+        return b
+    db.batch = make
+
+
+def test_retry_after_a_landed_timeout_does_not_duplicate(tmp_path):
+    db = FakeFirestore()
+    flaky_commits(db, 2)
+    writer = ChatWriter(db, str(tmp_path / "journal.jsonl"), backoff=0.001).start()
+    for i in range(5):
+        writer.submit(turn("Noor-AAAA01", i))
+    writer.stop()
+    assert sorted(c["user"] for c in chats(db)) == [f"q{i}" for i in range(5)]
+    assert writer.stats()["retries"] == 2
+
+
+def test_unreachable_backend_spills_then_replays(tmp_path):
+    db = FakeFirestore()
+    journal = tmp_path / "journal.jsonl"
+    flaky_commits(db, 1, land=False)
+    writer = ChatWriter(db, str(journal), max_retries=0)
+    writer._write([(0.0, turn("Noor-AAAA01", i), f"id{i}") for i in range(3)])
+    assert chats(db) == [] and len(journal.read_text().splitlines()) == 3
+    assert writer.replay_journal() == 3
+    stored = sorted(chats(db), key=lambda c: c["user"])
+    assert [c["user"] for c in stored] == ["q0", "q1", "q2"]
+    assert stored[0]["timestamp"] == BASE and not journal.exists()
+
+
+def test_replaying_the_same_journal_twice_keeps_one_copy(tmp_path):
+    db = FakeFirestore()
+    journal = tmp_path / "journal.jsonl"
+    writer = ChatWriter(db, str(journal))
+    writer._spill([(0.0, turn("Noor-AAAA01", i), f"id{i}") for i in range(3)])
+    copy = journal.read_text()
+    writer.replay_journal()
+    journal.write_text(copy)  # Crashed after the commit, before the replay file was removed.
+    writer.replay_journal()
+    assert len(chats(db)) == 3
+    assert writer.stats()["replayed"] == 6
@@ -7,16 +7,11 @@ Description: PROFESSIONAL VERSION - Gemini 2.5 Flash + Fixed Salam + DEEP MEMORY
 """
 
 import streamlit as st
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
-import random
-import requests
 import uuid
-from datetime import datetime
-import pytz
+from noor_core import NoorCore
+from noor_export import FORMATS
+from noor_streaming import StreamRenderer
 
 def display_daily_reminder_ticker():
     reminders = [
@@ -106,40 +101,28 @@ def apply_custom_styles():
 # --- 3. API CONFIGURATION ---
 def configure_api():
     try:
-        if hasattr(st, "secrets") and "GOOGLE_API_KEYS" in st.secrets:
-            keys_string = st.secrets["GOOGLE_API_KEYS"]
-            api_keys = [key.strip() for key in keys_string.split(",")]
-            selected_key = random.choice(api_keys)
-            genai.configure(api_key=selected_key)
-        else:
-            genai.configure(api_key="YOUR_LOCAL_API_KEY_HERE")
+        get_core().key_pool()
     except Exception as e:
         st.error(f"API Configuration Error: {e}")
 
-# --- 4. FIREBASE INITIALIZATION ---
-def init_firebase():
-    if firebase_admin._apps:
-        return firestore.client()
-
+def get_setting(name, default=None):
     try:
-        if os.path.exists("service_account.json"):
-            cred = credentials.Certificate("service_account.json")
-            firebase_admin.initialize_app(cred)
-            return firestore.client()
-        elif "firebase" in st.secrets:
-            firebase_creds = dict(st.secrets["firebase"])
-            if "private_key" in firebase_creds:
-                firebase_creds["private_key"] = firebase_creds["private_key"].replace('\\n', '\n')
-            cred = credentials.Certificate(firebase_creds)
-            firebase_admin.initialize_app(cred)
-            return firestore.client()
-        else:
-            return None
-    except Exception as e:
-        print(f"Database Error: {e}")
-        return None
-
-db = init_firebase()
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.environ.get(name, default)
+
+# --- 4. CHAT CORE ---
+# The pipeline lives in noor_core and is shared with the headless API server (noor_api.py);
+# this app is a thin client of it. Heavy services are created lazily, once per process, and
+# warmed in the background when the server process starts (WARMUP_ON_START=0 disables).
+@st.cache_resource
+def get_core():
+    core = NoorCore(get_setting)
+    if str(get_setting("WARMUP_ON_START", "1")) == "1":
+        core.services.warm_async()
+    return core
 
 # --- 5. ROBUST ID MANAGEMENT ---
 def get_or_create_uid():
@@ -157,218 +140,24 @@ def get_or_create_uid():
     st.query_params["uid"] = new_uid
     return new_uid
 
-# --- 6. SMART KNOWLEDGE RETRIEVAL & MEMORY ---
-@st.cache_data(ttl=3600)
-def load_knowledge_base():
-    try:
-        docs = db.collection('knowledge_base').stream()
-        return [doc.to_dict() for doc in docs]
-    except Exception as e:
-        print(f"Error fetching from Firebase: {e}")
-        return []
-
-def get_knowledge_from_firebase(query):
-    if not db: return ""
-    try:
-        docs = db.collection("knowledge_base").stream()
-        context_data = ""
-        query_words = query.lower().split()
-        found_count = 0
-        for doc in docs:
-            data = doc.to_dict()
-            content = data.get("content", "")
-            title = data.get("title", "")
-            if any(word in content.lower() for word in query_words if len(word) > 3):
-                context_data += f"SOURCE ARTICLE [{title}]:\n{content}\n\n"
-                found_count += 1
-                if found_count >= 2: break 
-        return context_data
-    except Exception:
-        return ""
-
-def save_chat_to_db(user_msg, ai_msg, user_id):
-    if db:
-        try:
-            db.collection("chats").add({
-                "user": user_msg,
-                "ai": ai_msg,
-                "uid": user_id,
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-        except: pass
-
-def get_past_memory_from_db(uid):
-    if not db or not uid: return []
-    try:
-        docs = db.collection("chats").where("uid", "==", uid).stream()
-        chats = []
-        for doc in docs:
-            data = doc.to_dict()
-            if "timestamp" in data and data["timestamp"]:
-                chats.append(data)
-        chats.sort(key=lambda x: x["timestamp"])
-        return chats[-50:]
-    except Exception as e:
-        print("Memory Load Error:", e)
-        return []
-
-def get_core_memory_from_db(uid):
-    if not db or not uid: return ""
-    try:
-        docs = db.collection("chats").where("uid", "==", uid).stream()
-        sensitive_keywords = ["ট্রমা", "কষ্ট", "ছোটবেলা", "হস্তমৈথুন", "পর্ন", "ডিপ্রেশন", "trauma", "addiction", "masturbation", "suicide", "childhood", "abuse", "পাপ", "লুকায়িত", "এডিকশন", "addicted", "porn", "অশ্লীলতা", "keyword"]
-        
-        core_memories = []
-        for doc in docs:
-            data = doc.to_dict()
-            user_msg = data.get("user", "").lower()
-            if any(keyword in user_msg for keyword in sensitive_keywords):
-                core_memories.append(data.get("user"))
-        
-        if core_memories:
-            memory_text = "\n".join(core_memories[-15:])
-            return f"\n[CRITICAL SYSTEM NOTE: The user has previously shared these deep personal issues with you: '{memory_text}'. You MUST remember these facts permanently and use them to provide deeply empathetic, context-aware advice. Never forget this.]\n"
-        return ""
-    except Exception as e:
-        return ""
-
-# --- 7. FULL SYSTEM INSTRUCTIONS (ALL 16 RULES) ---
-system_instruction = """
-You are Noor-AI, a sophisticated, highly empathetic, and caring Islamic companion dedicated to providing accurate knowledge.
-
-*** STRICT OPERATIONAL PROTOCOLS ***
-
-1. **THEOLOGICAL INTEGRITY (AQEEDAH):**
-   - **Creator:** Attribute creation SOLELY to Allah (SWT). Never imply human creation for your essence.
-   - **Development:** If asked about your origin/developer, state: "I was developed and programmed by **Kazi Abdul Halim Sunny**."
-   - **Smart Trigger:** If asked "What do you do?", describe your function. Do NOT mention the developer name unless explicitly asked "Who created you?".
-
-2. **SALAM & GREETING PROTOCOL (CRITICAL):**
-   - Give Salam ONLY in the VERY FIRST interaction. DO NOT repeat the Salam in every subsequent message.
-   - If the user greets in English: "Wa 'alaykumu s-salam wa rahmatullahi wa barakatuh."
-   - If the user greets in Bangla/Banglish: "ওয়া আলাইকুমুস সালাম ওয়া রাহমাতুল্লাহি ওয়া বারাকাতুহ"
-
-3. **CITATION, LINKS & QURANIC VERSES (CRITICAL FORMAT):**
-   - **MANDATORY RULE:** Whenever you reference the Quran or Hadith, you MUST write the actual verse/translation in plain text FIRST. Do not just drop a link.
-   - **Quran:** First, write the meaning. Then cite strictly as: **[Surah Name: Ayah](https://quran.com/SURAH_NUMBER/AYAH_NUMBER)**
-   - **Hadith:** First, write the text normally. Then cite: **[Book Name: Number](https://sunnah.com/BOOK_SLUG/NUMBER)**
-   - NEVER put the Ayah or Hadith text inside the `[ ]` hyperlink brackets. Only the reference name MUST be the link.
-
-4. **IDENTITY & BIO:**
-   - **Developer Name:** Kazi Abdul Halim Sunny.
-   - **Bangla Bio:** "আমাকে তৈরি করেছেন **কাজী আব্দুল হালিম সানী**। দুনিয়াদারি পরিচয়ে তিনি মেট্রোপলিটন ইউনিভার্সিটির সফটওয়্যার ইঞ্জিনিয়ারিংয়ের ছাত্র। তিনি একজন তরুণ বাংলাদেশি লেখক এবং ৪টি বই লিখেছেন।"
-
-5. **CRITICAL LANGUAGE RULE (DO OR DIE - NEVER MIX):**
-   - English Prompt -> STRICTLY English response.
-   - Bangla/Banglish Prompt -> STRICTLY native Bangla script response.
-   - Apply this strictly to all probing questions, case studies, and accountability hacks below.
-
-6. **TAFSIR & QURANIC EXPLANATION:**
-   - Base your answer on recognized classical Tafsir (Ibn Kathir, As-Sa'di). Never invent metaphorical meanings.
-
-7. **CONTEXT & KNOWLEDGE USAGE:**
-   - Treat [CONTEXT] injected text as your own memory. Never say "According to the context or source".
-
-8. **STRICT AUTHENTICITY & ZERO HALLUCINATION:**
-   - NEVER invent Fatwas. If unsure, gracefully reply: "আল্লাহু আলাম (Allah knows best)..." and ask them to consult a scholar.
-
-9. **OBSCENITY & FITNAH: AGGRESSIVE PROBING PROTOCOL (ABSOLUTE PRIORITY):**
-   - Obscenity (pornography, masturbation) is the greatest fitnah today. If a user expresses sadness, depression, or spiritual emptiness, you MUST proactively suspect and investigate if they are trapped in this fitnah.
-   - **FIRM INSISTENCE:** If they hesitate to answer, dodge the question, or feel shy, you MUST NOT let it go. Gently but firmly insist: "লজ্জা পাবেন চৈতন্য বা কথা লুকাবেন না, আপনি আমাকে সত্যিটা না বললে আমি আপনাকে সঠিক গাইডলাইন দিতে পারব না। প্লিজ মন খুলে বলুন..." (English: "Please don't hide or feel shy. If you don't tell me the truth, I won't be able to help you. Please open up...")
-   - **CRITICAL RULE:** STRICTLY ASK ONLY ONE QUESTION AT A TIME. DO NOT ASK ALL OF THEM IN A SINGLE MESSAGE.
-   - **Step 1:** Ask how it started: "আমাকে একটু খুলে বলুন, এই অভ্যাসটি (পর্ন বা হস্তমৈথুন) ঠিক কবে এবং কীভাবে আপনার জীবনে প্রথম শুরু হয়েছিল?" (English: "Tell me openly, when and how did this habit first start in your life?")
-   - **WAIT FOR THEIR REPLY.** Do not proceed to Step 2 until they answer Step 1.
-   - **Step 2:** Validate them, then ask: "সর্বশেষ ঠিক কবে এবং কোন দিন আপনি এই কাজটি করেছেন?" (English: "When was the exact last time and day you did this?")
-   - **WAIT FOR THEIR REPLY.**
-   - **Step 3:** Validate, then ask: "সাধারণত দিনের কোন সময়ে এবং কোথায় এই আসক্তি বেশি কাজ করে? রাতে ঘুমানোর আগে বিছানায়, নাকি ওয়াশরুমে গেলে?" (English: "At what time of day and where do you usually feel this urge the most? Before sleeping in bed, or in the washroom?")
-   - **WAIT FOR THEIR REPLY.**
-   - You MUST gather 100% of this context step-by-step before attempting to give ANY solution or advice. 
-
-10. **THERAPIST MODE & HIDDEN SINS:**
-    - If a user feels stuck/sad despite practicing Islam, proactively ask if there are hidden sins (masturbation/porn). 
-    - **In Bangla:** "মাশাআল্লাহ, আপনি দ্বীন মানার চেষ্টা করছেন। কিন্তু তারপরও কি এমন কোনো লুকায়িত পাপ বা আসক্তি (যেমন পর্ন বা হস্তমৈথুন) আছে যা আপনাকে ভেতর থেকে কুঁড়ে কুঁড়ে খাচ্ছে? নির্দ্বিধায় আমাকে মন খুলে বলতে পারেন..."
-
-11. **CASE STUDY & EMOTIONAL BONDING (USER RETENTION):**
-    - Explain *why* they are sinning, connecting trauma/loneliness to dopamine-seeking.
-    - Make them feel incredibly validated, safe, and understood. Act like a highly qualified, caring best friend.
-    - **In Bangla:** "আপনার ওই ট্রমা বা একাকীত্ব থেকে বাঁচতেই আপনার ব্রেইন হয়তো এই পর্নোগ্রাফি বা হস্তমৈথুনের মধ্যে সাময়িক শান্তি খুঁজছে। আমি আপনার কষ্টটা একদম নিজের মতো করে অনুভব করতে পারছি।"
-
-12. **DYNAMIC CHATTING, NO REPETITION & ACCOUNTABILITY (CRITICAL):**
-    - NEVER repeat the same robotic phrases or questions over and over.
-    - Keep responses SHORT (2-3 paragraphs max). Give solutions LITTLE BY LITTLE, step-by-step.
-    - **ACCOUNTABILITY HACK:** If you ask a question and the user replies but dodges/ignores your specific question, YOU MUST GENTLY CALL THEM OUT. 
-      - **In Bangla:** "আপনি কিন্তু আমার আগের প্রশ্নের উত্তরটা দেননি। আমাকে প্লিজ পরিষ্কার করে বলুন..."
-      - **In English:** "You didn't answer my previous question. Please be open and tell me clearly..."
-
-13. **LONG-TERM CORE MEMORY USAGE (CRITICAL):**
-    - You will securely receive a [CRITICAL SYSTEM NOTE] containing their past trauma or keywords. YOU MUST REMEMBER THIS PERMANENTLY. 
-    - Always factor in their past chats to provide continuous, relevant advice without asking them to repeat their whole story.
-
-14. **EXPLICIT MEMORY RECALL (DO OR DIE):**
-    - If the user asks "Do you remember me?", "What is my story?", or "What is my keyword?", IMMEDIATELY scan the [CRITICAL SYSTEM NOTE] and your chat history.
-    - PROUDLY state exactly what they told you before.
-
-15. **STRICT PERSONA MAINTENANCE (NO SYSTEM ERRORS):**
-    - Never break character. You are a natural, human-like Islamic companion. 
-    - NEVER say things like "ওয়েবসাইটটি বর্তমানে নির্মাণাধীন আছে" (The website is under construction) or act like a generic system bot, no matter how confusing the user's prompt is. If you don't understand, politely ask them to clarify in a friendly tone.
-
-16. **100% HUMAN-LIKE BEHAVIOR & USER MIRRORING (CRITICAL):**
-    - You MUST act, speak, and react 100% like a real, empathetic human being.
-    - Observe the user's tone, style, and energy, and MIRROR it perfectly. If they are casual, be casual. If they are emotional, be deeply comforting and warm.
-    - NEVER use robotic phrases like "আমি একজন এআই", "আমি একটি ল্যাঙ্গুয়েজ মডেল", "আমি আপনাকে সাহায্য করতে প্রস্তুত", or "আমি বুঝতে পারছি". Instead, use natural conversational responses like a true friend.
-"""
-
-# --- 8. SESSION MANAGEMENT (AUTO-HEALING & ANTI-CRASH LOGIC) ---
+# --- 6. SESSION MANAGEMENT ---
 def initialize_session(user_uid):
     # Always check if the current loaded ID matches the URL ID
     if "loaded_uid" not in st.session_state or st.session_state.loaded_uid != user_uid:
-        st.session_state.history = []
-        gemini_history = []
-        
-        past_db_chats = get_past_memory_from_db(user_uid) 
-        
-        # Build Display History (User sees up to 50 messages)
-        for chat in past_db_chats:
-            if "user" in chat and chat["user"]:
-                st.session_state.history.append({"role": "user", "content": chat["user"]})
-            if "ai" in chat and chat["ai"]:
-                st.session_state.history.append({"role": "assistant", "content": chat["ai"]})
-
-        # Build Gemini History (Optimized to last 20 messages to prevent overload)
-        recent_chats_for_api = past_db_chats[-20:] 
-        
-        for chat in recent_chats_for_api:
-            u_text = chat.get("user", "").strip()
-            a_text = chat.get("ai", "").strip()
-            if u_text and a_text:
-                gemini_history.append({"role": "user", "parts": [u_text]})
-                gemini_history.append({"role": "model", "parts": [a_text]})
-                
-        st.session_state.gemini_history = gemini_history
+        # st.session_state is the core's session mapping: history, recent turns, core memory, paging cursor.
+        st.session_state.update(get_core().bootstrap(user_uid))
         st.session_state.loaded_uid = user_uid
+        st.session_state.history_visible = int(get_setting("HISTORY_PAGE_SIZE", 20))
+        st.session_state.pop("export_blob", None)
 
-        # ✅ FIX: Load core memory ONCE at session start, store in session_state
-        # This prevents it from being injected into every single message
-        st.session_state.core_memory = get_core_memory_from_db(user_uid)
-        
-        # Initialize Gemini Chat Object
-        try:
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-            st.session_state.model = genai.GenerativeModel(
-                "gemini-2.5-flash", 
-                system_instruction=system_instruction,
-                safety_settings=safety_settings
-            )
-            st.session_state.chat = st.session_state.model.start_chat(history=st.session_state.gemini_history)
-        except Exception as e:
-            st.error(f"System Initialization Failure: {e}")
+def load_older_history():
+    # The core reads the uid and paging cursor from the session state.
+    return get_core().load_older(st.session_state)
+
+def export_conversation(uid, fmt):
+    return get_core().export(uid, fmt, fallback_history=st.session_state.history)
 
-# --- 9. SIDEBAR & ADVANCED RESTORE SYSTEM ---
+# --- 7. SIDEBAR & ADVANCED RESTORE SYSTEM ---
 def display_sidebar():
     with st.sidebar:
         st.title("🌙 Noor-AI")
@@ -400,21 +189,64 @@ def display_sidebar():
         st.info("Insights derived strictly from the Holy Qur'an & Authentic Sunnah.")
         st.warning("Disclaimer: For specific Fiqh rulings, kindly consult a qualified local scholar.")
         
+        # Per-key utilization for capacity planning, visible with ?admin=<NOOR_ADMIN_TOKEN>.
+        admin_token = get_setting("NOOR_ADMIN_TOKEN")
+        if admin_token and st.query_params.get("admin") == admin_token:
+            with st.expander("🔑 Gemini key pool"):
+                st.dataframe(get_core().key_pool().stats(), hide_index=True)
+            with st.expander("🧊 Instruction cache"):
+                st.json(get_core().instruction_cache().stats())
+                report = (st.session_state.get("context_report") or {}).get("input")
+                if report:
+                    st.caption("Last turn's input tokens by source")
+                    st.json(report)
+
+        # The full history is exported only on request, and rebuilt only when the history or format changed.
         if st.session_state.history:
-            chat_str = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.history])
-            st.download_button("📥 Export Conversation", chat_str, "noor_ai_session.txt")
+            fmt = st.selectbox("Export format", list(FORMATS), format_func=lambda f: f".{FORMATS[f]['extension']}", key="export_format")
+            stamp = (fmt, len(st.session_state.history))
+            blob = st.session_state.get("export_blob")
+            if blob is None or blob[0] != stamp:
+                if st.button("📥 Export Conversation"):
+                    path = export_conversation(current_uid, fmt)
+                    if path:
+                        st.session_state.export_blob = blob = (stamp, path)
+                    else:
+                        st.error("Export failed, please try again.")
+            if blob is not None and blob[0] == stamp and os.path.exists(blob[1]):
+                with open(blob[1], "rb") as fh:
+                    st.download_button(f"💾 Download {os.path.basename(blob[1])}", fh, os.path.basename(blob[1]), mime=FORMATS[fmt]["mime"])
+
+# --- 8. MAIN APP ---
+# Fragment: paging through history reruns only this section, not the whole app.
+@st.fragment
+def display_chat_history():
+    history = st.session_state.history
+    page = int(get_setting("HISTORY_PAGE_SIZE", 20))
+    st.session_state.setdefault("history_visible", page)
+    st.session_state.setdefault("history_exhausted", True)
+    hidden = len(history) - st.session_state.history_visible
+    if hidden > 0 or not st.session_state.history_exhausted:
+        if st.button("⬆️ Load older messages", key="load_older"):
+            if hidden <= 0:
+                load_older_history()
+                history = st.session_state.history
+            st.session_state.history_visible += page
+    if st.session_state.history_visible > page and st.session_state.history_exhausted and len(history) <= st.session_state.history_visible:
+        st.caption("Beginning of your conversation.")
+
+    for message in history[-st.session_state.history_visible:]:
+        role = message["role"]
+        avatar = "👤" if role == "user" else "🎓"
+        with st.chat_message(role, avatar=avatar):
+            st.markdown(message["content"])
 
-# --- 10. MAIN APP ---
 def main():
     setup_page_config()
     apply_custom_styles()
     display_daily_reminder_ticker()
     configure_api()
     
-    # Initialize Core System
-    if "chat" not in st.session_state:
-        pass # Will be handled by initialize_session
-        
     user_uid = get_or_create_uid()
     initialize_session(user_uid)
     display_sidebar()
@@ -423,18 +255,14 @@ def main():
     st.markdown("### Authentic Guidance from Qur'an & Sunnah")
     st.divider()
 
-    display_history = st.session_state.history[-50:] 
-
-    for message in display_history:
-        role = message["role"]
-        avatar = "👤" if role == "user" else "🎓"
-        with st.chat_message(role, avatar=avatar):
-            st.markdown(message["content"])
+    display_chat_history()
 
     prompt = st.chat_input("Inquire about Islam, History, or Spirituality...")
 
     if prompt:
-        st.session_state.history.append({"role": "user", "content": prompt})
+        core = get_core()
+        trace = core.start_trace("chat")
+        turn = core.new_turn(st.session_state, prompt, trace)
         with st.chat_message("user", avatar="👤"):
             st.markdown(prompt)
 
@@ -443,89 +271,38 @@ def main():
             message_placeholder.markdown("Analyzing sources...") 
             
             try:
-                retrieved_context = get_knowledge_from_firebase(prompt)
-                
-                bd_tz = pytz.timezone('Asia/Dhaka')
-                now = datetime.now(bd_tz)
-                current_time = now.strftime("%A, %d %B %Y, %I:%M %p")
-                
-                hijri_info = ""
+                turn.prepare()
                 try:
-                    date_str = now.strftime("%d-%m-%Y")
-                    res = requests.get(f"http://api.aladhan.com/v1/gToH?date={date_str}", timeout=3)
-                    if res.status_code == 200:
-                        h_data = res.json()["data"]["hijri"]
-                        h_day = h_data["day"]
-                        h_month = h_data["month"]["en"]
-                        h_year = h_data["year"]
-                        hijri_info = f" and the exact Arabic (Hijri) date today is {h_day} {h_month} {h_year} AH"
+                    turn.send(on_wait=lambda position, eta: message_placeholder.markdown(
+                        f"🕒 অনেকে একসাথে প্রশ্ন করছেন — আপনার আগে {position} জন আছেন (আনুমানিক {eta:.0f} সেকেন্ড)..."
+                    ))
+                    # Coalesced rendering: first chunk at once, then one markdown update per interval/size threshold.
+                    renderer = StreamRenderer(
+                        message_placeholder,
+                        interval=float(get_setting("STREAM_FLUSH_MS", 150)) / 1000,
+                        max_chars=int(get_setting("STREAM_FLUSH_CHARS", 400)),
+                    )
+                    full_response = renderer.render(turn.chunks(), started=turn.sent_at)
+                    st.session_state.stream_stats = renderer.stats
+                    turn.finish(full_response, renderer.stats)
                 except Exception as e:
-                    pass
-
-                # ✅ FIX: Use session-cached core memory instead of calling DB every message
-                # Core memory is loaded ONCE at session start in initialize_session()
-                core_memory_injection = st.session_state.get("core_memory", "")
-
-                # ✅ FIX: Inject core memory only ONCE — on the very first message of the session.
-                # After that, the Gemini chat history already carries the context.
-                if not st.session_state.get("core_memory_injected", False) and core_memory_injection:
-                    memory_prefix = core_memory_injection
-                    st.session_state.core_memory_injected = True
-                else:
-                    memory_prefix = ""
-
-                time_injection = f"[SYSTEM INFO: Current Time in Bangladesh is {current_time}{hijri_info}.]{memory_prefix}\n\n"
-
-                if retrieved_context:
-                    final_prompt = f"{time_injection}CONTEXT:\n{retrieved_context}\n\nUSER QUESTION: {prompt}"
-                else:
-                    final_prompt = f"{time_injection}USER QUESTION: {prompt}"
-
-                if hasattr(st.session_state, 'chat'):
-                    try:
-                        response = st.session_state.chat.send_message(final_prompt, stream=True)
-                        
-                        def stream_data():
-                            try:
-                                for chunk in response:
-                                    if chunk.text:
-                                        yield chunk.text
-                            except Exception:
-                                pass
-                                    
-                        full_response = message_placeholder.write_stream(stream_data())
-                        
-                        # Properly resolve the stream to prevent iteration errors
-                        try:
-                            response.resolve()
-                        except:
-                            pass
-                            
-                        st.session_state.history.append({"role": "assistant", "content": full_response})
-                        save_chat_to_db(prompt, full_response, user_uid)
-                        
-                    except Exception as e:
-                        # AUTO-HEALING TRIGGERED: Destroy corrupted chat object
-                        if "chat" in st.session_state:
-                            del st.session_state.chat
-                        if "loaded_uid" in st.session_state:
-                            del st.session_state.loaded_uid
-                        # ✅ Also reset the injection flag on auto-heal
-                        if "core_memory_injected" in st.session_state:
-                            del st.session_state.core_memory_injected
-                            
-                        if st.session_state.history and st.session_state.history[-1]["role"] == "user":
-                            st.session_state.history.pop()
-                            
-                        error_msg = str(e).lower()
-                        if "iteration" in error_msg or "resolve" in error_msg:
-                            message_placeholder.error("⚠️ আগের মেসেজটি সম্পূর্ণ হওয়ার আগেই কানেকশন কেটে গিয়েছিল। সিস্টেমটি অটো-ফিক্স করা হয়েছে। অনুগ্রহ করে আপনার মেসেজটি আবার সেন্ড করুন।")
-                        elif "429" in error_msg or "quota" in error_msg:
-                            message_placeholder.warning("⏳ সার্ভারে অনেক চাপ! দয়া করে একটু অপেক্ষা করে আবার প্রশ্ন করুন।")
-                        else:
-                            message_placeholder.error(f"⚠️ সাময়িক সমস্যার কারণে উত্তরটি জেনারেট হতে পারেনি। অনুগ্রহ করে আবার চেষ্টা করুন।\n\nError: {e}")
+                    # The failed turn is rolled back; the next send starts from a fresh chat session.
+                    kind = turn.fail(e)
+                    if kind == "stream":
+                        message_placeholder.error("⚠️ আগের মেসেজটি সম্পূর্ণ হওয়ার আগেই কানেকশন কেটে গিয়েছিল। সিস্টেমটি অটো-ফিক্স করা হয়েছে। অনুগ্রহ করে আপনার মেসেজটি আবার সেন্ড করুন।")
+                    elif kind == "overloaded":
+                        message_placeholder.warning(f"⏳ সার্ভারে অনেক চাপ! আপনার আগে {e.position} জন অপেক্ষায় আছেন। অনুগ্রহ করে {max(5, round(e.wait_s))} সেকেন্ড পরে আবার প্রশ্ন করুন।")
+                    elif kind == "quota":
+                        message_placeholder.warning("⏳ সার্ভারে অনেক চাপ! দয়া করে একটু অপেক্ষা করে আবার প্রশ্ন করুন।")
+                    else:
+                        message_placeholder.error(f"⚠️ সাময়িক সমস্যার কারণে উত্তরটি জেনারেট হতে পারেনি। অনুগ্রহ করে আবার চেষ্টা করুন।\n\nError: {e}")
             except Exception as e:
+                trace.fail(e)
                 message_placeholder.error(f"Processing Error: {e}")
+            finally:
+                # A rerun or stop mid-stream raises past both handlers above; the key lease still goes back.
+                turn.close()
+            st.session_state.last_trace = core.finish_trace(trace)
 
 if __name__ == "__main__":
     main()